@@ -16,27 +16,34 @@ sys.path.append(dirname(__file__))
 
 from stage0 import (
     assert_wav_is_longer_than_lab,
+    audio_index,
     check_lab,
     check_lab_after_segmentation,
     check_wav,
     compare_mono_align_and_mono_score,
     copy_files,
     copy_mono_time_to_full,
+    dag_pipeline,
     finalize_lab_and_wav,
     force_ust_end_with_rest,
     full2mono,
     generate_train_list,
+    incremental_cache,
+    label_cache,
     merge_rest_full_score,
-    merge_rest_mono_align,
     round_lab,
     segment_lab,
+    single_pass,
+    tracing,
     ust2lab,
+    validate,
 )
 
 
 def main(path_config_yaml):
     """
-    ステージ0の各ステップを順に実行する。
+    ログ出力と実行時間の記録を設定してから、ステージ0を実行する。
+    validate モードでは終了コードを返す。
     """
     # ログ出力設定
     stream_handler = logging.StreamHandler()
@@ -50,14 +57,70 @@ def main(path_config_yaml):
     with open(path_config_yaml, encoding='utf-8') as fy:
         config = safe_load(fy)
 
+    # WAVファイルの情報の記録を、子プロセスでも使う。
+    audio_index.enable(audio_index.default_index_path(config))
+
+    # 読み取ったLABファイルをフォルダに保存して、子プロセスや次回の実行でも使う。
+    label_cache_dir = config.get('stage0_label_cache_dir')
+    if label_cache_dir:
+        label_cache.enable(label_cache_dir.strip('"'))
+
+    # 各ステップと曲ごとの処理の、実行時間などを記録する。
+    trace_dir = config.get('stage0_trace_dir')
+    if trace_dir:
+        tracing.enable(trace_dir.strip('"'), profile=config.get('stage0_profile', False))
+    try:
+        with tracing.span('preprocess_data.main'):
+            return run_steps(path_config_yaml, config)
+    finally:
+        if trace_dir:
+            tracing.write_report()
+
+
+def run_steps(path_config_yaml, config):
+    """
+    ステージ0の各ステップを順に実行する。
+    """
+    # 学習用のファイルを作らずに、歌唱DB全体を点検して結果をまとめて出力する。
+    if config.get('stage0_pipeline', 'default') == 'validate':
+        return validate.main(path_config_yaml)
+
+    # 前回から変わった曲だけ処理する。
+    if config.get('stage0_cache', False):
+        incremental_cache.main(path_config_yaml)
+        return
+
     # 既存ファイルを削除する
+    # 歌唱DBからコピーしたファイルとWAVファイルの情報の記録は、
+    # 変わっていなければ再利用できるので残す。(copy_files が変更されたファイルだけ置き換える。)
     out_dir = Path(config['out_dir'])
     if out_dir.exists():
-        print(f'Removing existing output directory: {out_dir}')
-        rmtree(out_dir, ignore_errors=True)
+        print(f'Removing existing output files: {out_dir}')
+        names_to_keep = {*copy_files.TARGET_EXTENSIONS, audio_index.INDEX_NAME}
+        for path in out_dir.iterdir():
+            if path.name in names_to_keep:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
 
     # singing_databaseフォルダ の中にあるファイルを dataフォルダにコピーする。
     copy_files.main(path_config_yaml)
+    # WAVファイルの情報を記録する。変わっていないファイルは前回の記録を使う。
+    audio_index.main(path_config_yaml)
+
+    # 各曲のファイルを一度だけ読み取り、メモリ上で各ステップを実行する。
+    if config.get('stage0_pipeline', 'default') == 'single_pass':
+        single_pass.main(path_config_yaml)
+        generate_train_list.main(path_config_yaml)
+        return
+    # 各ステップを曲ごとのタスクに分けて、1つのプロセスプールで実行する。
+    if config.get('stage0_pipeline', 'default') == 'dag':
+        dag_pipeline.main(path_config_yaml)
+        generate_train_list.main(path_config_yaml)
+        return
+
     # mono_align (labフォルダのファイル) の中の音素の発生時刻が負でないか点検する。
     check_lab.main(path_config_yaml)
     # wavファイルのフォーマットが適切か点検する。
@@ -67,12 +130,10 @@ def main(path_config_yaml):
     # ustファイル を labファイル に変換して、full_score として保存する。
     ust2lab.main(path_config_yaml)
 
-    # mono_align (labフォルダのファイル) の連続する休符を結合する。
-    merge_rest_mono_align.main(path_config_yaml)
     # full_score の連続する休符を結合する。
     merge_rest_full_score.main(path_config_yaml)
 
-    # mono_align (labフォルダのファイル) を丸めて mono_align_round に保存する。
+    # mono_align (labフォルダのファイル) の休符を結合し、丸めて mono_align_round に保存する。
     # full_score を丸めて full_score_round に保存する。
     round_lab.main(path_config_yaml)
 
@@ -109,6 +170,6 @@ def main(path_config_yaml):
 
 if __name__ == '__main__':
     if len(argv) == 1:
-        main('config.yaml')
+        sys.exit(main('config.yaml'))
     else:
-        main(argv[1].strip('"'))
+        sys.exit(main(argv[1].strip('"')))
@@ -94,7 +94,7 @@ if [ ${stage} -le 0 ] && [ ${stop_stage} -ge 0 ]; then
     echo "#  stage 0: Data preparation            #"
     echo "#                                       #"
     echo "========================================="
-    rm -rf $out_dir
+    # out_dir is removed (or updated incrementally) by preprocess_data.py
     rm -f preprocess_data.py.log
     $PYTHON_EXE preprocess_data.py $CONFIG_PATH || exit 1
     echo ""
@@ -1,17 +1,31 @@
 from . import (  # noqa: F401
     assert_wav_is_longer_than_lab,
+    audio_index,
     check_lab,
     check_lab_after_segmentation,
+    compact_label,
     compare_mono_align_and_mono_score,
     copy_files,
     copy_mono_time_to_full,
+    dag_pipeline,
+    file_layout,
     finalize_lab_and_wav,
     force_ust_end_with_rest,
     full2mono,
     generate_train_list,
+    incremental_cache,
+    label_cache,
+    label_check,
     merge_rest_full_score,
     merge_rest_mono_align,
     round_lab,
+    scheduler,
     segment_lab,
+    single_pass,
+    tracing,
     ust2lab,
+    ust_cache,
+    validate,
+    wav_header,
+    wav_segment,
 )
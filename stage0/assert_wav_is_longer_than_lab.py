@@ -4,23 +4,25 @@
 WAVファイルが full_align_lab より長いことを確認する（concurrent.futures 使用）。
 """
 
-import warnings
 from glob import glob
 from logging import warning
 from os.path import join
 from sys import argv
 from typing import Optional
 
-import utaupy
 import yaml
 from natsort import natsorted
 from tqdm.contrib.concurrent import process_map
 
-with warnings.catch_warnings():
-    warnings.simplefilter('ignore')
-    from pydub import AudioSegment
+try:
+    from . import audio_index, label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import label_cache
+    import tracing
 
 
+@tracing.traced
 def check_wav_and_lab_pair(paths: tuple[str, str]) -> Optional[str]:
     """
     WAVとLABのペアを受け取り、WAVが短ければ警告メッセージを返す。
@@ -29,11 +31,11 @@ def check_wav_and_lab_pair(paths: tuple[str, str]) -> Optional[str]:
 
     try:
         # LABファイルの最後の音素の時刻を取得 [sec]
-        label = utaupy.label.load(path_lab)
-        lab_endtime_sec = label[-1].end / 10000000
+        label = label_cache.load(path_lab)
+        lab_endtime_sec = int(label.ends[-1]) / 10000000
 
-        # WAVファイルの長さを取得 [sec]
-        wav_length_sec = AudioSegment.from_file(path_wav, 'wav').duration_seconds
+        # WAVファイルの長さを取得 [sec] (記録した情報かヘッダだけを読み取る)
+        wav_length_sec = audio_index.read_wav_info(path_wav)['duration_seconds']
 
         if wav_length_sec < lab_endtime_sec:
             return f'WAV is shorter than LAB or score. ({path_wav}) ({path_lab})'
@@ -44,6 +46,16 @@ def check_wav_and_lab_pair(paths: tuple[str, str]) -> Optional[str]:
     return None
 
 
+def warn_if_wav_is_shorter_than_lab(path_wav, lab_files: list[str]):
+    """
+    WAVファイルが各LABファイルより短ければ警告する。
+    """
+    for path_lab in lab_files:
+        msg = check_wav_and_lab_pair((path_wav, path_lab))
+        if msg:
+            warning(msg)
+
+
 def compare_wav_and_lab_parallel(wav_dir_in, lab_dir_in):
     """
     concurrent.futures を使って並列に比較
@@ -64,6 +76,7 @@ def compare_wav_and_lab_parallel(wav_dir_in, lab_dir_in):
         warning(msg)
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     configを読み取ってフォルダを指定し、全体の処理を実行する。
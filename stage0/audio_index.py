@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+WAVファイルの情報 (チャンネル数・サンプルレート・ビット深度・フレーム数・長さなど) を
+JSONファイルに記録して、ステージ0の各ステップで共有する。
+
+記録はファイルのパス・サイズ・更新時刻と一緒に保存し、サイズか更新時刻が変わったファイルだけ
+ヘッダを読みなおす。copy_files は更新時刻を保ったままコピーするので、
+音声ファイルが変わっていなければ、再実行時に音声ファイルを読み取らない。
+
+enable() で記録ファイルのパスを指定すると、子プロセスでも read_wav_info() が記録を使う。
+"""
+
+import json
+import logging
+from glob import glob
+from os import environ, replace, stat
+from os.path import abspath, join
+from sys import argv
+
+import yaml
+from natsort import natsorted
+
+try:
+    from . import tracing, wav_header
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+    import wav_header
+
+# 記録ファイルの形式を変えたときに増やす
+INDEX_VERSION = 1
+INDEX_NAME = '.stage0_audio_index.json'
+ENV_INDEX_PATH = 'STAGE0_AUDIO_INDEX'
+
+# プロセスごとに読み込んだ記録。記録ファイルが更新されたら読みなおす。
+_loaded = {'path': None, 'mtime_ns': None, 'entries': {}}
+
+
+def default_index_path(config) -> str:
+    """
+    config で指定された記録ファイルのパスを返す。指定がなければ {out_dir}/.stage0_audio_index.json
+    """
+    path_index = config.get('stage0_audio_index')
+    if path_index:
+        return path_index.strip('"')
+    return join(config['out_dir'].strip('"'), INDEX_NAME)
+
+
+def enable(path_index):
+    """
+    記録ファイルを使うようにする。子プロセスにも引き継ぐ。
+    """
+    environ[ENV_INDEX_PATH] = path_index
+
+
+def load_index(path_index) -> dict:
+    """
+    記録ファイルを読み取って、{WAVファイルの絶対パス: 情報} を返す。
+    ない場合や壊れている場合、形式が古い場合は空にする。
+    """
+    try:
+        with open(path_index, encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index['files']
+
+
+def save_index(path_index, entries: dict):
+    """
+    記録ファイルを保存する。途中で中断しても壊れないように置き換えで保存する。
+    """
+    path_tmp = f'{path_index}.tmp'
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'files': entries}, f, ensure_ascii=False)
+    replace(path_tmp, path_index)
+
+
+def _is_fresh(entry, st) -> bool:
+    """
+    記録がファイルの現在のサイズと更新時刻に一致するかどうかを返す。
+    """
+    return (
+        entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+    )
+
+
+def _read_entry(path_wav, st) -> dict:
+    """
+    WAVファイルのヘッダを読み取って、記録する情報を返す。
+    """
+    info = wav_header.read_wav_info(path_wav)
+    return {**info, 'path': path_wav, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def update_index(path_index, wav_files) -> dict:
+    """
+    指定したWAVファイルの記録を更新して保存し、{WAVファイルの絶対パス: 情報} を返す。
+    サイズか更新時刻が変わったファイルだけヘッダを読みなおす。指定しなかったファイルの記録は消す。
+    """
+    old_entries = load_index(path_index)
+    entries = {}
+    num_updated = 0
+    for path_wav in wav_files:
+        path_wav = abspath(path_wav)
+        st = stat(path_wav)
+        entry = old_entries.get(path_wav)
+        if not _is_fresh(entry, st):
+            entry = _read_entry(path_wav, st)
+            num_updated += 1
+        entries[path_wav] = entry
+    save_index(path_index, entries)
+    logging.info(
+        'WAVファイルの情報を記録しました。(更新: %s, 再利用: %s) (%s)',
+        num_updated,
+        len(entries) - num_updated,
+        path_index,
+    )
+    _loaded.update(path=None, mtime_ns=None, entries={})
+    return entries
+
+
+def _loaded_entries() -> dict:
+    """
+    enable() で指定した記録ファイルの内容を返す。指定されていなければ空にする。
+    """
+    path_index = environ.get(ENV_INDEX_PATH)
+    if not path_index:
+        return {}
+    try:
+        mtime_ns = stat(path_index).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if (_loaded['path'], _loaded['mtime_ns']) != (path_index, mtime_ns):
+        _loaded.update(path=path_index, mtime_ns=mtime_ns, entries=load_index(path_index))
+    return _loaded['entries']
+
+
+def read_wav_info(path_wav) -> dict:
+    """
+    WAVファイルの情報を返す。記録があってサイズと更新時刻が一致すればそれを使い、
+    なければヘッダを読み取る。(wav_header.read_wav_info と同じ形式)
+    """
+    path_wav = abspath(path_wav)
+    st = stat(path_wav)
+    entry = _loaded_entries().get(path_wav)
+    if _is_fresh(entry, st):
+        return dict(entry)
+    return _read_entry(path_wav, st)
+
+
+@tracing.traced
+def main(path_config_yaml):
+    """
+    {out_dir}/wav 内のWAVファイルの記録を更新する。
+    """
+    with open(path_config_yaml, encoding='utf-8') as fy:
+        config = yaml.safe_load(fy)
+    out_dir = config['out_dir'].strip('"')
+    wav_files = natsorted(glob(join(out_dir, 'wav', '*.wav')))
+    print('Indexing WAV files')
+    update_index(default_index_path(config), wav_files)
+
+
+if __name__ == '__main__':
+    main(argv[1].strip('"'))
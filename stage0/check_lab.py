@@ -5,30 +5,34 @@
 
 - 極端に短い音素(5ms以下)がないか
 - 時刻の順序が逆転しているラベルがないか
+
+点検と修正は label_check でファイルごとに並列に行い、
+結果を {out_dir}/check_lab_report.json に保存する。
+すべてのファイルの点検が終わってから修正するので、不具合があるときはどのファイルも書き換えない。
 """
 
-import logging
 import sys
 from glob import glob
 from os.path import dirname, expanduser, join
 from pprint import pprint
 
-import utaupy as up
 import yaml
-from tqdm import tqdm
 
+try:
+    from . import label_check, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import label_check
+    import tracing
 
-def check_lab_files(lab_dir, threshold=0):
+REPORT_NAME = 'check_lab_report.json'
+
+
+def raise_if_invalid(results: list[dict]):
     """
-    発声時間が負でないか点検する。
+    点検に通過しなかったLABファイルがあれば、一覧を表示して例外を送出する。
     """
-    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
-    invalid_lab_files = []
-    for path_mono in tqdm(mono_lab_files):
-        label = up.label.load(path_mono)
-        if not label.is_valid(threshold):
-            invalid_lab_files.append(path_mono)
-    if len(invalid_lab_files) != threshold:
+    invalid_lab_files = label_check.invalid_files(results)
+    if len(invalid_lab_files) != 0:
         print(
             'LABファイルの発声時刻に不具合があります。以下のファイルを点検してください。'
         )
@@ -36,40 +40,47 @@ def check_lab_files(lab_dir, threshold=0):
         raise Exception
 
 
+def save_report(out_dir, results: list[dict]):
+    """
+    label_check の結果を {out_dir}/check_lab_report.json に保存する。
+    """
+    label_check.save_report(
+        join(out_dir, REPORT_NAME),
+        label_check.make_report(results, threshold=0, repair_threshold=5),
+    )
+
+
+def save_report_and_raise_if_invalid(out_dir, results: list[dict]):
+    """
+    点検結果を保存してから、点検に通過しなかったLABファイルがあれば例外を送出する。
+    """
+    save_report(out_dir, results)
+    raise_if_invalid(results)
+
+
+def check_lab_files(lab_dir, threshold=0):
+    """
+    発声時間が負でないか点検する。
+    """
+    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
+    raise_if_invalid(label_check.check_files(mono_lab_files, threshold))
+
+
 def repair_too_short_phoneme(lab_dir, threshold=5) -> None:
     """
     LABファイルの中の発声時刻が短すぎる音素(5ms未満の時とか)を修正する。
     直前の音素の長さを削る。
     一番最初の音素が短い場合のみ修正できない。
     """
-    mono_lab_files = glob(f'{lab_dir}/*.lab')
-    threshold_100ns = threshold * 10000
-    for path_mono in tqdm(mono_lab_files):
-        # LABファイルを読み取る
-        label = up.label.load(path_mono)
-        # 短い音素が一つもない場合はスルー
-        if all(phoneme.duration >= threshold_100ns for phoneme in label):
-            continue
-        # 短い音素が連続しても不具合が起こらないように逆向きにループする
-        if label[0].duration < threshold_100ns:  # pylint: disable=no-member
-            raise ValueError(
-                f'最初の音素が短いです。修正できません。: {label[0]} ({path_mono})'
-            )
-        for i, phoneme in enumerate(reversed(label)):
-            # 発声時間が閾値より短い場合
-            if phoneme.duration < threshold_100ns:
-                logging.info('短い音素を修正します。: %s (%s)', phoneme, path_mono)
-                # 閾値との差分を計算する。この分だけずらす。
-                delta_t = threshold_100ns - phoneme.duration
-                # 対象の音素の開始時刻をずらして、発生時間を伸ばす。
-                phoneme.start -= delta_t
-                # 直前の音素の終了時刻もずらす。
-                # label[-(i + 1) - 1]
-                label[-i - 2].end -= delta_t
-            # 修正済みデータで上書き保存
-            label.write(path_mono)
+    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
+    # 点検せずに修正だけを行う。
+    results = label_check.check_files(mono_lab_files, None, repair_threshold=threshold)
+    for result in results:
+        for problem in result['problems']:
+            raise ValueError(problem['message'])
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     config.yaml から歌唱DBのパスを取得して、
@@ -82,10 +93,14 @@ def main(path_config_yaml):
     config_dir = dirname(path_config_yaml)
     out_dir = expanduser(join(config_dir, config['out_dir'])).strip('"')
     lab_dir = join(out_dir, 'lab')
-    # LABファイルを点検する
+    # すべてのLABファイルを点検してから、短すぎる音素を修正する。
+    # 1つでも不具合があれば、どのファイルも修正しない。
     print(f'Checking LAB files in {lab_dir}')
-    check_lab_files(lab_dir)
-    repair_too_short_phoneme(lab_dir)
+    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
+    results = label_check.check_files(mono_lab_files, threshold=0)
+    if len(label_check.invalid_files(results)) == 0:
+        results = label_check.check_files(mono_lab_files, threshold=None, repair_threshold=5)
+    save_report_and_raise_if_invalid(out_dir, results)
 
 
 if __name__ == '__main__':
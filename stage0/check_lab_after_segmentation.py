@@ -2,6 +2,7 @@
 # Copyright (c) 2021-2025 oatsu
 """
 分割してroundした のあとに、各フォルダに設置したラベルファイルを点検する。
+結果は {out_dir}/check_lab_after_segmentation_report.json に保存する。
 """
 
 import logging
@@ -9,22 +10,41 @@ from glob import glob
 from os.path import dirname, expanduser, join
 from sys import argv
 
-import utaupy as up
 import yaml
-from tqdm import tqdm
 
+try:
+    from . import label_check, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import label_check
+    import tracing
 
-def check_lab_files(lab_dir, threshold=0):
+REPORT_NAME = 'check_lab_after_segmentation_report.json'
+
+
+def _log_invalid_lab_files(results: list[dict]) -> list[str]:
     """
-    発声時間が負でないか点検する。
+    点検に通過しなかったLABファイルをログに出力して、その一覧を返す。
+    """
+    invalid_lab_files = label_check.invalid_files(results)
+    for path_mono in invalid_lab_files:
+        logging.error('LABファイルの発声時刻に不具合があります。(%s)', path_mono)
+    return invalid_lab_files
+
+
+@tracing.traced
+def find_invalid_lab_files(lab_files, threshold=0) -> list[str]:
+    """
+    発声時間が負になっているLABファイルの一覧を返す。(1曲分など、少数のファイル用)
+    """
+    return _log_invalid_lab_files(
+        [label_check.check_file(path_mono, threshold) for path_mono in lab_files]
+    )
+
+
+def raise_if_invalid(invalid_lab_files: list[str]):
+    """
+    不具合のあるLABファイルがあれば例外を送出する。
     """
-    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
-    invalid_lab_files = []
-    for path_mono in tqdm(mono_lab_files):
-        label = up.label.load(path_mono)
-        if not label.is_valid(threshold):
-            invalid_lab_files.append(path_mono)
-            logging.error('LABファイルの発声時刻に不具合があります。(%s)', path_mono)
     if len(invalid_lab_files) != 0:
         message = '  \n'.join(
             ['LABファイルの発声時刻に不具合があります。以下のファイルを点検してください。']
@@ -34,6 +54,15 @@ def check_lab_files(lab_dir, threshold=0):
         raise Exception(message)
 
 
+def check_lab_files(lab_dir, threshold=0) -> list[dict]:
+    """
+    発声時間が負でないか並列に点検して、ファイルごとの結果を返す。
+    """
+    mono_lab_files = sorted(glob(f'{lab_dir}/*.lab'))
+    return label_check.check_files(mono_lab_files, threshold)
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     config.yaml から歌唱DBのパスを取得して、
@@ -45,14 +74,16 @@ def main(path_config_yaml):
     # 歌唱DBのパスを取得する
     config_dir = dirname(path_config_yaml)
     out_dir = expanduser(join(config_dir, config['out_dir'])).strip('"')
-    lab_dir = join(out_dir, 'lab')
     # LABファイルを点検する
+    results = []
     for lab_dir in [
         f'{out_dir}/full_align_round_seg',
         f'{out_dir}/mono_align_round_seg',
     ]:
         print(f'Checking LAB files in {lab_dir}')
-        check_lab_files(lab_dir)
+        results += check_lab_files(lab_dir)
+    label_check.save_report(join(out_dir, REPORT_NAME), label_check.make_report(results))
+    raise_if_invalid(_log_invalid_lab_files(results))
 
 
 if __name__ == '__main__':
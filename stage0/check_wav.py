@@ -10,7 +10,6 @@
 """
 
 import logging
-import warnings
 from glob import glob
 from os.path import join
 from statistics import mode
@@ -20,22 +19,26 @@ import yaml
 from natsort import natsorted
 from tqdm.contrib.concurrent import process_map
 
-with warnings.catch_warnings():
-    warnings.simplefilter('ignore')
-    from pydub import AudioSegment
+try:
+    from . import audio_index, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import tracing
 
 
+@tracing.traced
 def get_audio_info(path_wav):
     """
     各WAVファイルの情報を取得（並列実行される）
+    音声全体は読み込まず、記録した情報かヘッダだけを読み取る。
     """
     try:
-        audio = AudioSegment.from_file(path_wav)
+        info = audio_index.read_wav_info(path_wav)
         return {
             'path': path_wav,
-            'channels': audio.channels,
-            'frame_rate': audio.frame_rate,
-            'sample_width': audio.sample_width,
+            'channels': info['channels'],
+            'frame_rate': info['frame_rate'],
+            'sample_width': info['sample_width'],
         }
     except Exception as e:
         logging.error('ファイル読み込みエラー: %s - %s', path_wav, str(e))
@@ -59,6 +62,16 @@ def check_all_wav_files(wav_dir_in):
     # 並列処理: ProcessPoolExecutor を使用して get_audio_info を並列実行
     audio_info = process_map(get_audio_info, wav_files, colour='blue')
 
+    return validate_audio_info(audio_info)
+
+
+def validate_audio_info(audio_info):
+    """
+    get_audio_info で取得した全音声ファイルの情報を検証する。
+
+    Returns:
+        tuple: (mono_ok, sample_rate_ok, bit_depth_ok)
+    """
     # None（エラー）が含まれていないか
     if any(info is None for info in audio_info):
         return False, False, False
@@ -93,6 +106,23 @@ def check_all_wav_files(wav_dir_in):
     return mono_ok, sample_rate_ok, bit_depth_ok
 
 
+def raise_if_invalid(mono_ok, sample_rate_ok, bit_depth_ok):
+    """
+    検証結果に問題があれば例外を送出する。
+    """
+    if not mono_ok:
+        raise ValueError('モノラルではない音声ファイルがあります。ログを確認して修正して下さい。')
+    if not sample_rate_ok:
+        raise ValueError(
+            'サンプリングレートが異なる音声ファイルがあります。ログを確認して修正して下さい。'
+        )
+    if not bit_depth_ok:
+        raise ValueError(
+            'ビット深度が異なる音声ファイルがあります。ログを確認して修正して下さい。'
+        )
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     全体処理を実行する
@@ -106,17 +136,7 @@ def main(path_config_yaml):
     wav_dir_in = join(out_dir, 'wav')
 
     mono_ok, sample_rate_ok, bit_depth_ok = check_all_wav_files(wav_dir_in)
-
-    if not mono_ok:
-        raise ValueError('モノラルではない音声ファイルがあります。ログを確認して修正して下さい。')
-    if not sample_rate_ok:
-        raise ValueError(
-            'サンプリングレートが異なる音声ファイルがあります。ログを確認して修正して下さい。'
-        )
-    if not bit_depth_ok:
-        raise ValueError(
-            'ビット深度が異なる音声ファイルがあります。ログを確認して修正して下さい。'
-        )
+    raise_if_invalid(mono_ok, sample_rate_ok, bit_depth_ok)
 
     print('All WAV files passed validation')
 
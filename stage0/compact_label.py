@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+配列で保持する軽量なラベル。
+
+utaupy.label.Label は音素ごとに Phoneme オブジェクトを作るため、
+音素数の多いラベルを何度も読み書きするステージ0では遅い。
+CompactLabel は以下の形で保持し、点検・丸め・休符の結合・分割・オフセット修正を
+音素ごとのループではなく配列の演算で行う。
+
+- 発声開始時刻と終了時刻: int64 の NumPy 配列 [100ns]
+- 音素記号: プロセス内で共通の整数コード (フルラベルの場合は p3 の音素記号)
+- コンテキスト (LABファイルの3列目): 改行でつないだ1つの文字列と、各行の開始位置
+
+読み取りと書き出しの結果は utaupy.label と同じになる。
+(utaupy.label.load と同じく各行を split(maxsplit=2) し、Label.write と同じく末尾に改行を付けない。)
+"""
+
+import logging
+import re
+
+import numpy as np
+
+# 休符の音素記号
+REST_SYMBOLS = ('sil', 'pau')
+# context_text 中の、sil だけの行と、pau だけの行の連続
+_SIL_LINE = re.compile('^sil$', re.MULTILINE)
+_REST_LINES = re.compile('^(?:pau\n)+', re.MULTILINE)
+
+# 音素記号とコードの対応表 (プロセス内で共通)
+_SYMBOLS: list[str] = []
+_SYMBOL_CODES: dict[str, int] = {}
+
+
+def symbol_code(symbol: str) -> int:
+    """
+    音素記号に対応する整数コードを返す。未登録の場合は登録する。
+    """
+    code = _SYMBOL_CODES.get(symbol)
+    if code is None:
+        code = len(_SYMBOLS)
+        _SYMBOL_CODES[symbol] = code
+        _SYMBOLS.append(symbol)
+    return code
+
+
+def _phoneme_of_context(context: str) -> str:
+    """
+    フルラベルのコンテキストから音素記号 (p3) を取り出す。
+    モノラベルの場合はそのまま返す。
+    """
+    start = context.find('-')
+    end = context.find('+', start + 1)
+    if start < 0 or end < 0:
+        return context
+    return context[start + 1 : end]
+
+
+class CompactLabel:
+    """
+    発声時刻を NumPy 配列で、コンテキストを1つの文字列で保持するラベル。
+    """
+
+    def __init__(self, starts, ends, context_text: str, context_offsets, codes=None):
+        """
+        starts, ends: 発声開始時刻と終了時刻 [100ns]
+        context_text: 各行のコンテキストを改行でつないで、末尾にも改行を付けた文字列
+        context_offsets: 各行のコンテキストの context_text 内での開始位置 (音素数+1 個)
+        codes: 音素記号のコード。省略した場合は必要になったときに求める。
+        """
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.context_text = context_text
+        self.context_offsets = np.asarray(context_offsets, dtype=np.int64)
+        self._codes = None if codes is None else np.asarray(codes, dtype=np.int32)
+
+    @classmethod
+    def from_lines(cls, starts, ends, contexts: list[str]) -> 'CompactLabel':
+        """
+        発声時刻とコンテキストのリストから作る。
+        """
+        offsets = np.zeros(len(contexts) + 1, dtype=np.int64)
+        np.cumsum([len(context) + 1 for context in contexts], out=offsets[1:])
+        context_text = ''.join(context + '\n' for context in contexts)
+        return cls(starts, ends, context_text, offsets)
+
+    @classmethod
+    def from_label(cls, label) -> 'CompactLabel':
+        """
+        utaupy.label.Label から作る。
+        """
+        return cls.from_lines(
+            [int(phoneme.start) for phoneme in label],
+            [int(phoneme.end) for phoneme in label],
+            [phoneme.symbol for phoneme in label],
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        """
+        スライスの場合は、その範囲の CompactLabel を返す。
+        整数の場合は (開始時刻, 終了時刻, コンテキスト) を返す。
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('CompactLabel のスライスは step=1 のみ対応しています。')
+            stop = max(start, stop)
+            offset_start = int(self.context_offsets[start])
+            return CompactLabel(
+                self.starts[start:stop],
+                self.ends[start:stop],
+                self.context_text[offset_start : int(self.context_offsets[stop])],
+                self.context_offsets[start : stop + 1] - offset_start,
+                None if self._codes is None else self._codes[start:stop],
+            )
+        if index < 0:
+            index += len(self)
+        return (int(self.starts[index]), int(self.ends[index]), self.context(index))
+
+    def __getstate__(self):
+        # 音素記号のコードはプロセスごとに異なるので、pickle するときは含めない。
+        return {
+            'starts': self.starts,
+            'ends': self.ends,
+            'context_text': self.context_text,
+            'context_offsets': self.context_offsets,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def context(self, index: int) -> str:
+        """
+        index 番目の行のコンテキストを返す。
+        """
+        return self.context_text[
+            int(self.context_offsets[index]) : int(self.context_offsets[index + 1]) - 1
+        ]
+
+    @property
+    def contexts(self) -> list[str]:
+        """
+        全行のコンテキストのリスト
+        """
+        if len(self) == 0:
+            return []
+        return self.context_text[:-1].split('\n')
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+        各行の音素記号のコード。フルラベルの場合は p3 の音素記号のコード。
+        """
+        if self._codes is None:
+            self._codes = np.fromiter(
+                (symbol_code(_phoneme_of_context(context)) for context in self.contexts),
+                dtype=np.int32,
+                count=len(self),
+            )
+        return self._codes
+
+    @property
+    def symbols(self) -> list[str]:
+        """
+        各行の音素記号のリスト
+        """
+        return [_SYMBOLS[code] for code in self.codes.tolist()]
+
+    def symbol(self, index: int) -> str:
+        """
+        index 番目の行の音素記号を返す。
+        """
+        return _SYMBOLS[int(self.codes[index])]
+
+    def is_symbol_in(self, symbols) -> np.ndarray:
+        """
+        各行の音素記号が symbols に含まれるかどうかの bool 配列を返す。
+        """
+        codes = self.codes
+        result = np.zeros(len(codes), dtype=bool)
+        # 記号の数は少ないので、np.isin より1つずつ比較するほうが速い。
+        for symbol in symbols:
+            result |= codes == symbol_code(symbol)
+        return result
+
+    @property
+    def durations(self) -> np.ndarray:
+        """
+        各音素の発声時間 [100ns]
+        """
+        return self.ends - self.starts
+
+    def copy(self) -> 'CompactLabel':
+        """
+        発声時刻の配列を複製した CompactLabel を返す。
+        """
+        return CompactLabel(
+            self.starts.copy(),
+            self.ends.copy(),
+            self.context_text,
+            self.context_offsets,
+            self._codes,
+        )
+
+    def to_label(self):
+        """
+        utaupy.label.Label に変換する。
+        """
+        # 必要になったときだけ読み込む
+        from utaupy.label import Label, Phoneme
+
+        label = Label()
+        for start, end, context in zip(self.starts.tolist(), self.ends.tolist(), self.contexts):
+            phoneme = Phoneme()
+            phoneme.start = start
+            phoneme.end = end
+            phoneme.symbol = context
+            label.append(phoneme)
+        return label
+
+    def lines(self) -> list[str]:
+        """
+        LABファイルの各行の文字列のリストを返す。
+        """
+        return [
+            f'{start} {end} {context}'
+            for start, end, context in zip(self.starts.tolist(), self.ends.tolist(), self.contexts)
+        ]
+
+    def to_text(self) -> str:
+        """
+        LABファイルの内容を返す。utaupy.label.Label.write と同じく、末尾に改行を付けない。
+        """
+        return '\n'.join(self.lines())
+
+    def write(self, path_out):
+        """
+        LABファイルを書き出す。
+        """
+        with open(path_out, mode='w', encoding='utf-8', newline='\n') as f:
+            f.write(self.to_text())
+
+    def is_valid(self, threshold=0) -> bool:
+        """
+        発声時間が一定未満の音素や、前後の音素と時刻がつながっていない音素がないか点検する。
+        utaupy.label.Label.is_valid と同じ内容のエラーを出力する。
+
+        threshold: 許容される最小の発声時間(ms)
+        """
+        threshold_100ns = int(threshold * (10**4))
+        starts = self.starts
+        ends = self.ends
+        too_short = np.flatnonzero(ends - starts < threshold_100ns)
+        for i in too_short.tolist():
+            logging.error(
+                '発声時間が %s%s 未満か負です : %s %s', threshold, 'ms', starts[i], ends[i]
+            )
+        if len(self) < 3:
+            return len(too_short) == 0
+        # 最初と最後を除く音素について、前後の音素と時刻が一致するか確認する。
+        start_mismatch = starts[1:-1] != ends[:-2]
+        end_mismatch = ends[1:-1] != starts[2:]
+        mismatch = np.flatnonzero(start_mismatch | end_mismatch) + 1
+        for i in mismatch.tolist():
+            if start_mismatch[i - 1]:
+                logging.error(
+                    '\n'.join(
+                        [
+                            '発声開始時刻が直前の発声終了時刻と一致しません',
+                            f'  previous_phoneme : {starts[i - 1]} {ends[i - 1]}',
+                            f'  current_phoneme  : {starts[i]} {ends[i]}',
+                        ]
+                    )
+                )
+            if end_mismatch[i - 1]:
+                logging.error(
+                    '\n'.join(
+                        [
+                            '発声終了時刻が直後の発声終了時刻と一致しません',
+                            f'  current_phoneme : {starts[i]} {ends[i]}',
+                            f'  next_phoneme    : {starts[i + 1]} {ends[i + 1]}',
+                        ]
+                    )
+                )
+        return len(too_short) == 0 and len(mismatch) == 0
+
+    def round(self, step_size: int):
+        """
+        時刻を丸める。utaupy.label.Label.round と同じく偶数丸めにする。
+        """
+        self.starts = np.rint(self.starts / step_size).astype(np.int64) * step_size
+        self.ends = np.rint(self.ends / step_size).astype(np.int64) * step_size
+
+    def fix_offset(self):
+        """
+        最初の音素の開始時刻がゼロになるように、全体の時刻をずらす。
+        """
+        if len(self) == 0:
+            return
+        dt = self.starts[0]
+        self.starts = self.starts - dt
+        self.ends = self.ends - dt
+
+    def repair_too_short_phonemes(self, threshold=5, path_mono='') -> bool:
+        """
+        発声時間が短すぎる音素(5ms未満の時とか)を、直前の音素を削って伸ばす。
+        一番最初の音素が短い場合のみ修正できない。
+
+        修正したかどうかをboolで返す。
+        """
+        threshold_100ns = threshold * 10000
+        # 短い音素が一つもない場合はスルー
+        if not np.any(self.durations < threshold_100ns):
+            return False
+        if self.ends[0] - self.starts[0] < threshold_100ns:
+            start, end, context = self[0]
+            raise ValueError(
+                f'最初の音素が短いです。修正できません。: {start} {end} {context} ({path_mono})'
+            )
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+        # 短い音素が連続しても不具合が起こらないように逆向きにループする。
+        # 修正は直前の音素にしか影響しないので、最後の短い音素から始める。
+        last = int(np.flatnonzero(self.durations < threshold_100ns)[-1])
+        for i in range(last, -1, -1):
+            duration = ends[i] - starts[i]
+            if duration < threshold_100ns:
+                if i == 0:
+                    raise ValueError(f'最初の音素が短くなりました。修正できません。 ({path_mono})')
+                logging.info(
+                    '短い音素を修正します。: %s %s %s (%s)',
+                    starts[i],
+                    ends[i],
+                    self.context(i),
+                    path_mono,
+                )
+                delta_t = threshold_100ns - duration
+                starts[i] -= delta_t
+                ends[i - 1] -= delta_t
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        return True
+
+    def merge_rests(self) -> 'CompactLabel':
+        """
+        モノラベルの休符を結合した CompactLabel を返す。休符はすべてpauにする。
+        merge_rest_mono_align.merge_rests_mono と同じ結果になる。
+
+        音素記号のコードの配列で休符の連続 (ラン) を求めて、ランごとに1行にまとめる。
+        """
+        if len(self) == 0:
+            return self.copy()
+        # 音素記号だけの行 (sil, pau) を休符とする。フルラベルの行は含めない。
+        line_lengths = np.diff(self.context_offsets)
+        is_rest = self.is_symbol_in(REST_SYMBOLS) & (line_lengths == len('pau\n'))
+        # 直前も休符である休符以外の行が、ランの先頭になる。
+        is_run_start = np.ones(len(self), dtype=bool)
+        is_run_start[1:] = ~(is_rest[1:] & is_rest[:-1])
+        run_starts = np.flatnonzero(is_run_start)
+        run_durations = np.add.reduceat(self.durations, run_starts)
+        new_starts = self.starts[run_starts]
+        new_ends = np.empty_like(new_starts)
+        # 発声終了時刻は直後の音素の開始時刻にする。(Label.reload と同じ)
+        new_ends[:-1] = new_starts[1:]
+        # 最後の音素だけは、結合した休符の発声時間を足す。
+        last = run_starts[-1]
+        new_ends[-1] = self.ends[last] + run_durations[-1] - self.durations[last]
+        # 休符のランは pau にする。sil と pau は同じ長さなので、各行の長さは変わらない。
+        run_is_rest = is_rest[run_starts]
+        new_codes = self.codes[run_starts]
+        new_codes[run_is_rest] = symbol_code('pau')
+        new_offsets = np.zeros(len(run_starts) + 1, dtype=np.int64)
+        np.cumsum(line_lengths[run_starts], out=new_offsets[1:])
+        new_text = _REST_LINES.sub('pau\n', _SIL_LINE.sub('pau', self.context_text))
+        return CompactLabel(new_starts, new_ends, new_text, new_offsets, new_codes)
+
+
+def parse(text: str) -> CompactLabel:
+    """
+    LABファイルの文字列を読み取る。
+    """
+    lines = text.split('\n')
+    # 末尾の空白行を除去
+    while lines and lines[-1].strip() == '':
+        del lines[-1]
+    rows = [line.strip().split(maxsplit=2) for line in lines]
+    starts = np.fromiter((int(row[0]) for row in rows), dtype=np.int64, count=len(rows))
+    ends = np.fromiter((int(row[1]) for row in rows), dtype=np.int64, count=len(rows))
+    return CompactLabel.from_lines(starts, ends, [row[2] for row in rows])
+
+
+def load(path) -> CompactLabel:
+    """
+    LABファイルを読み取る。
+    """
+    with open(str(path).strip('"'), encoding='utf-8') as f:
+        return parse(f.read())
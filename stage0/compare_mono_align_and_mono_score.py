@@ -10,68 +10,282 @@ DB同梱のモノラベルをSinsy出力の音素と一致させる。
 
 import logging
 import statistics
+import sys
+from collections import Counter
+from fractions import Fraction
 from glob import glob
-from itertools import chain
+from math import isqrt
 
 # from os import makedirs
 from os.path import basename
 from sys import argv
 from typing import Union
 
-import utaupy as up
+import numpy as np
 import yaml
 from natsort import natsorted  # type: ignore
-from tqdm import tqdm
+from tqdm.contrib.concurrent import process_map
+
+try:
+    from . import compact_label, label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import compact_label
+    import label_cache
+    import tracing
 
 VOWELS = {'a', 'i', 'u', 'e', 'o', 'A', 'I', 'U', 'E', 'O', 'N'}
+# 前奏と母音の長さの差の許容範囲 (平均値 ± k * 標準偏差) の k。指定がなければ 6 にする。
+OFFSET_SIGMAS = {'strict': 5, 'medium': 6, 'lenient': 7}
+VOWEL_DURATION_SIGMAS = {'strict': 4, 'medium': 5, 'lenient': 6}
+# 母音の長さを点検しない、直後の音素
+SKIP_NEXT_SYMBOLS = ('cl', 'pau')
+# 平方根を正しく丸めるための精度 (statistics モジュールと同じ)
+_SQRT_BIT_WIDTH = 2 * sys.float_info.mant_dig + 3
+
+
+def _sqrt_of_fraction(numerator: int, denominator: int) -> float:
+    """
+    numerator / denominator の平方根を、正しく丸めた float で返す。(statistics.pstdev と同じ)
+    """
+
+    def isqrt_round_to_odd(n, m):
+        root = isqrt(n // m)
+        return root | (root * root * m != n)
+
+    q = (numerator.bit_length() - denominator.bit_length() - _SQRT_BIT_WIDTH) // 2
+    if q >= 0:
+        return (isqrt_round_to_odd(numerator, denominator << 2 * q) << q) / 1
+    return isqrt_round_to_odd(numerator << -2 * q, denominator) / (1 << -q)
+
+
+class DurationStats:
+    """
+    durationの差の統計値を、曲ごとに求めてから合算できる形で保持する。
+
+    個数・合計・二乗和を整数で持つので、平均値と標準偏差は statistics モジュールと同じ値になる。
+    中央値は値ごとの個数から求める。(丸めた後の時刻の差なので、値の種類は少ない。)
+    """
+
+    __slots__ = ('count', 'total', 'total_sq', 'histogram')
+
+    def __init__(self, count=0, total=0, total_sq=0, histogram=None):
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.histogram = Counter() if histogram is None else histogram
+
+    @classmethod
+    def from_differences(cls, duration_differences) -> 'DurationStats':
+        """
+        durationの差の一覧から統計値を求める。
+        """
+        values, counts = np.unique(
+            np.asarray(duration_differences, dtype=np.int64), return_counts=True
+        )
+        values = values.tolist()
+        counts = counts.tolist()
+        return cls(
+            count=sum(counts),
+            total=sum(value * count for value, count in zip(values, counts)),
+            total_sq=sum(value * value * count for value, count in zip(values, counts)),
+            histogram=Counter(dict(zip(values, counts))),
+        )
+
+    def merge(self, other: 'DurationStats') -> 'DurationStats':
+        """
+        2つの統計値を合算した統計値を返す。
+        """
+        return DurationStats(
+            self.count + other.count,
+            self.total + other.total,
+            self.total_sq + other.total_sq,
+            self.histogram + other.histogram,
+        )
+
+    def median(self) -> float:
+        """
+        中央値を返す。個数が偶数の場合は中央の2つの平均値にする。(statistics.median と同じ)
+        """
+        if self.count == 0:
+            raise statistics.StatisticsError('no median for empty data')
+        lower_rank = (self.count - 1) // 2
+        upper_rank = self.count // 2
+        lower = upper = None
+        cumulative_count = 0
+        for value in sorted(self.histogram):
+            cumulative_count += self.histogram[value]
+            if lower is None and cumulative_count > lower_rank:
+                lower = value
+            if cumulative_count > upper_rank:
+                upper = value
+                break
+        if lower == upper:
+            return lower
+        return (lower + upper) / 2
+
+    def mean(self) -> float:
+        """
+        平均値を返す。
+        """
+        if self.count == 0:
+            raise statistics.StatisticsError('mean requires at least one data point')
+        return self.total / self.count
+
+    def pstdev(self) -> float:
+        """
+        母標準偏差を返す。
+        """
+        if self.count == 0:
+            raise statistics.StatisticsError('pstdev requires at least one data point')
+        variance = Fraction(self.count * self.total_sq - self.total**2, self.count**2)
+        return _sqrt_of_fraction(variance.numerator, variance.denominator)
+
+    def median_mean_pstdev(self) -> tuple[int, int, int]:
+        """
+        中央値と平均値と標準偏差を整数にして返す。
+        """
+        return int(self.median()), int(self.mean()), int(self.pstdev())
 
 
-def phoneme_is_ok(path_mono_align_lab, path_mono_score_lab):
+def phoneme_is_ok(
+    path_mono_align_lab, path_mono_score_lab, mono_align_label=None, mono_score_label=None
+):
     """
     音素数と音素記号が一致するかチェックする。
+    Labelオブジェクトを渡した場合はファイルを読み取らない。
     """
-    mono_align_label = up.label.load(path_mono_align_lab)
-    mono_score_label = up.label.load(path_mono_score_lab)
+    if mono_align_label is None:
+        mono_align_label = label_cache.load_label(path_mono_align_lab)
+    if mono_score_label is None:
+        mono_score_label = label_cache.load_label(path_mono_score_lab)
     # 全音素記号が一致したらTrueを返す
     for mono_align_phoneme, mono_score_phoneme in zip(mono_align_label, mono_score_label):
         if mono_align_phoneme.symbol != mono_score_phoneme.symbol:
-            error_message = '\n'.join(
-                [
-                    f'DB同梱のラベルと楽譜から生成したラベルの音素記号が一致しません。({basename(path_mono_align_lab)})',
-                    f'  DB同梱のラベル  : {mono_align_phoneme}\t({path_mono_align_lab})',  # noqa:E501
-                    f'  楽譜からのラベル: {mono_score_phoneme}\t({path_mono_score_lab})',  # noqa:E501
-                ]
+            _log_symbol_mismatch(
+                path_mono_align_lab, path_mono_score_lab, mono_align_phoneme, mono_score_phoneme
             )
-            logging.error(error_message)
             return False
     if len(mono_align_label) != len(mono_score_label):
-        error_message = '\n'.join(
-            [
-                f'DB同梱のラベルと楽譜から生成したラベルの音素数が一致しません。({basename(path_mono_align_lab)})',
-                f'  DB同梱ラベルの音素数    : {len(mono_align_label)}\t({path_mono_align_lab})',  # noqa:E501
-                f'  楽譜からのラベルの音素数: {len(mono_score_label)}\t({path_mono_score_lab})',  # noqa:E501
-            ]
+        _log_count_mismatch(
+            path_mono_align_lab, path_mono_score_lab, len(mono_align_label), len(mono_score_label)
         )
-        logging.error(error_message)
         return False
     return True
 
 
-def force_start_with_zero(path_mono_align_lab):
+def _log_symbol_mismatch(
+    path_mono_align_lab, path_mono_score_lab, mono_align_line, mono_score_line
+):
+    """
+    音素記号が一致しないことを出力する。
+    """
+    error_message = '\n'.join(
+        [
+            f'DB同梱のラベルと楽譜から生成したラベルの音素記号が一致しません。({basename(path_mono_align_lab)})',
+            f'  DB同梱のラベル  : {mono_align_line}\t({path_mono_align_lab})',  # noqa:E501
+            f'  楽譜からのラベル: {mono_score_line}\t({path_mono_score_lab})',  # noqa:E501
+        ]
+    )
+    logging.error(error_message)
+
+
+def _log_count_mismatch(
+    path_mono_align_lab, path_mono_score_lab, mono_align_count, mono_score_count
+):
+    """
+    音素数が一致しないことを出力する。
+    """
+    error_message = '\n'.join(
+        [
+            f'DB同梱のラベルと楽譜から生成したラベルの音素数が一致しません。({basename(path_mono_align_lab)})',
+            f'  DB同梱ラベルの音素数    : {mono_align_count}\t({path_mono_align_lab})',  # noqa:E501
+            f'  楽譜からのラベルの音素数: {mono_score_count}\t({path_mono_score_lab})',  # noqa:E501
+        ]
+    )
+    logging.error(error_message)
+
+
+def _log_offset_outlier(
+    path_mono_align_lab, lower_threshold, upper_threshold, duration_difference
+):
+    """
+    前奏の長さが閾値の範囲外であることを出力する。
+    """
+    warning_message = 'DB同梱のラベルの前奏が楽譜より {} ミリ秒以上早いか、{} ミリ秒以上長いです。({} ms) ({})'.format(  # noqa: E501,UP032
+        round(lower_threshold / 10000),
+        round(upper_threshold / 10000),
+        round(duration_difference / 10000),
+        basename(path_mono_align_lab),
+    )
+    logging.warning(warning_message)
+
+
+def _log_vowel_outlier(
+    path_mono_align_lab,
+    path_mono_score_lab,
+    lower_threshold,
+    upper_threshold,
+    k,
+    duration_difference,
+    previous_symbol,
+    next_symbol,
+    mono_align_line,
+    mono_align_duration,
+    mono_score_line,
+    mono_score_duration,
+):
+    """
+    母音の長さが閾値の範囲外であることを出力する。
+    """
+    warning_message = '\n'.join(
+        [
+            'DB同梱のラベルが楽譜から生成したラベルの母音より {} ミリ秒以上短いか、{} ミリ秒以上長いです。平均値 ± {}σ の範囲外です。({} ms) ({})'.format(  # noqa: E501,UP032
+                round(lower_threshold / 10000),
+                round(upper_threshold / 10000),
+                k,
+                round(duration_difference / 10000),
+                basename(path_mono_align_lab),
+            ),
+            f'  直前の音素: {previous_symbol}',
+            f'  DB同梱のラベル  : {mono_align_line}\t({mono_align_duration / 10000} ms)\t{path_mono_align_lab}',  # noqa: E501
+            f'  楽譜からのラベル: {mono_score_line}\t({mono_score_duration / 10000} ms)\t{path_mono_score_lab}',  # noqa: E501
+            f'  直後の音素: {next_symbol}',
+        ]
+    )
+    logging.warning(warning_message)
+
+
+def force_start_with_zero(path_mono_align_lab, mono_align_label=None):
     """
     最初の音素(pau)の開始時刻を0にする。
     LABの元のiniの、左ブランクとか先行発声が動かされてると0ではなくなってしまうため。
+    ラベル (Label または CompactLabel) を渡した場合はそれを修正し、ファイルには書き出さない。
+    修正後のラベルを返す。
     """
-    mono_align_label = up.label.load(path_mono_align_lab)
-    if mono_align_label[0].start != 0:
+    write_file = mono_align_label is None
+    if write_file:
+        mono_align_label = label_cache.load(path_mono_align_lab)
+    # 音素がない場合は、音素数の不一致として compare_song_labels で報告する。
+    if len(mono_align_label) == 0:
+        return mono_align_label
+    if isinstance(mono_align_label, compact_label.CompactLabel):
+        starts_with_zero = int(mono_align_label.starts[0]) == 0
+    else:
+        starts_with_zero = mono_align_label[0].start == 0
+    if not starts_with_zero:
         warning_message = (
             'DB同梱のラベルの最初の音素開始時刻が0ではありません。'
             f'0に修正して処理を続行します。({basename(path_mono_align_lab)})'
         )
 
         logging.warning(warning_message)
-        mono_align_label[0].start = 0
-        mono_align_label.write(path_mono_align_lab)
+        if isinstance(mono_align_label, compact_label.CompactLabel):
+            mono_align_label.starts[0] = 0
+        else:
+            mono_align_label[0].start = 0
+        if write_file:
+            label_cache.write(mono_align_label, path_mono_align_lab)
+    return mono_align_label
 
 
 def calc_median_mean_pstdev(
@@ -82,35 +296,41 @@ def calc_median_mean_pstdev(
     median: 中央値
     mean  : 平均値
     sigma : 標準偏差
+
+    曲ごとに統計値を求めてから合算するので、全曲のラベルを同時には保持しない。
     """
-    # 全ラベルファイルを読み取る
-    mono_align_label_objects = [up.label.load(path) for path in mono_align_lab_files]
-    mono_score_label_objects = [up.label.load(path) for path in mono_score_lab_files]
-    # Labelのリストを展開してPhonemeのリストにする
-    mono_align_phonemes = list(chain.from_iterable(mono_align_label_objects))
-    mono_score_phonemes = list(chain.from_iterable(mono_score_label_objects))
-    # 母音以外を削除し、直後が休符なものも削除
-    mono_align_phonemes = [
-        phoneme
-        for i, phoneme in enumerate(mono_align_phonemes[:-1])
-        if (phoneme.symbol in vowels) and mono_align_phonemes[i + 1] not in ['cl', 'pau']
-    ]
-    mono_score_phonemes = [
-        phoneme
-        for i, phoneme in enumerate(mono_score_phonemes[:-1])
-        if (phoneme.symbol in vowels) and mono_score_phonemes[i + 1] not in ['cl', 'pau']
-    ]
-    # durationの差の一覧
-    duration_differences = [
+    stats = DurationStats()
+    for path_mono_align, path_mono_score in zip(mono_align_lab_files, mono_score_lab_files):
+        stats = stats.merge(
+            DurationStats.from_differences(
+                vowel_duration_differences(
+                    label_cache.load_label(path_mono_align),
+                    label_cache.load_label(path_mono_score),
+                    vowels,
+                )
+            )
+        )
+    return stats.median_mean_pstdev()
+
+
+def vowel_duration_differences(mono_align_label, mono_score_label, vowels=VOWELS) -> list[int]:
+    """
+    1曲分のラベルについて、ラベルと楽譜の母音のdurationの差の一覧を返す。
+    calc_median_mean_pstdev と同じく、最後の音素は対象外とする。
+    """
+    mono_align_vowels = [phoneme for phoneme in mono_align_label[:-1] if phoneme.symbol in vowels]
+    mono_score_vowels = [phoneme for phoneme in mono_score_label[:-1] if phoneme.symbol in vowels]
+    return [
         ph_align.duration - ph_score.duration
-        for ph_align, ph_score in zip(mono_align_phonemes, mono_score_phonemes)
+        for ph_align, ph_score in zip(mono_align_vowels, mono_score_vowels)
     ]
-    # 中央値
-    return (
-        int(statistics.median(duration_differences)),
-        int(statistics.mean(duration_differences)),
-        int(statistics.pstdev(duration_differences)),
-    )
+
+
+def median_mean_pstdev(duration_differences: list[int]) -> tuple[int, int, int]:
+    """
+    durationの差の一覧から、中央値と平均値と標準偏差を求める。
+    """
+    return DurationStats.from_differences(duration_differences).median_mean_pstdev()
 
 
 def offet_is_ok(
@@ -119,28 +339,29 @@ def offet_is_ok(
     mean_100ns: Union[int, float],
     stdev_100ns: Union[int, float],
     mode: str,
+    mono_align_label=None,
+    mono_score_label=None,
 ) -> bool:
     """
     最初の音素の長さを比較して、閾値以上ずれていたらエラーを返す。
     threshold_ms の目安: 300ms-600ms (5sigma-10sigma)
+    Labelオブジェクトを渡した場合はファイルを読み取らない。
     """
-    k = {'strict': 5, 'medium': 6, 'lenient': 7}.get(mode, 6)
+    k = OFFSET_SIGMAS.get(mode, 6)
     # 単位換算して100nsにする
     upper_threshold = mean_100ns + k * stdev_100ns
     lower_threshold = mean_100ns - k * stdev_100ns
     # labファイルを読み込む
-    mono_align_label = up.label.load(path_mono_align_lab)
-    mono_score_label = up.label.load(path_mono_score_lab)
+    if mono_align_label is None:
+        mono_align_label = label_cache.load_label(path_mono_align_lab)
+    if mono_score_label is None:
+        mono_score_label = label_cache.load_label(path_mono_score_lab)
     # 設定した閾値以上差があるか調べる
     duration_difference = mono_align_label[0].duration - mono_score_label[0].duration
     if not lower_threshold < duration_difference < upper_threshold:
-        warning_message = 'DB同梱のラベルの前奏が楽譜より {} ミリ秒以上早いか、{} ミリ秒以上長いです。({} ms) ({})'.format(  # noqa: E501,UP032
-            round(lower_threshold / 10000),
-            round(upper_threshold / 10000),
-            round(duration_difference / 10000),
-            basename(path_mono_align_lab),
+        _log_offset_outlier(
+            path_mono_align_lab, lower_threshold, upper_threshold, duration_difference
         )
-        logging.warning(warning_message)
         return False
     # 問題なければTrueを返す
     return True
@@ -153,6 +374,8 @@ def vowel_durations_are_ok(
     stdev_100ns: Union[int, float],
     mode: str,
     vowels=VOWELS,
+    mono_align_label=None,
+    mono_score_label=None,
 ) -> bool:
     """
     母音の長さを比較して、楽譜中で歌詞ずれが起きていないかチェックする。
@@ -164,46 +387,217 @@ def vowel_durations_are_ok(
     - 優しめ: 6sigma
     - ふつう: 5sigma
     - 厳しめ: 4sigma
+
+    Labelオブジェクトを渡した場合はファイルを読み取らない。
     """
-    k = {'strict': 4, 'medium': 5, 'lenient': 6}.get(mode, 6)
+    k = VOWEL_DURATION_SIGMAS.get(mode, 6)
     # 単位換算して100nsにする
     upper_threshold = mean_100ns + k * stdev_100ns
     lower_threshold = mean_100ns - k * stdev_100ns
     # labファイルを読み込む
-    mono_align_label = up.label.load(path_mono_align_lab)
-    mono_score_label = up.label.load(path_mono_score_lab)
+    if mono_align_label is None:
+        mono_align_label = label_cache.load_label(path_mono_align_lab)
+    if mono_score_label is None:
+        mono_score_label = label_cache.load_label(path_mono_score_lab)
     ok_flag = True
     # 休符を比較
     for i, (phoneme_align, phoneme_score) in enumerate(
         zip(mono_align_label[:-1], mono_score_label[:-1])
     ):
         duration_difference = phoneme_align.duration - phoneme_score.duration
-        if mono_align_label[i + 1].symbol in ['cl', 'pau']:
+        if mono_align_label[i + 1].symbol in SKIP_NEXT_SYMBOLS:
             continue
         if (
             phoneme_align.symbol in vowels
             and not lower_threshold < duration_difference < upper_threshold
         ):
-            warning_message = '\n'.join(
-                [
-                    'DB同梱のラベルが楽譜から生成したラベルの母音より {} ミリ秒以上短いか、{} ミリ秒以上長いです。平均値 ± {}σ の範囲外です。({} ms) ({})'.format(  # noqa: E501,UP032
-                        round(lower_threshold / 10000),
-                        round(upper_threshold / 10000),
-                        k,
-                        round(duration_difference / 10000),
-                        basename(path_mono_align_lab),
-                    ),
-                    f'  直前の音素: {mono_align_label[i - 1].symbol}',
-                    f'  DB同梱のラベル  : {phoneme_align}\t({phoneme_align.duration / 10000} ms)\t{path_mono_align_lab}',  # noqa: E501
-                    f'  楽譜からのラベル: {phoneme_score}\t({phoneme_score.duration / 10000} ms)\t{path_mono_score_lab}',  # noqa: E501
-                    f'  直後の音素: {mono_align_label[i + 1].symbol}',
-                ]
+            _log_vowel_outlier(
+                path_mono_align_lab,
+                path_mono_score_lab,
+                lower_threshold,
+                upper_threshold,
+                k,
+                duration_difference,
+                mono_align_label[i - 1].symbol,
+                mono_align_label[i + 1].symbol,
+                phoneme_align,
+                phoneme_align.duration,
+                phoneme_score,
+                phoneme_score.duration,
             )
-            logging.warning(warning_message)
             ok_flag = False
     return ok_flag
 
 
+@tracing.traced
+def compare_one_song(path_mono_align_lab, path_mono_score_lab) -> tuple[bool, list[int]]:
+    """
+    1曲分のラベルについて、最初の音素の開始時刻を0にしてから音素記号を比較する。
+    (音素記号が一致したか, 母音のdurationの差の一覧) を返す。
+    """
+    force_start_with_zero(path_mono_align_lab)
+    mono_align_label = label_cache.load_label(path_mono_align_lab)
+    mono_score_label = label_cache.load_label(path_mono_score_lab)
+    if not phoneme_is_ok(
+        path_mono_align_lab,
+        path_mono_score_lab,
+        mono_align_label=mono_align_label,
+        mono_score_label=mono_score_label,
+    ):
+        return False, []
+    return True, vowel_duration_differences(mono_align_label, mono_score_label)
+
+
+@tracing.traced
+def check_durations_of_one_song(
+    path_mono_align_lab,
+    path_mono_score_lab,
+    mean_100ns: Union[int, float],
+    stdev_100ns: Union[int, float],
+    mode: str,
+) -> bool:
+    """
+    1曲分のラベルについて、前奏の長さを点検し、問題なければ母音の長さも点検する。
+    前奏の長さに問題がなかったかどうかを返す。
+    """
+    mono_align_label = label_cache.load_label(path_mono_align_lab)
+    mono_score_label = label_cache.load_label(path_mono_score_lab)
+    kwargs = {'mono_align_label': mono_align_label, 'mono_score_label': mono_score_label}
+    if not offet_is_ok(
+        path_mono_align_lab, path_mono_score_lab, mean_100ns, stdev_100ns, mode, **kwargs
+    ):
+        return False
+    vowel_durations_are_ok(
+        path_mono_align_lab, path_mono_score_lab, mean_100ns, stdev_100ns, mode, **kwargs
+    )
+    return True
+
+
+def compare_song_labels(mono_align_label, mono_score_label, vowels=VOWELS) -> dict:
+    """
+    extract_song_durations の本体。読み取り済みの CompactLabel どうしを比較する。
+    ログは出力しない。音素記号が一致しない最初の位置を mismatch_index に入れる。(なければ None)
+    """
+    n_common = min(len(mono_align_label), len(mono_score_label))
+    mismatches = np.flatnonzero(
+        mono_align_label.codes[:n_common] != mono_score_label.codes[:n_common]
+    )
+    # どちらかのラベルに音素がない場合は、音素数が一致しないものとして扱う。
+    is_empty = n_common == 0
+    result = {
+        'phoneme_is_ok': (
+            len(mismatches) == 0
+            and len(mono_align_label) == len(mono_score_label)
+            and not is_empty
+        ),
+        'mismatch_index': int(mismatches[0]) if len(mismatches) > 0 else None,
+        'offset_difference': (
+            None
+            if is_empty
+            else int(mono_align_label.durations[0] - mono_score_label.durations[0])
+        ),
+        'stats': DurationStats(),
+        'vowel_indices': np.zeros(0, dtype=np.int64),
+        'vowel_differences': np.zeros(0, dtype=np.int64),
+    }
+    if not result['phoneme_is_ok']:
+        return result
+    # 音素記号が一致しているので、同じ位置の音素どうしを比較できる。
+    duration_differences = mono_align_label.durations - mono_score_label.durations
+    is_vowel = mono_align_label.is_symbol_in(vowels)[:-1]
+    result['stats'] = DurationStats.from_differences(duration_differences[:-1][is_vowel])
+    is_checked = is_vowel & ~mono_align_label.is_symbol_in(SKIP_NEXT_SYMBOLS)[1:]
+    result['vowel_indices'] = np.flatnonzero(is_checked)
+    result['vowel_differences'] = duration_differences[result['vowel_indices']]
+    return result
+
+
+@tracing.traced
+def extract_song_durations(paths, vowels=VOWELS) -> dict:
+    """
+    1曲分のラベルを一度だけ読み取って、点検に使う値を配列で返す。(並列処理用)
+    mono_align の最初の音素の開始時刻が0でなければ、0にしてファイルに書き出す。
+    音素記号か音素数が一致しなければ、phoneme_is_ok と同じくエラーを出力する。
+
+    phoneme_is_ok      : 音素記号と音素数が一致したか
+    mismatch_index     : 音素記号が一致しない最初の位置 (なければ None)
+    offset_difference  : 最初の音素の長さの差 (どちらかのラベルに音素がなければ None)
+    stats              : 母音のdurationの差の統計値 (DurationStats)
+    vowel_indices      : 母音の長さを点検する音素の位置 (直後が cl, pau の母音と、最後の音素を除く)
+    vowel_differences  : vowel_indices の位置のdurationの差
+    """
+    path_mono_align_lab, path_mono_score_lab = paths
+    mono_align_label = force_start_with_zero(path_mono_align_lab)
+    mono_score_label = label_cache.load(path_mono_score_lab)
+    result = compare_song_labels(mono_align_label, mono_score_label, vowels)
+    i = result['mismatch_index']
+    if i is not None:
+        _log_symbol_mismatch(
+            path_mono_align_lab,
+            path_mono_score_lab,
+            mono_align_label.lines()[i],
+            mono_score_label.lines()[i],
+        )
+    elif not result['phoneme_is_ok']:
+        _log_count_mismatch(
+            path_mono_align_lab, path_mono_score_lab, len(mono_align_label), len(mono_score_label)
+        )
+    return result
+
+
+def vowel_outliers(
+    song_durations: dict, lower_threshold, upper_threshold
+) -> list[tuple[int, int]]:
+    """
+    extract_song_durations の結果から、durationの差が閾値の範囲外の母音を探して、
+    (音素の位置, durationの差) のリストを返す。
+    """
+    differences = song_durations['vowel_differences']
+    is_outlier = ~((lower_threshold < differences) & (differences < upper_threshold))
+    return list(
+        zip(song_durations['vowel_indices'][is_outlier].tolist(), differences[is_outlier].tolist())
+    )
+
+
+def log_vowel_outliers(
+    path_mono_align_lab, path_mono_score_lab, song_durations: dict, mean_100ns, stdev_100ns, mode
+) -> bool:
+    """
+    extract_song_durations の結果を使って、vowel_durations_are_ok と同じ点検をする。
+    範囲外の母音がある場合だけ、警告を出力するためにラベルを読み取る。
+    """
+    k = VOWEL_DURATION_SIGMAS.get(mode, 6)
+    upper_threshold = mean_100ns + k * stdev_100ns
+    lower_threshold = mean_100ns - k * stdev_100ns
+    outliers = vowel_outliers(song_durations, lower_threshold, upper_threshold)
+    if len(outliers) == 0:
+        return True
+    mono_align_label = label_cache.load(path_mono_align_lab)
+    mono_score_label = label_cache.load(path_mono_score_lab)
+    mono_align_lines = mono_align_label.lines()
+    mono_score_lines = mono_score_label.lines()
+    mono_align_symbols = mono_align_label.symbols
+    mono_align_durations = mono_align_label.durations.tolist()
+    mono_score_durations = mono_score_label.durations.tolist()
+    for i, duration_difference in outliers:
+        _log_vowel_outlier(
+            path_mono_align_lab,
+            path_mono_score_lab,
+            lower_threshold,
+            upper_threshold,
+            k,
+            duration_difference,
+            mono_align_symbols[i - 1],
+            mono_align_symbols[i + 1],
+            mono_align_lines[i],
+            mono_align_durations[i],
+            mono_score_lines[i],
+            mono_score_durations[i],
+        )
+    return False
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     全体の処理をやる。
@@ -215,32 +609,39 @@ def main(path_config_yaml):
     mono_score_files = natsorted(glob(f'{out_dir}/mono_score_round/*.lab'))
     duration_check_mode = config['vowel_duration_check']
 
-    # mono_align_labの最初の音素が時刻0から始まるようにする。
-    print('Overwriting mono-align-LAB so that it starts with zero.')
-    for path_mono_align in tqdm(mono_align_files):
-        force_start_with_zero(path_mono_align)
-
-    # 音素記号や最初の休符の長さが一致するか確認する。
+    # mono_align_labの最初の音素が時刻0から始まるようにしてから、
+    # 音素記号を比較し、点検に使うdurationの差を曲ごとに取り出す。
     print('Comparing mono-align-LAB and mono-score-LAB')
-    invalid_basenames = []
-    for path_mono_align, path_mono_score in zip(tqdm(mono_align_files), mono_score_files):
-        if not phoneme_is_ok(path_mono_align, path_mono_score):
-            invalid_basenames.append(basename(path_mono_align))
+    pairs = list(zip(mono_align_files, mono_score_files))
+    results = process_map(
+        extract_song_durations, pairs, colour='blue', chunksize=max(1, len(pairs) // 64)
+    )
+    invalid_basenames = [
+        basename(path_mono_align)
+        for (path_mono_align, _), result in zip(pairs, results)
+        if not result['phoneme_is_ok']
+    ]
 
     # 母音のdurationの統計値を取得
     print('Calculating median, mean and stdev of duration difference')
-    _, mean_100ns, stdev_100ns = calc_median_mean_pstdev(mono_align_files, mono_score_files)
+    stats = DurationStats()
+    for result in results:
+        stats = stats.merge(result['stats'])
+    _, mean_100ns, stdev_100ns = stats.median_mean_pstdev()
 
     # 前奏の長さを点検
     print('Checking first pau duration')
-    for path_mono_align, path_mono_score in zip(tqdm(mono_align_files), mono_score_files):
-        if not offet_is_ok(
-            path_mono_align,
-            path_mono_score,
-            mean_100ns,
-            stdev_100ns,
-            mode=duration_check_mode,
-        ):
+    k = OFFSET_SIGMAS.get(duration_check_mode, 6)
+    upper_threshold = mean_100ns + k * stdev_100ns
+    lower_threshold = mean_100ns - k * stdev_100ns
+    for (path_mono_align, _), result in zip(pairs, results):
+        # 音素がないラベルは、音素数の不一致として記録済み。
+        if result['offset_difference'] is None:
+            continue
+        if not lower_threshold < result['offset_difference'] < upper_threshold:
+            _log_offset_outlier(
+                path_mono_align, lower_threshold, upper_threshold, result['offset_difference']
+            )
             invalid_basenames.append(basename(path_mono_align))
     if len(invalid_basenames) > 0:
         raise Exception(
@@ -250,10 +651,11 @@ def main(path_config_yaml):
 
     # 音素長をチェックする。
     print('Comparing mono-align-LAB durations and mono-score-LAB durations')
-    for path_mono_align, path_mono_score in zip(tqdm(mono_align_files), mono_score_files):
-        vowel_durations_are_ok(
+    for (path_mono_align, path_mono_score), result in zip(pairs, results):
+        log_vowel_outliers(
             path_mono_align,
             path_mono_score,
+            result,
             mean_100ns,
             stdev_100ns,
             mode=duration_check_mode,
@@ -3,28 +3,119 @@
 """
 歌唱DBから必要そうなファイルを全てコピーする。
 USTとMusicXMLとLABとWAVとINI
+
+歌唱DBのフォルダは一度だけ走査して、拡張子ごとに振り分ける。除外する曲のファイルはコピーしない。
+コピー先にサイズと更新時刻が同じファイルがあればコピーしない。(更新時刻を保ったままコピーする。)
+
+config の stage0_copy_mode で配置方法を選ぶ。[copy, hardlink, reflink, symlink]
+hardlink と symlink は WAV ファイルだけに使い、ほかのファイルはコピーする。
+(UST や LAB は後の処理で上書きすることがあり、リンクだと歌唱DBのファイルが書き換わるため。)
 """
 
 import shutil
-from glob import glob
-from os import makedirs
-from os.path import expanduser, join
+from os import listdir, makedirs, remove, stat, walk
+from os.path import basename, expanduser, isdir, islink, join, samefile, splitext
 from sys import argv
 
 import yaml
-from tqdm import tqdm
+from tqdm.contrib.concurrent import thread_map
+
+try:
+    from . import file_layout, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import file_layout
+    import tracing
+
+TARGET_EXTENSIONS = ('wav', 'xml', 'musicxml', 'ust', 'ini', 'lab')
+# 後の処理で書き換えないので、リンクにしてよいファイルの拡張子
+LINKABLE_EXTENSIONS = ('wav',)
+
+
+def find_target_files(db_root, extensions=TARGET_EXTENSIONS, exclude_songs=()) -> dict:
+    """
+    歌唱DBのフォルダを一度だけ走査して、{拡張子: ファイルのリスト} を返す。
+    glob と同じく、'.' で始まるフォルダとファイルは含めず、見つかった順に並べる。
+    拡張子は大文字と小文字を区別しない。(Windows の glob と同じく、.WAV なども含める。)
+    除外する曲 (拡張子を除いたファイル名が exclude_songs にあるもの) は含めない。
+    """
+    exclude_songs = set(exclude_songs)
+    target_files = {ext: [] for ext in extensions}
+    for dirpath, dirnames, filenames in walk(db_root, followlinks=True):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            stem, ext = splitext(filename)
+            ext = ext[1:].lower()
+            if ext in target_files and stem not in exclude_songs:
+                target_files[ext].append(join(dirpath, filename))
+    return target_files
+
+
+def is_up_to_date(path_src, path_dst) -> bool:
+    """
+    コピー先のファイルのサイズと更新時刻がコピー元と同じかどうかを返す。
+    """
+    try:
+        st_dst = stat(path_dst)
+    except FileNotFoundError:
+        return False
+    st_src = stat(path_src)
+    return (st_src.st_size, st_src.st_mtime_ns) == (st_dst.st_size, st_dst.st_mtime_ns)
+
+
+def _place_one_file(src_and_dst, mode) -> bool:
+    """
+    1ファイルをコピーする (並列処理用)。変更がなくコピーしなかった場合は False を返す。
+    """
+    path_src, path_dst = src_and_dst
+    # 複製を指定した場合は、前回リンクとして配置したファイルを置き換える。
+    if is_up_to_date(path_src, path_dst) and not (
+        mode in ('copy', 'reflink') and samefile(path_src, path_dst)
+    ):
+        return False
+    file_layout.place_file(path_src, path_dst, mode, copy_function=shutil.copy2)
+    if mode == 'reflink':
+        shutil.copystat(path_src, path_dst)
+    return True
 
 
-def copy_target_files(db_root, out_dir, ext):
+def copy_target_files(target_files: list, out_dir, ext, mode='copy'):
     """
-    拡張子を指定して、ファイルを複製する。
+    拡張子ごとのフォルダにファイルを複製する。
+    同名のファイルが複数ある場合は、後に見つかったものを使う。(拡張子の大文字と小文字は区別しない)
+    コピー先のファイルの拡張子は ext (小文字) にそろえる。
+    コピー先のフォルダにある、コピー元のないファイルは削除する。
     """
-    target_files = glob(f'{db_root}/**/*.{ext}', recursive=True)
-    if len(target_files) != 0:
-        makedirs(join(out_dir, ext), exist_ok=True)
-        print(f'Copying {ext} files')
-        for path in tqdm(target_files):
-            shutil.copy2(path, join(out_dir, ext))
+    dst_dir = join(out_dir, ext)
+    if ext not in LINKABLE_EXTENSIONS and mode in ('hardlink', 'symlink'):
+        mode = 'copy'
+    # コピー先のパスごとにまとめる (後に見つかったものを使う)
+    src_by_dst = {}
+    for path_src in target_files:
+        # 後の処理は小文字の拡張子でファイルを探すので、拡張子は小文字にそろえる。
+        path_dst = join(dst_dir, f'{splitext(basename(path_src))[0]}.{ext}')
+        src_by_dst.pop(path_dst, None)
+        src_by_dst[path_dst] = path_src
+    # 前回の実行で置いたファイルのうち、不要になったものを消す。
+    if isdir(dst_dir):
+        for filename in listdir(dst_dir):
+            path_dst = join(dst_dir, filename)
+            # フォルダは前回の実行で置いたものではないので消さない。
+            if path_dst not in src_by_dst and not (isdir(path_dst) and not islink(path_dst)):
+                remove(path_dst)
+    if len(src_by_dst) == 0:
+        return
+    makedirs(dst_dir, exist_ok=True)
+    print(f'Copying {ext} files ({mode})')
+    results = thread_map(
+        lambda pair: _place_one_file(pair, mode),
+        [(path_src, path_dst) for path_dst, path_src in src_by_dst.items()],
+        colour='blue',
+    )
+    num_skipped = results.count(False)
+    if num_skipped != 0:
+        print(f'Skipped {num_skipped} unchanged {ext} files')
 
 
 def make_gitignore(out_dir):
@@ -36,6 +127,17 @@ def make_gitignore(out_dir):
         f.write('*\n')
 
 
+def copy_mode(config) -> str:
+    """
+    config で指定されたファイルの配置方法を返す。
+    """
+    mode = config.get('stage0_copy_mode') or 'copy'
+    if mode not in file_layout.COPY_MODES:
+        raise ValueError(f'stage0_copy_mode must be one of {file_layout.COPY_MODES}: {mode}')
+    return mode
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     設定ファイルを読み取って、使いそうなファイルを複製する。
@@ -47,14 +149,16 @@ def main(path_config_yaml):
     db_root = expanduser(config['db_root']).strip('"')
     # ファイルのコピー先を取得
     out_dir = config['out_dir'].strip('"')
+    mode = copy_mode(config)
 
     make_gitignore(out_dir)
     # 移動元と移動先を標準出力
     print(f'Copy files from "{db_root}" to "{out_dir}"')
+    # 歌唱DBのフォルダを一度だけ走査して、除外する曲以外のファイルを探す
+    target_files = find_target_files(db_root, exclude_songs=config.get('exclude_songs') or ())
     # ファイルをコピー
-    target_extensions = ('wav', 'xml', 'musicxml', 'ust', 'ini', 'lab')
-    for ext in target_extensions:
-        copy_target_files(db_root, out_dir, ext)
+    for ext in TARGET_EXTENSIONS:
+        copy_target_files(target_files[ext], out_dir, ext, mode)
 
 
 if __name__ == '__main__':
@@ -5,24 +5,33 @@ DBのモノラベルの時刻をフルラベルに書き写して、
 音声ファイルの発声時刻に合ったフルラベルを生成する。
 
 音素数と音素が完全に一致している前提で処理する。
+
+ファイルを処理するときは、フルラベルのコンテキストの文字列には手を加えず、
+発声時刻の配列だけを置き換えて書き出す。
 """
 
+from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import basename
 from sys import argv
 
-import utaupy as up
 import yaml
-from tqdm import tqdm
+from tqdm.contrib.concurrent import process_map
 
+try:
+    from . import compact_label, label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import compact_label
+    import label_cache
+    import tracing
 
-def copy_mono_align_time_to_full(path_mono_align_in, path_full_score_in, path_full_align_out):
+
+def copy_mono_align_time_to_full_label(mono_align_label, full_label):
     """
-    モノラベルの発声時刻をフルラベルにコピーする。
+    モノラベルのLabelオブジェクトの発声時刻を、フルラベルのLabelオブジェクトにコピーする。
+    フルラベルは上書きされる。
     """
-    mono_align_label = up.label.load(path_mono_align_in)
-    full_label = up.label.load(path_full_score_in)
     # ラベル内の各行を比較する。
     for ph_mono_align, ph_full in tuple(zip(mono_align_label, full_label))[:-1]:
         # 発声開始時刻を上書き
@@ -35,11 +44,54 @@ def copy_mono_align_time_to_full(path_mono_align_in, path_full_score_in, path_fu
     if mono_align_label[-1].symbol not in ['pau', 'sil']:
         print(mono_align_label[-1].symbol)
         full_label[-1].end = mono_align_label[-1].end
+    return full_label
+
+
+def copy_mono_align_time_to_compact_label(mono_align_label, full_label):
+    """
+    CompactLabel 用の copy_mono_align_time_to_full_label。
+    フルラベルのコンテキストはそのまま共有して、発声時刻だけを置き換えた CompactLabel を返す。
+    """
+    # zip と同じく短いほうに合わせて、最後の行以外の時刻をコピーする。
+    n_copy = max(min(len(mono_align_label), len(full_label)) - 1, 0)
+    starts = full_label.starts.copy()
+    ends = full_label.ends.copy()
+    starts[:n_copy] = mono_align_label.starts[:n_copy]
+    ends[:n_copy] = mono_align_label.ends[:n_copy]
+    # 最後のノートは休符だったら終了時刻は楽譜に合わせる。
+    # そうじゃなかったら手動ラベルに合わせる。
+    starts[-1] = mono_align_label.starts[-1]
+    last_symbol = mono_align_label.context(len(mono_align_label) - 1)
+    if last_symbol not in ['pau', 'sil']:
+        print(last_symbol)
+        ends[-1] = mono_align_label.ends[-1]
+    return compact_label.CompactLabel(
+        starts, ends, full_label.context_text, full_label.context_offsets, full_label._codes
+    )
 
+
+@tracing.traced
+def copy_mono_align_time_to_full(path_mono_align_in, path_full_score_in, path_full_align_out):
+    """
+    モノラベルの発声時刻をフルラベルにコピーする。
+    """
+    mono_align_label = label_cache.load(path_mono_align_in)
+    full_label = label_cache.load(path_full_score_in)
+    full_label = copy_mono_align_time_to_compact_label(mono_align_label, full_label)
     # ファイル出力
-    full_label.write(path_full_align_out)
+    label_cache.write(full_label, path_full_align_out)
 
 
+def _copy_one_song(paths, full_align_dir):
+    """
+    copy_mono_align_time_to_full の並列処理用
+    """
+    path_mono_align, path_full_score = paths
+    path_full_align = f'{full_align_dir}/{basename(path_full_score)}'
+    copy_mono_align_time_to_full(path_mono_align, path_full_score, path_full_align)
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     モノラベルとフルラベルのファイルを取得して処理を実行する。
@@ -61,9 +113,13 @@ def main(path_config_yaml):
         'Copying times of mono-LAB (mono_align_round) to '
         'full-LAB (full_score_round) and save into full_align_round'
     )
-    for path_mono_align, path_full_score in zip(tqdm(mono_align_files), full_score_files):
-        path_full_align = f'{full_align_dir}/{basename(path_full_score)}'
-        copy_mono_align_time_to_full(path_mono_align, path_full_score, path_full_align)
+    pairs = list(zip(mono_align_files, full_score_files))
+    process_map(
+        partial(_copy_one_song, full_align_dir=full_align_dir),
+        pairs,
+        colour='blue',
+        chunksize=max(1, len(pairs) // 64),
+    )
 
 
 if __name__ == '__main__':
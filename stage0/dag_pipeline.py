@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+ステージ0の各ステップを曲ごとのタスクに分けて、1つのプロセスプールで実行する。
+
+通常のステージ0と同じファイルを読み書きするが、ステップごとに全曲の完了を待たない。
+各曲は以下の順に、ほかの曲とは独立して処理される。
+
+check_lab (点検) → check_lab (修正)
+→ merge_rest_mono_align と round_lab(mono_align) (1つのタスクで行う)
+force_ust_end_with_rest → ust2lab → merge_rest_full_score → round_lab(full_score) → full2mono
+→ compare_mono_align_and_mono_score → copy_mono_time_to_full
+→ assert_wav_is_longer_than_lab → segment_lab → check_lab_after_segmentation
+→ finalize_lab_and_wav
+
+全曲の結果が必要な点検 (check_lab, check_wav, 母音のdurationの統計値) だけは、
+全曲分のタスクが終わるのを待ってから親プロセスで実行する。
+LABファイルの修正と copy_mono_time_to_full 以降は、全曲の点検に通過してから行う。
+"""
+
+from os import makedirs
+from os.path import join
+from pathlib import Path
+from sys import argv
+
+import yaml
+from natsort import natsorted
+
+try:
+    from . import (
+        assert_wav_is_longer_than_lab,
+        check_lab,
+        check_lab_after_segmentation,
+        check_wav,
+        compare_mono_align_and_mono_score,
+        copy_mono_time_to_full,
+        file_layout,
+        finalize_lab_and_wav,
+        force_ust_end_with_rest,
+        full2mono,
+        label_check,
+        merge_rest_full_score,
+        round_lab,
+        segment_lab,
+        tracing,
+        ust2lab,
+    )
+    from .scheduler import ResultOf, TaskGraph
+except ImportError:  # スクリプトとして実行した場合
+    import assert_wav_is_longer_than_lab
+    import check_lab
+    import check_lab_after_segmentation
+    import check_wav
+    import compare_mono_align_and_mono_score
+    import copy_mono_time_to_full
+    import file_layout
+    import finalize_lab_and_wav
+    import force_ust_end_with_rest
+    import full2mono
+    import label_check
+    import merge_rest_full_score
+    import round_lab
+    import segment_lab
+    import tracing
+    import ust2lab
+    from scheduler import ResultOf, TaskGraph
+
+# 途中ファイルと学習用ファイルの出力先フォルダ
+OUTPUT_SUBDIRS = (
+    'full_score',
+    'mono_align_round',
+    'full_score_round',
+    'mono_score_round',
+    'full_align_round',
+    'mono_score_round_seg',
+    'full_score_round_seg',
+    'mono_align_round_seg',
+    'full_align_round_seg',
+    'timelag/label_phone_align',
+    'timelag/label_phone_score',
+    'duration/label_phone_align',
+    'acoustic/wav',
+    'acoustic/label_phone_align',
+    'acoustic/label_phone_score',
+)
+
+
+def _ust_to_full_score(path_ust, full_score_dir, path_table):
+    """
+    force_ust_end_with_rest と ust2lab を1つのタスクで実行して、USTの解析を一度で済ませる。
+    """
+    force_ust_end_with_rest.force_ust_file_end_with_rest(path_ust)
+    ust2lab._convert_one_ust_file(path_ust, None, full_score_dir, path_table, [])
+
+
+def _raise_if_wav_is_invalid(audio_info):
+    """
+    check_wav の結果を確認する。
+    """
+    check_wav.raise_if_invalid(*check_wav.validate_audio_info(audio_info))
+
+
+def _calc_mean_pstdev(compare_results):
+    """
+    各曲の母音のdurationの差から、平均値と標準偏差を求める。
+    """
+    duration_differences = []
+    for _, duration_differences_in_song in compare_results:
+        duration_differences += duration_differences_in_song
+    _, mean_100ns, stdev_100ns = compare_mono_align_and_mono_score.median_mean_pstdev(
+        duration_differences
+    )
+    return mean_100ns, stdev_100ns
+
+
+def _check_durations(path_mono_align, path_mono_score, mean_and_stdev, mode):
+    """
+    統計値を使って、1曲分の前奏と母音の長さを点検する。(並列処理用)
+    """
+    mean_100ns, stdev_100ns = mean_and_stdev
+    return compare_mono_align_and_mono_score.check_durations_of_one_song(
+        path_mono_align, path_mono_score, mean_100ns, stdev_100ns, mode
+    )
+
+
+def _raise_if_labels_do_not_match(compare_results, duration_check_results):
+    """
+    compare_mono_align_and_mono_score の結果を確認する。
+    """
+    phoneme_results = [phoneme_is_ok for phoneme_is_ok, _ in compare_results]
+    if not all(phoneme_results) or not all(duration_check_results):
+        raise Exception(
+            'DBから生成したラベルと楽譜から生成したラベルに不整合があります。'
+            'ログファイルを参照して修正して下さい。'
+        )
+
+
+def _check_segments(out_dir, segments):
+    """
+    1曲分の分割後のラベルを点検して、不具合のあるファイルの一覧を返す。(並列処理用)
+    segments: segment_lab._process_one_song の戻り値
+    """
+    lab_files = [
+        join(out_dir, lab_dir, f'{segment["name"]}.lab')
+        for lab_dir in ('full_align_round_seg', 'mono_align_round_seg')
+        for segment in segments
+    ]
+    return check_lab_after_segmentation.find_invalid_lab_files(lab_files)
+
+
+def _finalize_if_valid(path_wav, segments, out_dir, layout, invalid_lab_files):
+    """
+    分割後のラベルに不具合がなければ、学習用のファイルを出力する。(並列処理用)
+    """
+    if len(invalid_lab_files) == 0:
+        finalize_lab_and_wav.finalize_one_song(path_wav, segments, out_dir, layout)
+
+
+def _save_segment_manifest(out_dir, songnames, results):
+    """
+    segment_lab の結果をまとめて記録して、{曲名: セグメントの記録} を返す。
+    """
+    songs = dict(zip(songnames, results))
+    segment_lab.save_manifest(out_dir, songs)
+    return songs
+
+
+def _raise_if_segments_are_invalid(results):
+    """
+    check_lab_after_segmentation の結果を確認する。
+    """
+    check_lab_after_segmentation.raise_if_invalid(
+        [path for invalid_lab_files in results for path in invalid_lab_files]
+    )
+
+
+def build_task_graph(config, songnames: list[str]) -> TaskGraph:
+    """
+    ステージ0の各ステップを、曲ごとのタスクとして登録する。
+    """
+    out_dir = config['out_dir'].strip('"')
+    duration_check_mode = config['vowel_duration_check']
+    layout = file_layout.layout_mode(config)
+    path_table = ust2lab.table_path(config)
+    step_size = round_lab.ROUND_STEP_SIZE
+    keep_intermediate_files = config.get('keep_intermediate_files', False)
+    segment_output_dirs = [
+        Path(out_dir) / lab_dir
+        for lab_dir in (
+            'mono_score_round_seg',
+            'full_score_round_seg',
+            'mono_align_round_seg',
+            'full_align_round_seg',
+        )
+    ]
+
+    graph = TaskGraph()
+    # 曲ごとの点検と、休符・時刻の修正
+    for songname in songnames:
+        path_ust = join(out_dir, 'ust', f'{songname}.ust')
+        path_wav = join(out_dir, 'wav', f'{songname}.wav')
+        path_mono_align = join(out_dir, 'lab', f'{songname}.lab')
+        path_full_score = join(out_dir, 'full_score', f'{songname}.lab')
+        graph.add(f'{songname}/check_lab', label_check.check_file, path_mono_align)
+        graph.add(f'{songname}/check_wav', check_wav.get_audio_info, path_wav)
+        graph.add(
+            f'{songname}/ust2lab',
+            _ust_to_full_score,
+            path_ust,
+            join(out_dir, 'full_score'),
+            path_table,
+        )
+        graph.add(
+            f'{songname}/merge_rest_full_score',
+            merge_rest_full_score._process_one_labfile,
+            path_full_score,
+            deps=[f'{songname}/ust2lab'],
+        )
+        graph.add(
+            f'{songname}/round_full_score',
+            round_lab.round_lab_file,
+            path_full_score,
+            join(out_dir, 'full_score_round', f'{songname}.lab'),
+            step_size,
+            deps=[f'{songname}/merge_rest_full_score'],
+        )
+        graph.add(
+            f'{songname}/full2mono',
+            full2mono._convert_one_full_to_mono,
+            join(out_dir, 'full_score_round', f'{songname}.lab'),
+            join(out_dir, 'mono_score_round'),
+            deps=[f'{songname}/round_full_score'],
+        )
+
+    # 全曲のLABファイルとWAVファイルの点検結果を確認する。
+    # check_lab.main と同じく、全曲のLABファイルを点検してから短すぎる音素を修正する。
+    graph.add(
+        'check_lab',
+        check_lab.save_report_and_raise_if_invalid,
+        out_dir,
+        [ResultOf(f'{songname}/check_lab') for songname in songnames],
+        in_parent=True,
+    )
+    for songname in songnames:
+        graph.add(
+            f'{songname}/repair_lab',
+            label_check.check_file,
+            join(out_dir, 'lab', f'{songname}.lab'),
+            None,
+            5,
+            deps=['check_lab'],
+        )
+    graph.add(
+        'repair_lab',
+        check_lab.save_report_and_raise_if_invalid,
+        out_dir,
+        [ResultOf(f'{songname}/repair_lab') for songname in songnames],
+        in_parent=True,
+    )
+    graph.add(
+        'check_wav',
+        _raise_if_wav_is_invalid,
+        [ResultOf(f'{songname}/check_wav') for songname in songnames],
+        in_parent=True,
+    )
+
+    # モノラベルを修正して、楽譜のモノラベルと比較する。
+    for songname in songnames:
+        path_mono_align = join(out_dir, 'lab', f'{songname}.lab')
+        path_mono_align_round = join(out_dir, 'mono_align_round', f'{songname}.lab')
+        path_mono_score_round = join(out_dir, 'mono_score_round', f'{songname}.lab')
+        graph.add(
+            f'{songname}/round_mono_align',
+            round_lab.merge_rests_and_round_lab_file,
+            path_mono_align,
+            path_mono_align_round,
+            step_size,
+            keep_intermediate_files,
+            deps=['repair_lab'],
+        )
+        graph.add(
+            f'{songname}/compare',
+            compare_mono_align_and_mono_score.compare_one_song,
+            path_mono_align_round,
+            path_mono_score_round,
+            deps=[f'{songname}/round_mono_align', f'{songname}/full2mono'],
+        )
+
+    # 母音のdurationの統計値を使って、前奏と母音の長さを点検する。
+    graph.add(
+        'duration_statistics',
+        _calc_mean_pstdev,
+        [ResultOf(f'{songname}/compare') for songname in songnames],
+        in_parent=True,
+    )
+    for songname in songnames:
+        graph.add(
+            f'{songname}/check_durations',
+            _check_durations,
+            join(out_dir, 'mono_align_round', f'{songname}.lab'),
+            join(out_dir, 'mono_score_round', f'{songname}.lab'),
+            ResultOf('duration_statistics'),
+            duration_check_mode,
+        )
+    graph.add(
+        'compare',
+        _raise_if_labels_do_not_match,
+        [ResultOf(f'{songname}/compare') for songname in songnames],
+        [ResultOf(f'{songname}/check_durations') for songname in songnames],
+        in_parent=True,
+    )
+
+    # 時刻をフルラベルにコピーして、ラベルと音声を分割する。
+    # ほかのパイプラインと同じく、全曲のラベルの比較が通ってから進める。
+    # (音素が一致しない曲を分割したり、学習用のファイルを書き出したりしないようにする。)
+    for songname in songnames:
+        path_wav = join(out_dir, 'wav', f'{songname}.wav')
+        path_mono_score_round = join(out_dir, 'mono_score_round', f'{songname}.lab')
+        path_full_score_round = join(out_dir, 'full_score_round', f'{songname}.lab')
+        path_mono_align_round = join(out_dir, 'mono_align_round', f'{songname}.lab')
+        path_full_align_round = join(out_dir, 'full_align_round', f'{songname}.lab')
+        graph.add(
+            f'{songname}/copy_mono_time_to_full',
+            copy_mono_time_to_full.copy_mono_align_time_to_full,
+            path_mono_align_round,
+            path_full_score_round,
+            path_full_align_round,
+            deps=['compare'],
+        )
+        graph.add(
+            f'{songname}/assert_wav_is_longer_than_lab',
+            assert_wav_is_longer_than_lab.warn_if_wav_is_shorter_than_lab,
+            path_wav,
+            [path_full_align_round, path_full_score_round],
+            deps=[f'{songname}/copy_mono_time_to_full', 'check_wav'],
+        )
+        graph.add(
+            f'{songname}/segment_lab',
+            segment_lab._process_one_song,
+            tuple(
+                Path(path)
+                for path in (
+                    path_mono_score_round,
+                    path_full_score_round,
+                    path_mono_align_round,
+                    path_full_align_round,
+                )
+            ),
+            config,
+            segment_output_dirs,
+            deps=[f'{songname}/copy_mono_time_to_full'],
+        )
+        graph.add(
+            f'{songname}/check_lab_after_segmentation',
+            _check_segments,
+            out_dir,
+            ResultOf(f'{songname}/segment_lab'),
+        )
+        graph.add(
+            f'{songname}/finalize_lab_and_wav',
+            _finalize_if_valid,
+            path_wav,
+            ResultOf(f'{songname}/segment_lab'),
+            out_dir,
+            layout,
+            ResultOf(f'{songname}/check_lab_after_segmentation'),
+            deps=[f'{songname}/assert_wav_is_longer_than_lab'],
+        )
+    graph.add(
+        'segment_manifest',
+        _save_segment_manifest,
+        out_dir,
+        songnames,
+        [ResultOf(f'{songname}/segment_lab') for songname in songnames],
+        in_parent=True,
+    )
+    graph.add(
+        'check_lab_after_segmentation',
+        _raise_if_segments_are_invalid,
+        [ResultOf(f'{songname}/check_lab_after_segmentation') for songname in songnames],
+        in_parent=True,
+    )
+    return graph
+
+
+@tracing.traced
+def main(path_config_yaml):
+    """
+    config を読み取って、全曲についてステージ0の各ステップを実行する。
+    copy_files を実行済みであること。
+    """
+    with open(path_config_yaml, encoding='utf-8') as fy:
+        config = yaml.safe_load(fy)
+    out_dir = config['out_dir'].strip('"')
+    ust_dir = join(out_dir, 'ust')
+    mono_align_dir = join(out_dir, 'lab')
+
+    # ファイル数と名前が一致するか点検
+    ust2lab.compare_number_of_ustfiles_and_labfiles(ust_dir, mono_align_dir)
+    ust2lab.compare_name_of_ustfiles_and_labfiles(ust_dir, mono_align_dir)
+
+    # 除外する曲をスキップする
+    songnames = []
+    for path_ust in natsorted(Path(ust_dir).glob('*.ust')):
+        if path_ust.stem in config['exclude_songs']:
+            print(f'Skip excluded song: {path_ust.stem}')
+        else:
+            songnames.append(path_ust.stem)
+
+    # 出力先フォルダを作成する
+    for output_dir in OUTPUT_SUBDIRS:
+        makedirs(join(out_dir, output_dir), exist_ok=True)
+
+    # 曲ごとのタスクを実行する
+    print('Running stage-0 tasks song by song')
+    results = build_task_graph(config, songnames).run(
+        desc='stage0',
+        initializer=ust2lab.init_worker,
+        initargs=(ust2lab.table_path(config),),
+    )
+    segment_lab.print_manifest_length_report(results['segment_manifest'], config)
+
+
+if __name__ == '__main__':
+    if len(argv) == 1:
+        main('config.yaml')
+    else:
+        main(argv[1].strip('"'))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+内容が同じファイルを複数のフォルダに配置する。
+
+config の stage0_file_layout で配置方法を選ぶ。
+- copy    : 複製する。(これまでと同じ)
+- hardlink: ハードリンクを作る。書き込み量と使用する容量が減る。
+            リンク先のファイルを書き換えると、元のファイルも書き換わるので注意。
+- reflink : 対応するファイルシステム (Btrfs, XFS など) では、内容を共有する複製を作る。
+
+copy_files では、このほかにシンボリックリンク (symlink) も選べる。
+
+ハードリンクやリンクの共有を作れない場合 (別のドライブへの配置や非対応のファイルシステム) は、
+複製する。
+"""
+
+import errno
+import os
+from os.path import abspath
+from shutil import copy
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LAYOUT_MODES = ('copy', 'hardlink', 'reflink')
+# copy_files で選べる配置方法
+COPY_MODES = (*LAYOUT_MODES, 'symlink')
+# Linux の ioctl FICLONE
+_FICLONE = 0x40049409
+# リンクを作れないときに複製で代用するエラー
+_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EMLINK,
+    errno.ENOSYS,
+}
+
+
+def layout_mode(config) -> str:
+    """
+    config で指定された配置方法を返す。
+    """
+    mode = config.get('stage0_file_layout') or 'copy'
+    if mode not in LAYOUT_MODES:
+        raise ValueError(f'stage0_file_layout must be one of {LAYOUT_MODES}: {mode}')
+    return mode
+
+
+def _reflink(path_src, path_dst):
+    """
+    内容を共有する複製を作る。(FICLONE)
+    fcntl がない環境 (Windows) では非対応として OSError を送出し、呼び出し元で複製させる。
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform')
+    with open(path_src, 'rb') as f_src, open(path_dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+
+
+def place_file(path_src, path_dst, mode='copy', copy_function=copy):
+    """
+    path_src と同じ内容のファイルを path_dst に配置する。既存のファイルは置き換える。
+    copy_function: 複製するときに使う関数 (shutil.copy または shutil.copy2)
+    """
+    # 前回リンクとして配置したファイルに書き込むと、元のファイルが書き換わるので先に消す。
+    if os.path.lexists(path_dst):
+        os.remove(path_dst)
+    try:
+        if mode == 'copy':
+            copy_function(path_src, path_dst)
+        elif mode == 'hardlink':
+            os.link(path_src, path_dst)
+        elif mode == 'reflink':
+            _reflink(path_src, path_dst)
+        elif mode == 'symlink':
+            os.symlink(abspath(path_src), path_dst)
+        else:
+            raise ValueError(f'mode must be one of {COPY_MODES}: {mode}')
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRNOS:
+            raise
+        copy_function(path_src, path_dst)
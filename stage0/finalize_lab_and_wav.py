@@ -8,23 +8,34 @@ timelag とか duration とか acoustic の学習用フォルダにコピーす
 音声の offset_correction がよくわからんので実装できてない。
 """
 
-import warnings
 from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import basename, expanduser, splitext
-from shutil import copy
 from sys import argv
 
-import utaupy as up
 import yaml
 from natsort import natsorted
-from tqdm import tqdm
 from tqdm.contrib.concurrent import process_map
 
-with warnings.catch_warnings():
-    warnings.simplefilter('ignore')
-    from pydub import AudioSegment
+try:
+    from . import file_layout, label_cache, segment_lab, tracing, wav_segment
+except ImportError:  # スクリプトとして実行した場合
+    import file_layout
+    import label_cache
+    import segment_lab
+    import tracing
+    import wav_segment
+
+# 学習用のファイルを配置するフォルダ
+OUTPUT_SUBDIRS = (
+    'timelag/label_phone_align',
+    'timelag/label_phone_score',
+    'duration/label_phone_align',
+    'acoustic/label_phone_align',
+    'acoustic/label_phone_score',
+    'acoustic/wav',
+)
 
 
 def lab_fix_offset(path_lab):
@@ -33,122 +44,138 @@ def lab_fix_offset(path_lab):
     ファイルは上書きする。
     offset: 最初に余裕をどのくらい持たせるか[100ns]
     """
-    label = up.label.load(path_lab)
-    # どのくらいずらすか
-    dt = label[0].start
-    for phoneme in label:
-        phoneme.start -= dt
-        phoneme.end -= dt
-    label.write(path_lab)
+    label = label_cache.load(path_lab)
+    label.fix_offset()
+    label_cache.write(label, path_lab)
 
 
-def prepare_data_for_timelag_models(
-    full_align_round_seg_files: list, full_score_round_seg_files: list, timelag_dir
-):
+def place_song_labels(segments: list[dict], out_dir, layout='copy'):
     """
-    timilagモデル用にラベルファイルをコピーする
+    1曲分のセグメントについて、timelag・duration・acoustic の学習用フォルダにラベルを配置する。
+    segments: segment_lab.segment_records の戻り値 (少なくとも 'name' を含む)
+    layout: file_layout.LAYOUT_MODES のいずれか
 
     Shiraniさんのレシピではoffset_correstionの工程が含まれるが、
     このプログラムでは実装していない。
     """
-    label_phone_align_dir = f'{timelag_dir}/label_phone_align'
-    label_phone_score_dir = f'{timelag_dir}/label_phone_score'
-
-    makedirs(label_phone_align_dir, exist_ok=True)
-    makedirs(label_phone_score_dir, exist_ok=True)
-
-    # 手動設定したフルラベルファイルを複製
-    print('Copying full_align_round_seg files')
-    for path_lab in tqdm(full_align_round_seg_files):
-        copy(path_lab, f'{label_phone_align_dir}/{basename(path_lab)}')
-
-    # 楽譜から生成したフルラベルファイルを複製
-    print('Copying full_score_round_seg files')
-    for path_lab in tqdm(full_score_round_seg_files):
-        copy(path_lab, f'{label_phone_score_dir}/{basename(path_lab)}')
+    for segment in segments:
+        segment_name = segment['name']
+        path_full_align = f'{out_dir}/full_align_round_seg/{segment_name}.lab'
+        path_full_score = f'{out_dir}/full_score_round_seg/{segment_name}.lab'
+        # timelag 用のラベルはオフセットを修正しないので、分割後のラベルと同じ内容にする。
+        file_layout.place_file(
+            path_full_align, f'{out_dir}/timelag/label_phone_align/{segment_name}.lab', layout
+        )
+        file_layout.place_file(
+            path_full_score, f'{out_dir}/timelag/label_phone_score/{segment_name}.lab', layout
+        )
+        # duration 用と acoustic 用のラベルはオフセットを修正する。
+        # 読み取ったラベルを修正して一度だけ書き出し、同じ内容のファイルはそれを配置する。
+        path_duration_align = f'{out_dir}/duration/label_phone_align/{segment_name}.lab'
+        full_align_label = label_cache.load(path_full_align)
+        full_align_label.fix_offset()
+        label_cache.write(full_align_label, path_duration_align)
+        file_layout.place_file(
+            path_duration_align,
+            f'{out_dir}/acoustic/label_phone_align/{segment_name}.lab',
+            layout,
+        )
+        full_score_label = label_cache.load(path_full_score)
+        full_score_label.fix_offset()
+        label_cache.write(
+            full_score_label, f'{out_dir}/acoustic/label_phone_score/{segment_name}.lab'
+        )
+
+
+@tracing.traced
+def _place_song_labels(segments, out_dir, layout):
+    """1曲分のラベルを配置する（並列処理用）"""
+    place_song_labels(segments, out_dir, layout)
+
+
+def group_segments_by_song(full_align_round_seg_files: list) -> dict:
+    """
+    分割結果の記録がない場合に、セグメントのファイル名から {曲名: セグメントのリスト} を作る。
+    セグメントには切断位置を含めない。
+    """
+    songs = {}
+    for path_lab in full_align_round_seg_files:
+        segment_name = splitext(basename(path_lab))[0]
+        songname = segment_name.rsplit('__seg', 1)[0]
+        songs.setdefault(songname, []).append({'name': segment_name})
+    return songs
 
 
-def prepare_data_for_duration_models(full_align_round_seg_files: list, duration_dir):
+def export_segments(wav, segments: list[dict], full_align_round_seg_dir, acoustic_wav_dir):
     """
-    durationモデル用にラベルファイルを複製する。
+    1曲分のセグメントの音声を切り出して保存する。
+    記録した切断位置があればそれを使い、なければ分割後のラベルから求める。
     """
-    label_phone_align_dir = f'{duration_dir}/label_phone_align'
-    makedirs(label_phone_align_dir, exist_ok=True)
-
-    # 手動設定したフルラベルファイルを複製
-    print('Copying full_align_round_seg files')
-    for path_lab_in in tqdm(full_align_round_seg_files):
-        path_lab_out = f'{label_phone_align_dir}/{basename(path_lab_in)}'
-        copy(path_lab_in, path_lab_out)
-        lab_fix_offset(path_lab_out)
+    for segment in segments:
+        # outdir/songname_segx.wav
+        path_wav_seg_out = f'{acoustic_wav_dir}/{segment["name"]}.wav'
+        if segment.get('start_frame') is not None and wav.frame_rate == segment.get('frame_rate'):
+            wav.write_frames(segment['start_frame'], segment['end_frame'], path_wav_seg_out)
+        else:
+            label = label_cache.load(f'{full_align_round_seg_dir}/{segment["name"]}.lab')
+            export_wav_segment(wav, label, path_wav_seg_out)
 
 
-def _segment_one_wav(path_wav, acoustic_wav_dir, full_align_round_seg_files):
+@tracing.traced
+def _segment_one_wav(path_wav, segments, full_align_round_seg_dir, acoustic_wav_dir):
     """1つのWAVファイルを処理（並列処理用）"""
-    songname = splitext(basename(path_wav))[0]
-
-    # 対応するセグメントファイルを取得
-    corresponding_full_align_round_seg_files = [
-        path for path in full_align_round_seg_files if f'{songname}__seg' in path
-    ]
-
-    # 音声ファイルを読み取る
-    wav = AudioSegment.from_file(path_wav, format='wav')
-    for path_lab in corresponding_full_align_round_seg_files:
-        label = up.label.load(path_lab)
-        # 切断時刻を取得
-        t_start_ms = round(label[0].start / 10000)
-        t_end_ms = round(label[-1].end / 10000)
-        # 切り出す
-        wav_slice = wav[t_start_ms:t_end_ms]
-        # outdir/songname_segx.wav
-        path_wav_seg_out = f'{acoustic_wav_dir}/{splitext(basename(path_lab))[0]}.wav'
-        wav_slice.export(path_wav_seg_out, format='wav')
+    # 音声ファイルを開く (音声全体は読み込まない)
+    with wav_segment.WavSource(path_wav) as wav:
+        export_segments(wav, segments, full_align_round_seg_dir, acoustic_wav_dir)
 
 
-def prepare_data_for_acoustic_models(
-    full_align_round_seg_files: list,
-    full_score_round_seg_files: list,
-    wav_files: list,
-    acoustic_dir: str,
-):
+def export_wav_segment(wav, label, path_wav_seg_out):
     """
-    acousticモデル用に音声ファイルとラベルファイルを複製する。
+    ラベルの開始時刻と終了時刻で音声を切り出して保存する。
+    wav: wav_segment.WavSource (with文で開いたもの)
+    label: compact_label.CompactLabel (label_cache.load で読み取ったもの)
     """
-    wav_dir = f'{acoustic_dir}/wav'
-    label_phone_align_dir = f'{acoustic_dir}/label_phone_align'
-    label_phone_score_dir = f'{acoustic_dir}/label_phone_score'
-    # 出力先フォルダを作成
-    makedirs(wav_dir, exist_ok=True)
-    makedirs(label_phone_align_dir, exist_ok=True)
-    makedirs(label_phone_score_dir, exist_ok=True)
+    # ミリ秒に丸めず、ラベルの時刻に最も近いサンプルで切断する。
+    wav.write_segment(label.starts[0], label.ends[-1], path_wav_seg_out)
+
 
-    # wavファイルを分割して保存する
+def split_wav_files(wav_files: list, segments_by_song: dict, out_dir):
+    """
+    acousticモデル用に音声ファイルを分割して保存する。
+    segments_by_song: {曲名: セグメントのリスト} (segment_lab.load_manifest の戻り値)
+    """
     print('Split wav files (parallel)')
     # 並列用に引数を部分適用
     func = partial(
         _segment_one_wav,
-        acoustic_wav_dir=wav_dir,
-        full_align_round_seg_files=full_align_round_seg_files,
+        full_align_round_seg_dir=f'{out_dir}/full_align_round_seg',
+        acoustic_wav_dir=f'{out_dir}/acoustic/wav',
+    )
+    # 曲ごとのセグメントだけを渡して、並列処理で実行
+    process_map(
+        func,
+        wav_files,
+        [segments_by_song.get(splitext(basename(path))[0], []) for path in wav_files],
+        colour='blue',
     )
-    # 並列処理で実行
-    process_map(func, wav_files, colour='blue')
 
-    # 手動設定したフルラベルファイルを複製
-    print('Copying full_align_round_seg files')
-    for path_lab_in in tqdm(full_align_round_seg_files):
-        path_lab_out = f'{label_phone_align_dir}/{basename(path_lab_in)}'
-        copy(path_lab_in, path_lab_out)
-        lab_fix_offset(path_lab_out)
 
-    # 楽譜から生成したフルラベルファイルを複製
-    print('Copying full_score_round_seg files')
-    for path_lab_in in tqdm(full_score_round_seg_files):
-        path_lab_out = f'{label_phone_score_dir}/{basename(path_lab_in)}'
-        copy(path_lab_in, path_lab_out)
-        lab_fix_offset(path_lab_out)
+@tracing.traced
+def finalize_one_song(path_wav, segments: list[dict], out_dir, layout='copy'):
+    """
+    1曲分のセグメントについて、学習用のフォルダにラベルと分割した音声を保存する。
+    segments: segment_lab.segment_records の戻り値
+    出力先フォルダは作成済みであること。
+    """
+    place_song_labels(segments, out_dir, layout)
+    # 音声を切り出す
+    with wav_segment.WavSource(path_wav) as wav:
+        export_segments(
+            wav, segments, f'{out_dir}/full_align_round_seg', f'{out_dir}/acoustic/wav'
+        )
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     フォルダを指定して全体の処理をやる
@@ -156,31 +183,31 @@ def main(path_config_yaml):
     with open(path_config_yaml, encoding='utf-8') as fy:
         config = yaml.safe_load(fy)
     out_dir = expanduser(config['out_dir'])
+    layout = file_layout.layout_mode(config)
 
     full_align_round_seg_files = natsorted(glob(f'{out_dir}/full_align_round_seg/*.lab'))
-    full_score_round_seg_files = natsorted(glob(f'{out_dir}/full_score_round_seg/*.lab'))
     wav_files = natsorted(glob(f'{out_dir}/wav/*.wav', recursive=True))
-
-    # フルラベルをtimelag用のフォルダに保存する。
-    print('Preparing data for timelag models')
-    timelag_dir = f'{out_dir}/timelag'
-    prepare_data_for_timelag_models(
-        full_align_round_seg_files, full_score_round_seg_files, timelag_dir
+    # 曲ごとのセグメントを segment_lab の記録から取得する。記録がなければファイル名から作る。
+    segments_by_song = segment_lab.load_manifest(out_dir) or group_segments_by_song(
+        full_align_round_seg_files
     )
 
-    # フルラベルのオフセット修正をして、duration用のフォルダに保存する。
-    print('Preparing data for duration models')
-    duration_dir = f'{out_dir}/duration'
-    prepare_data_for_duration_models(full_align_round_seg_files, duration_dir)
+    # 出力先フォルダを作成
+    for output_dir in OUTPUT_SUBDIRS:
+        makedirs(f'{out_dir}/{output_dir}', exist_ok=True)
+
+    # フルラベルを timelag 用のフォルダに保存し、
+    # オフセット修正をして duration 用と acoustic 用のフォルダに保存する。
+    print(f'Preparing labels for timelag, duration and acoustic models (layout: {layout})')
+    process_map(
+        partial(_place_song_labels, out_dir=out_dir, layout=layout),
+        list(segments_by_song.values()),
+        colour='blue',
+    )
 
-    # フルラベルのオフセット修正をして、acoustic用のフォルダに保存する。
     # wavファイルをlabファイルのセグメントに合わせて切断
-    # wavファイルの前後にどのくらい余白を設けるか
-    print('Preparing data for acoustic models')
-    acoustic_dir = f'{out_dir}/acoustic'
-    prepare_data_for_acoustic_models(
-        full_align_round_seg_files, full_score_round_seg_files, wav_files, acoustic_dir
-    )
+    print('Preparing wav files for acoustic models')
+    split_wav_files(wav_files, segments_by_song, out_dir)
 
 
 if __name__ == '__main__':
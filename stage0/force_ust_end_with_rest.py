@@ -2,6 +2,8 @@
 # Copyright (c) 2021-2025 oatsu
 """
 USTファイルの最終ノートを休符にする。
+
+読み取ったUSTは ust_cache に残し、続く ust2lab で解析しなおさずに使う。
 """
 
 import logging
@@ -9,10 +11,36 @@ from glob import glob
 from os.path import join
 from sys import argv
 
-import utaupy as up
 import yaml
 from tqdm import tqdm
 
+try:
+    from . import tracing, ust_cache
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+    import ust_cache
+
+
+def force_ust_end_with_rest(ust, path_ust=''):
+    """
+    Ustオブジェクトの最終ノートが休符になるようにする。
+    """
+    if ust.notes[-1].lyric != 'R':
+        info_message = f'USTの末尾に休符がありません。({path_ust})'
+        logging.info(info_message)
+    ust.make_finalnote_R()
+
+
+@tracing.traced
+def force_ust_file_end_with_rest(path_ust):
+    """
+    USTファイルが休符で終わるようにして上書き保存する。
+    内容が変わらない場合は上書きしない。
+    """
+    ust = ust_cache.load(path_ust)
+    force_ust_end_with_rest(ust, path_ust)
+    ust_cache.write(ust, path_ust)
+
 
 def force_ust_files_end_with_rest(ust_dir):
     """
@@ -20,14 +48,10 @@ def force_ust_files_end_with_rest(ust_dir):
     """
     ust_files = glob(f'{ust_dir}/*.ust')
     for path_ust in tqdm(ust_files):
-        ust = up.ust.load(path_ust)
-        if ust.notes[-1].lyric != 'R':
-            info_message = f'USTの末尾に休符がありません。({path_ust})'
-            logging.info(info_message)
-        ust.make_finalnote_R()
-        ust.write(path_ust)
+        force_ust_file_end_with_rest(path_ust)
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     フォルダとかを指定
@@ -2,25 +2,119 @@
 # Copyright (c) 2021-2025 oatsu
 """
 フルラベルを読み取ってモノラベルにして保存する。
+
+フルラベルの各行から、発声時刻と現在の音素記号 (p3) だけをバイト列のまま切り出す。
+utaupy.hts.load で Songオブジェクトを作ってから as_mono() で変換した場合と同じ結果になる。
+そのように切り出せない行があるファイルは、utaupy で変換する。
 """
 
+import mmap
+import re
 from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import basename, join
 from sys import argv
 
+import numpy as np
 import utaupy as up
 import yaml
 from tqdm.contrib.concurrent import process_map
 
+try:
+    from . import tracing
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+
+# utaupy.hts がコンテキストを区切る文字のうち、1バイトのもの
+_SEPARATORS = rb'=+\-~!@#$%^&;_|\[\]'
+# utaupy.hts がコンテキストを区切る文字のうち、UTF-8 で複数バイトになるもの (∼, ˆ)
+_MULTIBYTE_SEPARATORS = ('∼'.encode(), 'ˆ'.encode())
+# 1行分: 発声開始時刻, 発声終了時刻, p1 から p3 まで区切った後の音素記号
+# /A: などで区切られる位置より前に音素記号があることも確かめる。
+_LINE = re.compile(
+    rb'^[ \t]*(-?\d+)[ \t]+(-?\d+)[ \t]+(?:[^\s/%s]*[%s]){3}([^\s/%s]*)[%s]'
+    % (_SEPARATORS, _SEPARATORS, _SEPARATORS, _SEPARATORS),
+    re.MULTILINE,
+)
+
+
+def _starts_with_note(line: str) -> bool:
+    """
+    フルラベルの1行目がノートの先頭かどうかを返す。
+    utaupy.hts.HTSFullLabel.generate_songobj は、最初のノートより前の行を捨てる。
+    """
+    contexts = re.split('/.:', line.split(maxsplit=2)[2])
+    sep = re.escape('=+-~∼!@#$%^ˆ&;_|[]')
+    p = re.split(f'[{sep}]', contexts[0])
+    b = re.split(f'[{sep}]', contexts[2])
+    return p[0] in ('s', 'p') or (p[11] == '1' and b[1] == '1')
+
+
+def _convert_bytes(data) -> bytes | None:
+    """
+    フルラベルの内容 (bytes または mmap) をモノラベルの内容にする。
+    切り出せない場合は None を返す。
+    """
+    if len(data) == 0:
+        return None
+    codes = np.frombuffer(data, dtype=np.uint8)
+    # utaupy と同じ行の区切りや文字コードになるとは限らないものは扱わない。
+    if np.any(codes == ord('\r')) or any(data.find(sep) >= 0 for sep in _MULTIBYTE_SEPARATORS):
+        return None
+    if np.any(codes >= 0x80):
+        try:
+            str(data, 'utf-8')
+        except UnicodeDecodeError:
+            return None
+    newlines = np.flatnonzero(codes == ord('\n'))
+    n_lines = len(newlines) + (codes[-1] != ord('\n'))
+    matches = _LINE.findall(data)
+    if len(matches) != n_lines:
+        return None
+    first_line = data[: newlines[0]] if len(newlines) > 0 else data[:]
+    try:
+        if not _starts_with_note(str(first_line, 'utf-8')):
+            return None
+    except IndexError:
+        return None
+    # utaupy と同じく、時刻は整数にしてから書き出す。
+    return b'\n'.join(
+        b'%d %d %s' % (int(start), int(end), symbol) for start, end, symbol in matches
+    )
+
+
+def convert_full_to_mono_lines(lines: list[str]) -> list[str]:
+    """
+    フルラベルの行のリストを、モノラベルの行のリストにする。
+    """
+    mono = _convert_bytes('\n'.join(lines).encode('utf-8'))
+    if mono is None:
+        label = up.hts.load(lines).as_mono()
+        return [f'{phoneme.start} {phoneme.end} {phoneme.symbol}' for phoneme in label]
+    return mono.decode('utf-8').split('\n')
+
 
+@tracing.traced
 def _convert_one_full_to_mono(path_full, mono_lab_dir):
     """1つのフルラベルをモノラベルに変換（並列処理用）"""
-    full_label_obj = up.hts.load(path_full)
-    full_label_obj.as_mono().write(join(mono_lab_dir, basename(path_full)))
+    path_mono = join(mono_lab_dir, basename(path_full))
+    with open(path_full, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                mono = _convert_bytes(data)
+        # 空のファイルは mmap できない。
+        except ValueError:
+            mono = None
+    if mono is None:
+        full_label_obj = up.hts.load(path_full)
+        full_label_obj.as_mono().write(path_mono)
+        return
+    with open(path_mono, 'wb') as f:
+        f.write(mono)
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     configファイルからフォルダを指定して、全体の処理を実行する。
@@ -42,7 +136,12 @@ def main(path_config_yaml):
     # 並列処理用の関数を作成
     convert_func = partial(_convert_one_full_to_mono, mono_lab_dir=mono_score_dir)
     # 並列処理で実行
-    process_map(convert_func, full_labels, colour='blue')
+    process_map(
+        convert_func,
+        full_labels,
+        colour='blue',
+        chunksize=max(1, len(full_labels) // 64),
+    )
 
 
 if __name__ == '__main__':
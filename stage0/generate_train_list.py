@@ -8,17 +8,43 @@ data/list/dev.list
 data/list/train.list
 
 全ファイルから12個おきにevalとdevに入れる。dev以外の全ファイルをtrainに入れる。
+split_method='hash' の場合は、曲名またはセグメント名のハッシュで同じ割合に振り分ける。
+(曲を追加しても、ほかの曲やセグメントの振り分けは変わらない。)
+
+data/list/utt_manifest.tsv には、セグメントごとの長さ (秒・フレーム数) と音素数、曲名を記録する。
+長さは分割後のWAVファイルのヘッダから求めるので、音声を読み込まない。
+train_list_variants を指定すると、長さ順 (*_sorted.list) や
+長さの近いセグメントをまとめた順 (*_bucketed.list) のリストも作る。
 """
 
+import hashlib
+import random
 from glob import glob
 from os import makedirs
-from os.path import basename, expanduser, join, splitext
+from os.path import basename, exists, expanduser, join, splitext
 from pathlib import Path
 from sys import argv
 
 import yaml
 from natsort import natsorted  # type: ignore
 
+try:
+    from . import tracing, wav_header
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+    import wav_header
+
+# 長さの情報を記録するファイル
+MANIFEST_NAME = 'utt_manifest.tsv'
+# 音響特徴量のフレーム周期[ms] の既定値 (conf/prepare_features/acoustic/*.yaml の frame_period)
+DEFAULT_FRAME_PERIOD = 5
+# dev, eval, train への振り分け方の選択肢
+SPLIT_METHODS = ('position', 'hash')
+# リストの並べ方の選択肢
+LIST_VARIANTS = ('sorted', 'bucketed')
+# bucketed で長さの近いセグメントをまとめる個数の既定値
+DEFAULT_BUCKET_SIZE = 8
+
 
 def generate_train_list_by_segment(
     out_dir: Path, interval: int = 11
@@ -107,28 +133,186 @@ def generate_train_list_by_song(
     return utt_list, dev_list, eval_list, train_list
 
 
-def generate_train_list(out_dir: Path, interval: int, select_by: str = 'segment') -> None:
+def _hash_ratio(name: str) -> float:
+    """
+    名前のハッシュから [0, 1) の値を求める。同じ名前なら常に同じ値になる。
+    """
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2**64
+
+
+def generate_train_list_by_hash(
+    out_dir: Path, interval: int = 11, select_by: str = 'segment'
+) -> tuple[list[str], list[str], list[str], list[str]]:
+    """
+    曲名 (select_by='song') またはセグメント名 (select_by='segment') のハッシュで
+    dev, eval, train に振り分ける。割合は idx % interval で振り分ける場合と同じにする。
+    (dev: 1 / interval, eval: 1 / (interval * 2), 残りは train)
+
+    dev や eval が空になる場合は、ハッシュの値が最も小さい train の曲 (セグメント) を移す。
+    """
+    # 学習対象のファイル一覧を取得
+    wav_dir = join(out_dir, 'acoustic', 'wav')
+    utt_list = glob(f'{wav_dir}/*.wav')
+    utt_list = natsorted([splitext(basename(path))[0] for path in utt_list])
+    # utt_listが空でないことを確認
+    if len(utt_list) == 0:
+        raise Exception(f'No wav files in "{wav_dir}".')
+
+    # 振り分けの単位 (曲名またはセグメント名) ごとにまとめる
+    groups: dict[str, list[str]] = {}
+    for utt_id in utt_list:
+        key = utt_id.rsplit('__seg', 1)[0] if select_by == 'song' else utt_id
+        groups.setdefault(key, []).append(utt_id)
+
+    subsets: dict[str, list[str]] = {'dev': [], 'eval': [], 'train': []}
+    ratios = {key: _hash_ratio(key) for key in groups}
+    for key, ratio in ratios.items():
+        if ratio < 1 / interval:
+            subsets['dev'].append(key)
+        elif ratio < 1 / interval + 1 / (interval * 2):
+            subsets['eval'].append(key)
+        else:
+            subsets['train'].append(key)
+    for name in ('dev', 'eval'):
+        if len(subsets[name]) == 0 and len(subsets['train']) > 1:
+            key = min(subsets['train'], key=ratios.__getitem__)
+            subsets['train'].remove(key)
+            subsets[name].append(key)
+
+    dev_list, eval_list, train_list = (
+        natsorted(utt_id for key in subsets[name] for utt_id in groups[key])
+        for name in ('dev', 'eval', 'train')
+    )
+    return utt_list, dev_list, eval_list, train_list
+
+
+def frame_period_from_config(config, path_config_yaml) -> float:
+    """
+    音響特徴量のフレーム周期[ms] を返す。
+    config.yaml と同じフォルダにある
+    conf/prepare_features/acoustic/{acoustic_features}.yaml から読み取る。
+    見つからなければ DEFAULT_FRAME_PERIOD にする。
+    """
+    path_features_yaml = join(
+        Path(path_config_yaml).parent,
+        'conf',
+        'prepare_features',
+        'acoustic',
+        f'{config.get("acoustic_features")}.yaml',
+    )
+    if not exists(path_features_yaml):
+        return DEFAULT_FRAME_PERIOD
+    with open(path_features_yaml, encoding='utf-8') as fy:
+        features_config = yaml.safe_load(fy) or {}
+    return features_config.get('frame_period') or DEFAULT_FRAME_PERIOD
+
+
+def utterance_lengths(out_dir: Path, utt_list: list[str], frame_period: float) -> dict:
+    """
+    セグメントごとの長さと音素数を返す。
+    {utt_id: {'song': 曲名, 'seconds': 秒数, 'frames': フレーム数, 'phonemes': 音素数}}
+
+    長さは acoustic/wav のWAVファイルのヘッダから求める。
+    フレーム数は WORLD と同じく (サンプル数 / フレーム周期のサンプル数) + 1 とする。
+    音素数は acoustic/label_phone_score のLABファイルの行数とする。
+    """
+    wav_dir = join(out_dir, 'acoustic', 'wav')
+    lab_dir = join(out_dir, 'acoustic', 'label_phone_score')
+    lengths = {}
+    for utt_id in utt_list:
+        info = wav_header.read_wav_info(join(wav_dir, f'{utt_id}.wav'))
+        hop_size = info['frame_rate'] * frame_period / 1000
+        try:
+            with open(join(lab_dir, f'{utt_id}.lab'), 'rb') as f:
+                phonemes = len(f.read().splitlines())
+        except FileNotFoundError:
+            phonemes = None
+        lengths[utt_id] = {
+            'song': utt_id.rsplit('__seg', 1)[0],
+            'seconds': info['num_frames'] / info['frame_rate'],
+            'frames': int(info['num_frames'] / hop_size) + 1,
+            'phonemes': phonemes,
+        }
+    return lengths
+
+
+def sorted_by_length(utt_list: list[str], lengths: dict) -> list[str]:
+    """
+    セグメントを長い順に並べる。長さが同じ場合は元の順にする。
+    """
+    return sorted(utt_list, key=lambda utt_id: -lengths[utt_id]['frames'])
+
+
+def bucketed_by_length(
+    utt_list: list[str], lengths: dict, bucket_size: int, seed: int = 0
+) -> list[str]:
+    """
+    長さの近いセグメントを bucket_size 個ずつまとめて、まとまりの順番をシャッフルする。
+    先頭から bucket_size 個ずつバッチにすると、バッチ内の長さがそろう。
+    """
+    utt_list = sorted_by_length(utt_list, lengths)
+    buckets = [utt_list[i : i + bucket_size] for i in range(0, len(utt_list), bucket_size)]
+    random.Random(seed).shuffle(buckets)
+    return [utt_id for bucket in buckets for utt_id in bucket]
+
+
+def write_manifest(path_manifest, lengths: dict, subsets: dict):
+    """
+    セグメントごとの長さの記録を TSV で書き出す。
+    subsets: {utt_id: 'train_no_dev', 'dev' または 'eval'}
+    """
+    rows = ['utt_id\tsong\tsubset\tseconds\tframes\tphonemes']
+    for utt_id, length in lengths.items():
+        phonemes = '' if length['phonemes'] is None else length['phonemes']
+        rows.append(
+            f'{utt_id}\t{length["song"]}\t{subsets[utt_id]}\t'
+            f'{length["seconds"]:.6f}\t{length["frames"]}\t{phonemes}'
+        )
+    with open(path_manifest, mode='w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(rows) + '\n')
+
+
+def generate_train_list(
+    out_dir: Path,
+    interval: int,
+    select_by: str = 'segment',
+    split_method: str = 'position',
+    frame_period: float = DEFAULT_FRAME_PERIOD,
+    variants: list[str] = (),
+    bucket_size: int = DEFAULT_BUCKET_SIZE,
+) -> None:
     """
     Generate training list files.
+
+    split_method: 'position' (並び順で振り分ける) または 'hash' (名前のハッシュで振り分ける)
+    frame_period: 長さの記録に使うフレーム周期[ms]
+    variants: 追加で作るリストの並べ方 (LIST_VARIANTS のいずれか)
+    bucket_size: bucketed で長さの近いセグメントをまとめる個数
     """
+    for variant in variants:
+        if variant not in LIST_VARIANTS:
+            raise ValueError(f'train_list_variants must be in {LIST_VARIANTS}: {variant}')
 
     if not 5 <= interval <= 20:
         msg = f'Interval must be between 5 and 20, got {interval}.'
         raise ValueError(msg)
-    print(f'Generate train list: interval = {interval}')
+    print(f'Generate train list: interval = {interval}, split by {split_method}')
 
-    if select_by == 'segment':
-        generate_train_list_by_segment(out_dir, interval)
-    elif select_by == 'song':
-        generate_train_list_by_song(out_dir, interval)
-    else:
+    if select_by not in ('segment', 'song'):
         raise ValueError(f'Unknown select_by value: {select_by}')
+    if split_method not in SPLIT_METHODS:
+        raise ValueError(f'list_split_method must be one of {SPLIT_METHODS}: {split_method}')
 
-    if select_by == 'segment':
+    if split_method == 'hash':
+        utt_list, dev_list, eval_list, train_list = generate_train_list_by_hash(
+            out_dir, interval, select_by
+        )
+    elif select_by == 'segment':
         utt_list, dev_list, eval_list, train_list = generate_train_list_by_segment(
             out_dir, interval
         )
-    elif select_by == 'song':
+    else:
         utt_list, dev_list, eval_list, train_list = generate_train_list_by_song(out_dir, interval)
 
     # すべてのリストの要素が 1以上であることを確認する
@@ -170,14 +354,55 @@ def generate_train_list(out_dir: Path, interval: int, select_by: str = 'segment'
     with open(path_train_list, mode='w', newline='\n') as f_utt:
         f_utt.write('\n'.join(train_list))
 
+    # 長さの記録を出力する
+    lengths = utterance_lengths(out_dir, utt_list, frame_period)
+    subsets = {
+        **{utt_id: 'train_no_dev' for utt_id in train_list},
+        **{utt_id: 'dev' for utt_id in dev_list},
+        **{utt_id: 'eval' for utt_id in eval_list},
+    }
+    path_manifest = join(list_dir, MANIFEST_NAME)
+    write_manifest(path_manifest, lengths, subsets)
+
+    # 長さ順などに並べたリストを出力する
+    variant_paths = []
+    for variant in variants:
+        for name, subset_list in (
+            ('dev', dev_list),
+            ('eval', eval_list),
+            ('train_no_dev', train_list),
+        ):
+            if variant == 'sorted':
+                ordered_list = sorted_by_length(subset_list, lengths)
+            else:
+                ordered_list = bucketed_by_length(subset_list, lengths, bucket_size)
+            path_variant = join(list_dir, f'{name}_{variant}.list')
+            with open(path_variant, mode='w', newline='\n') as f_utt:
+                f_utt.write('\n'.join(ordered_list))
+            variant_paths.append(path_variant)
+
+    # 各リストの合計の長さを表示する
+    print('Length:')
+    for name, subset_list in (('eval', eval_list), ('dev', dev_list), ('train', train_list)):
+        seconds = sum(lengths[utt_id]['seconds'] for utt_id in subset_list)
+        frames = sum(lengths[utt_id]['frames'] for utt_id in subset_list)
+        print(
+            f'- {name:6s}: {seconds / 60:8.1f} min, {frames:9d} frames '
+            f'(frame period {frame_period} ms)'
+        )
+
     # 結果を表示
     print('Generated train list:')
     print('- utt_list   :', path_utt_list)
     print('- dev_list   :', path_dev_list)
     print('- eval_list  :', path_eval_list)
     print('- train_list :', path_train_list)
+    print('- manifest   :', path_manifest)
+    for path_variant in variant_paths:
+        print('-', path_variant)
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     フォルダを指定して実行
@@ -185,7 +410,15 @@ def main(path_config_yaml):
     with open(path_config_yaml, encoding='utf-8') as fy:
         config = yaml.safe_load(fy)
     out_dir = Path(expanduser(config['out_dir']))
-    generate_train_list(out_dir, interval=11, select_by='segment')
+    generate_train_list(
+        out_dir,
+        interval=11,
+        select_by=config.get('list_by') or 'segment',
+        split_method=config.get('list_split_method') or 'position',
+        frame_period=frame_period_from_config(config, path_config_yaml),
+        variants=config.get('train_list_variants') or (),
+        bucket_size=config.get('train_list_bucket_size') or DEFAULT_BUCKET_SIZE,
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+ステージ0を差分だけ実行する。
+
+{out_dir}/.stage0_cache.json に、曲ごとの UST・LAB・WAV のハッシュと、
+変換テーブルおよび関連する設定値のハッシュを記録する。
+前回から変わっていない曲はすべてのステップをスキップし、
+追加・変更された曲だけを single_pass で処理する。
+削除された曲と除外された曲の出力ファイルは削除する。
+
+変換テーブルや max_pause_duration などの設定値が変わった場合は全曲を処理しなおす。
+"""
+
+import hashlib
+import json
+import logging
+import shutil
+from glob import escape, glob
+from os import makedirs, remove, replace, stat
+from os.path import basename, exists, expanduser, join, splitext
+from shutil import rmtree
+from sys import argv
+
+import yaml
+from natsort import natsorted
+from tqdm.contrib.concurrent import process_map
+
+try:
+    from . import (
+        audio_index,
+        check_wav,
+        copy_files,
+        generate_train_list,
+        single_pass,
+        tracing,
+    )
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import check_wav
+    import copy_files
+    import generate_train_list
+    import single_pass
+    import tracing
+
+# キャッシュの形式や処理内容を変えたときに増やす
+CACHE_VERSION = 1
+MANIFEST_NAME = '.stage0_cache.json'
+SOURCE_EXTENSIONS = ('ust', 'lab', 'wav')
+# 曲ごとの出力内容に影響する設定値
+# (list_by などリストの設定は、毎回リストを作りなおすので含めない。
+#  stage0_copy_mode はこのモードでは使わず、常にコピーする。)
+CONFIG_KEYS = (
+    'max_pause_duration',
+    'max_segment_length',
+    'segment_mode',
+    'segment_target_length',
+    'keep_intermediate_files',
+    'vowel_duration_check',
+    'stage0_file_layout',
+)
+# 曲ごとのファイルが出力されるフォルダ
+OUTPUT_SUBDIRS = (
+    'ust',
+    'lab',
+    'wav',
+    'full_score',
+    'full_score_round',
+    'mono_align_round',
+    'mono_score_round',
+    'full_align_round',
+    'mono_score_round_seg',
+    'full_score_round_seg',
+    'mono_align_round_seg',
+    'full_align_round_seg',
+    'timelag/label_phone_align',
+    'timelag/label_phone_score',
+    'duration/label_phone_align',
+    'acoustic/wav',
+    'acoustic/label_phone_align',
+    'acoustic/label_phone_score',
+)
+
+
+def file_digest(path, previous: dict | None = None) -> dict:
+    """
+    ファイルのハッシュを計算する。
+    パスとサイズと更新時刻が前回と同じ場合は、前回のハッシュをそのまま使う。
+    """
+    st = stat(path)
+    if (
+        previous is not None
+        and previous['path'] == path
+        and previous['size'] == st.st_size
+        and previous['mtime_ns'] == st.st_mtime_ns
+    ):
+        return previous
+    with open(path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+
+
+def settings_digest(config, path_table) -> str:
+    """
+    変換テーブルと、出力内容に影響する設定値のハッシュを計算する。
+    """
+    with open(path_table, 'rb') as f:
+        table_sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    settings = {
+        'cache_version': CACHE_VERSION,
+        'table': table_sha256,
+        **{key: config.get(key) for key in CONFIG_KEYS},
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def find_source_files(db_root) -> dict[str, dict[str, str]]:
+    """
+    歌唱DB内の UST・LAB・WAV を曲名ごとにまとめる。
+    copy_files と同じく、同名のファイルが複数ある場合は後に見つかったものを使う。
+    """
+    source_files: dict[str, dict[str, str]] = {}
+    target_files = copy_files.find_target_files(db_root, SOURCE_EXTENSIONS)
+    for ext in SOURCE_EXTENSIONS:
+        for path in target_files[ext]:
+            songname = splitext(basename(path))[0]
+            source_files.setdefault(songname, {})[ext] = path
+    return source_files
+
+
+def load_manifest(path_manifest) -> dict:
+    """
+    キャッシュの記録を読み取る。ない場合や壊れている場合は空にする。
+    """
+    try:
+        with open(path_manifest, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path_manifest, manifest: dict):
+    """
+    キャッシュの記録を保存する。途中で中断しても壊れないように置き換えで保存する。
+    """
+    path_tmp = f'{path_manifest}.tmp'
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    replace(path_tmp, path_manifest)
+
+
+def remove_song_outputs(out_dir, songname):
+    """
+    1曲分の出力ファイル (songname.* と songname__seg*) を削除する。
+    """
+    for subdir in OUTPUT_SUBDIRS:
+        for pattern in (f'{escape(songname)}.*', f'{escape(songname)}__seg*'):
+            for path in glob(join(out_dir, subdir, pattern)):
+                remove(path)
+
+
+def copy_song_files(song_files: dict[str, str], out_dir):
+    """
+    1曲分の UST・LAB・WAV を出力先フォルダにコピーする。
+    copy_files と同じく、コピー先のファイルの拡張子は小文字にそろえる。
+    """
+    for ext, path in song_files.items():
+        makedirs(join(out_dir, ext), exist_ok=True)
+        shutil.copy2(path, join(out_dir, ext, f'{splitext(basename(path))[0]}.{ext}'))
+
+
+def check_song_files(source_files: dict[str, dict[str, str]]):
+    """
+    UST または LAB がある曲について、UST と LAB と WAV がそろっているか点検する。
+    """
+    incomplete_songs = [
+        natsorted(files.values())
+        for files in source_files.values()
+        if ('ust' in files or 'lab' in files) and len(files) != len(SOURCE_EXTENSIONS)
+    ]
+    if len(incomplete_songs) != 0:
+        for files in incomplete_songs:
+            logging.error('UST・LAB・WAVファイルがそろっていません: %s', files)
+        raise ValueError(
+            'UST・LAB・WAVファイルの名前が一致しませんでした。ファイル名を点検してください'
+        )
+
+
+@tracing.traced
+def main(path_config_yaml):
+    """
+    前回から変わった曲だけ、ステージ0の処理をする。
+    """
+    with open(path_config_yaml, encoding='utf-8') as fy:
+        config = yaml.safe_load(fy)
+    db_root = expanduser(config['db_root']).strip('"')
+    out_dir = config['out_dir'].strip('"')
+    if 'table_path' in config:
+        path_table = config['table_path'].strip('"')
+    else:
+        path_table = config['utaupy_table_path'].strip('"')
+    path_manifest = join(out_dir, MANIFEST_NAME)
+
+    # 設定が変わっていたら、全曲処理しなおす。
+    manifest = load_manifest(path_manifest)
+    settings = settings_digest(config, path_table)
+    if manifest.get('settings') != settings:
+        if exists(out_dir):
+            print(f'Settings changed. Removing existing output directory: {out_dir}')
+            rmtree(out_dir, ignore_errors=True)
+        manifest = {'settings': settings, 'songs': {}}
+    copy_files.make_gitignore(out_dir)
+
+    # 歌唱DB内のファイルを曲ごとにまとめる
+    source_files = find_source_files(db_root)
+    check_song_files(source_files)
+    songnames = []
+    for songname in natsorted(source_files):
+        if 'ust' not in source_files[songname]:
+            continue
+        if songname in config['exclude_songs']:
+            print(f'Skip excluded song: {songname}')
+        else:
+            songnames.append(songname)
+
+    # ハッシュを比較して、変更された曲を探す
+    print(f'Hashing UST, LAB and WAV files in "{db_root}"')
+    cached_songs = manifest['songs']
+    unchanged_songs = {}
+    changed_songnames = []
+    current_digests = {}
+    for songname in songnames:
+        cached_song = cached_songs.get(songname, {})
+        cached_digests = cached_song.get('files', {})
+        digests = {
+            ext: file_digest(source_files[songname][ext], cached_digests.get(ext))
+            for ext in SOURCE_EXTENSIONS
+        }
+        current_digests[songname] = digests
+        # 更新時刻だけが変わった場合は、変更されていないとみなす。
+        if {ext: d['sha256'] for ext, d in digests.items()} == {
+            ext: d['sha256'] for ext, d in cached_digests.items()
+        }:
+            unchanged_songs[songname] = {**cached_song, 'files': digests}
+        else:
+            changed_songnames.append(songname)
+    removed_songnames = [songname for songname in cached_songs if songname not in songnames]
+    print(
+        f'Unchanged: {len(unchanged_songs)} songs, '
+        f'Changed: {len(changed_songnames)} songs, '
+        f'Removed: {len(removed_songnames)} songs'
+    )
+
+    # 変更された曲と削除された曲の出力ファイルを削除する。
+    # 処理が途中で止まっても再実行されるよう、先に記録から外しておく。
+    for songname in removed_songnames + changed_songnames:
+        remove_song_outputs(out_dir, songname)
+    manifest['songs'] = unchanged_songs
+    save_manifest(path_manifest, manifest)
+
+    if len(changed_songnames) != 0:
+        # 変更された曲のファイルをコピーする
+        print(f'Copy files of changed songs from "{db_root}" to "{out_dir}"')
+        for songname in changed_songnames:
+            copy_song_files(source_files[songname], out_dir)
+
+        # wavファイルのフォーマットが適切か点検する。変わっていない曲は記録した情報を使う。
+        audio_index.main(path_config_yaml)
+        print('Checking WAV files')
+        audio_info = process_map(
+            check_wav.get_audio_info,
+            [join(out_dir, 'wav', f'{songname}.wav') for songname in changed_songnames],
+            colour='blue',
+        )
+        all_audio_info = [song['audio_info'] for song in unchanged_songs.values()] + audio_info
+        check_wav.raise_if_invalid(*check_wav.validate_audio_info(all_audio_info))
+
+        # 変更された曲を処理する。統計値には変わっていない曲の値も含める。
+        cached_duration_differences = []
+        for song in unchanged_songs.values():
+            cached_duration_differences += song['duration_differences']
+        song_results = single_pass.run_single_pass(
+            config, changed_songnames, cached_duration_differences
+        )
+
+        # 処理に成功した曲を記録する
+        for songname, info in zip(changed_songnames, audio_info):
+            manifest['songs'][songname] = {
+                'files': current_digests[songname],
+                'audio_info': info,
+                **song_results[songname],
+            }
+        manifest['songs'] = {
+            songname: manifest['songs'][songname] for songname in natsorted(manifest['songs'])
+        }
+        save_manifest(path_manifest, manifest)
+
+    # listを作成する
+    generate_train_list.main(path_config_yaml)
+
+
+if __name__ == '__main__':
+    if len(argv) == 1:
+        main('config.yaml')
+    else:
+        main(argv[1].strip('"'))
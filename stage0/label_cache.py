@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+読み取ったLABファイルをキャッシュして、同じファイルを何度も読み取らないようにする。
+
+ファイルのパス・サイズ・更新時刻 (ns) をキーにして、以下の2段階でキャッシュする。
+ファイルが書き換えられるとサイズか更新時刻が変わるので、古い内容は使われない。
+
+- プロセス内の LRU キャッシュ (合計サイズが MAX_CACHE_BYTES を超えたら古いものから捨てる)
+- enable() で指定したフォルダに保存する .npz ファイル
+  (子プロセスや次回の実行でも使える。指定しなければ使わない。)
+
+更新時刻の精度が粗いファイルシステムでは、同じサイズで書き換えても更新時刻が変わらないことがある。
+そのため、キャッシュした時点で更新から RACY_WINDOW_NS 経っていなかったファイルは、
+内容のハッシュも比較してから使う。
+
+load() は compact_label.CompactLabel を、load_label() は utaupy.label.Label を返す。
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from os import environ, getpid, makedirs, replace, stat
+from os.path import abspath, join
+
+import numpy as np
+
+try:
+    from . import compact_label
+except ImportError:  # スクリプトとして実行した場合
+    import compact_label
+
+ENV_CACHE_DIR = 'STAGE0_LABEL_CACHE_DIR'
+# プロセス内でキャッシュするラベルの合計サイズの上限[byte]
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# 更新時刻だけでは変更を検出できないおそれがある期間[ns] (FAT の更新時刻の精度が2秒のため)
+RACY_WINDOW_NS = 2 * 10**9
+
+# {絶対パス: _Entry}
+_cache: OrderedDict = OrderedDict()
+_state = {'bytes': 0, 'hits': 0, 'misses': 0}
+
+
+class _Entry:
+    """
+    キャッシュした1ファイル分のラベル
+    """
+
+    def __init__(self, size, mtime_ns, digest, label, cached_at_ns):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.label = label
+        # 更新時刻の直後にキャッシュした場合は、ハッシュも比較する。
+        self.racy = cached_at_ns < mtime_ns + RACY_WINDOW_NS
+
+    @property
+    def nbytes(self) -> int:
+        """
+        キャッシュしたラベルのおおよそのサイズ[byte]
+        """
+        label = self.label
+        return (
+            label.starts.nbytes
+            + label.ends.nbytes
+            + label.context_offsets.nbytes
+            + len(label.context_text)
+        )
+
+
+def enable(cache_dir):
+    """
+    .npz ファイルへのキャッシュを有効にする。子プロセスにも引き継ぐ。
+    """
+    makedirs(cache_dir, exist_ok=True)
+    environ[ENV_CACHE_DIR] = cache_dir
+
+
+def clear():
+    """
+    プロセス内のキャッシュを削除する。
+    """
+    _cache.clear()
+    _state.update(bytes=0, hits=0, misses=0)
+
+
+def stats() -> dict:
+    """
+    プロセス内のキャッシュの使用状況を返す。
+    """
+    return {'entries': len(_cache), **_state}
+
+
+def _read_text(path) -> tuple[str, bytes]:
+    """
+    LABファイルを読み取って、(文字列, 内容のハッシュ) を返す。
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    return text, hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def _remember(path, entry: _Entry):
+    """
+    プロセス内のキャッシュに追加する。同じパスの古い内容は置き換える。
+    """
+    if path in _cache:
+        _state['bytes'] -= _cache.pop(path).nbytes
+    _cache[path] = entry
+    _state['bytes'] += entry.nbytes
+    while _state['bytes'] > MAX_CACHE_BYTES and len(_cache) > 1:
+        _, old_entry = _cache.popitem(last=False)
+        _state['bytes'] -= old_entry.nbytes
+
+
+def _sidecar_path(cache_dir, path) -> str:
+    """
+    LABファイルに対応する .npz ファイルのパスを返す。
+    """
+    return join(cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + '.npz')
+
+
+def _load_sidecar(cache_dir, path):
+    """
+    .npz ファイルからキャッシュを読み取る。読み取れなければ None を返す。
+    """
+    try:
+        with np.load(_sidecar_path(cache_dir, path)) as npz:
+            size, mtime_ns, cached_at_ns = npz['stat'].tolist()
+            label = compact_label.CompactLabel(
+                npz['starts'],
+                npz['ends'],
+                npz['context_text'].tobytes().decode('utf-8'),
+                npz['context_offsets'],
+            )
+            return _Entry(size, mtime_ns, npz['digest'].tobytes(), label, cached_at_ns)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_sidecar(cache_dir, path, entry: _Entry, cached_at_ns):
+    """
+    キャッシュを .npz ファイルに保存する。並列処理中でも壊れないよう、一時ファイルを置き換える。
+    """
+    path_npz = _sidecar_path(cache_dir, path)
+    path_tmp = f'{path_npz[:-4]}.{getpid()}.tmp.npz'
+    label = entry.label
+    np.savez(
+        path_tmp,
+        stat=np.array([entry.size, entry.mtime_ns, cached_at_ns], dtype=np.int64),
+        digest=np.frombuffer(entry.digest, dtype=np.uint8),
+        starts=label.starts,
+        ends=label.ends,
+        context_text=np.frombuffer(label.context_text.encode('utf-8'), dtype=np.uint8),
+        context_offsets=label.context_offsets,
+    )
+    replace(path_tmp, path_npz)
+
+
+def _is_fresh(entry, size, mtime_ns, path) -> bool:
+    """
+    キャッシュがファイルの現在の内容と一致するかどうかを返す。
+    """
+    if entry is None or (entry.size, entry.mtime_ns) != (size, mtime_ns):
+        return False
+    if entry.racy:
+        verified_at_ns = time.time_ns()
+        if _read_text(path)[1] != entry.digest:
+            return False
+        # 更新から十分経ってから内容を確認できたので、以降は更新時刻だけで判定する。
+        entry.racy = verified_at_ns < mtime_ns + RACY_WINDOW_NS
+    return True
+
+
+def load(path) -> compact_label.CompactLabel:
+    """
+    LABファイルを CompactLabel として読み取る。
+    キャッシュがあればそれを使う。戻り値を変更してもキャッシュには影響しない。
+    """
+    path = abspath(str(path).strip('"'))
+    st = stat(path)
+    entry = _cache.get(path)
+    if _is_fresh(entry, st.st_size, st.st_mtime_ns, path):
+        _cache.move_to_end(path)
+        _state['hits'] += 1
+        return entry.label.copy()
+    cache_dir = environ.get(ENV_CACHE_DIR)
+    if cache_dir:
+        entry = _load_sidecar(cache_dir, path)
+        was_racy = entry is not None and entry.racy
+        if _is_fresh(entry, st.st_size, st.st_mtime_ns, path):
+            _remember(path, entry)
+            if was_racy and not entry.racy:
+                _save_sidecar(cache_dir, path, entry, time.time_ns())
+            _state['hits'] += 1
+            return entry.label.copy()
+    _state['misses'] += 1
+    text, digest = _read_text(path)
+    cached_at_ns = time.time_ns()
+    entry = _Entry(st.st_size, st.st_mtime_ns, digest, compact_label.parse(text), cached_at_ns)
+    _remember(path, entry)
+    if cache_dir:
+        _save_sidecar(cache_dir, path, entry, cached_at_ns)
+    return entry.label.copy()
+
+
+def load_label(path):
+    """
+    LABファイルを utaupy.label.Label として読み取る。キャッシュがあればそれを使う。
+    """
+    return load(path).to_label()
+
+
+def write(label, path_out):
+    """
+    ラベルをLABファイルに書き出す。
+    label: compact_label.CompactLabel または utaupy.label.Label
+
+    CompactLabel の場合は、書き出した内容をそのままキャッシュする。
+    """
+    path = abspath(str(path_out).strip('"'))
+    if not isinstance(label, compact_label.CompactLabel):
+        label.write(path)
+        if path in _cache:
+            _state['bytes'] -= _cache.pop(path).nbytes
+        return
+    _write_text(path, label.to_text(), label)
+
+
+def _write_text(path, text, label):
+    """
+    ラベルの内容をLABファイルに書き出して、キャッシュする。
+    text: label.to_text() と同じ文字列
+    """
+    with open(path, mode='w', encoding='utf-8', newline='\n') as f:
+        f.write(text)
+    st = stat(path)
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    cached_at_ns = time.time_ns()
+    entry = _Entry(st.st_size, st.st_mtime_ns, digest, label.copy(), cached_at_ns)
+    _remember(path, entry)
+    cache_dir = environ.get(ENV_CACHE_DIR)
+    if cache_dir:
+        _save_sidecar(cache_dir, path, entry, cached_at_ns)
+
+
+def write_ranges(label, ranges, paths_out):
+    """
+    CompactLabel の音素の範囲ごとにLABファイルを書き出す。
+    ranges: [(開始位置, 終了位置), ...]
+    paths_out: 範囲ごとの出力先
+
+    ラベル全体の文字列を一度だけ作り、各範囲の行をそこから切り出して書き出す。
+    """
+    lines = label.lines()
+    text = '\n'.join(lines)
+    # 各行の先頭の位置。最後に末尾の位置 (改行の分を含む) を加える。
+    line_offsets = np.concatenate(([0], np.cumsum([len(line) + 1 for line in lines]))).tolist()
+    for (start_idx, end_idx), path_out in zip(ranges, paths_out):
+        path = abspath(str(path_out).strip('"'))
+        segment_text = text[line_offsets[start_idx] : max(line_offsets[end_idx] - 1, 0)]
+        _write_text(path, segment_text, label[start_idx:end_idx])
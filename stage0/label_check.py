@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+LABファイルの発声時刻を、ファイルごとに配列でまとめて点検・修正する。
+
+- 発声時間が負の音素 (negative_duration)
+- 発声時間が閾値未満の音素 (too_short)
+- 直前の音素の終了時刻と開始時刻が一致しない音素 (discontinuous)
+- 開始時刻が直前の音素より前に戻っている音素 (unordered)
+- 短い音素を修正できないもの (unrepairable)
+
+各ファイルは一度だけ読み取り、修正した場合も一度だけ書き出す。
+複数のファイルはプロセスプールで並列に処理し、見つかった不具合をすべて JSON で出力できる。
+点検の合否は utaupy.label.Label.is_valid と同じ。(エラーのログも同じ内容を出力する。)
+"""
+
+import json
+import logging
+from functools import partial
+from os import replace
+from sys import argv
+
+import numpy as np
+from tqdm.contrib.concurrent import process_map
+
+try:
+    from . import label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import label_cache
+    import tracing
+
+# 出力する JSON の形式を変えたときに増やす
+REPORT_VERSION = 1
+
+
+def _problem(kind, label, i, **kwargs) -> dict:
+    """
+    不具合1件分の記録を作る。
+    """
+    return {
+        'kind': kind,
+        'index': int(i),
+        'start': int(label.starts[i]),
+        'end': int(label.ends[i]),
+        'context': label.context(i),
+        **kwargs,
+    }
+
+
+def find_problems(label, threshold=0) -> list[dict]:
+    """
+    compact_label.CompactLabel の不具合をすべて探して、音素の順に返す。
+    threshold: 許容される最小の発声時間(ms)
+    """
+    threshold_100ns = int(threshold * (10**4))
+    starts = label.starts
+    ends = label.ends
+    durations = ends - starts
+    problems = []
+    for i in np.flatnonzero(durations < 0).tolist():
+        problems.append(_problem('negative_duration', label, i, duration=int(durations[i])))
+    for i in np.flatnonzero((durations >= 0) & (durations < threshold_100ns)).tolist():
+        problems.append(_problem('too_short', label, i, duration=int(durations[i])))
+    if len(label) >= 2:
+        for i in (np.flatnonzero(starts[1:] < starts[:-1]) + 1).tolist():
+            problems.append(_problem('unordered', label, i, previous_start=int(starts[i - 1])))
+    # utaupy と同じく、音素が3つ以上の場合だけ前後の時刻のつながりを点検する。
+    if len(label) >= 3:
+        for i in (np.flatnonzero(starts[1:] != ends[:-1]) + 1).tolist():
+            problems.append(_problem('discontinuous', label, i, previous_end=int(ends[i - 1])))
+    problems.sort(key=lambda problem: problem['index'])
+    return problems
+
+
+def check_label(label, path_lab, threshold=0, repair_threshold=None) -> dict:
+    """
+    check_file の本体。読み取り済みの CompactLabel を点検して、結果を返す。
+    repair_threshold を指定した場合は、点検に通過したラベルの短すぎる音素(ms)を修正する。
+    label 自体を書き換え、ファイルには書き出さない。
+    threshold を None にした場合は、点検せずに修正だけを行う。
+    """
+    # 合否とエラーのログは utaupy と同じにする。
+    valid = threshold is None or label.is_valid(threshold)
+    result = {
+        'path': str(path_lab),
+        'num_phonemes': len(label),
+        'valid': valid,
+        'problems': find_problems(label, threshold) if not valid else [],
+        'repairs': [],
+    }
+    if not valid or repair_threshold is None:
+        return result
+    starts_before = label.starts.copy()
+    try:
+        label.repair_too_short_phonemes(repair_threshold, str(path_lab))
+    except ValueError as e:
+        logging.error('%s', e)
+        result['valid'] = False
+        result['problems'].append(_problem('unrepairable', label, 0, message=str(e)))
+        return result
+    for i in np.flatnonzero(label.starts != starts_before).tolist():
+        result['repairs'].append(
+            {
+                'index': i,
+                'start_before': int(starts_before[i]),
+                'start_after': int(label.starts[i]),
+                'context': label.context(i),
+            }
+        )
+    return result
+
+
+@tracing.traced
+def check_file(path_lab, threshold=0, repair_threshold=None) -> dict:
+    """
+    1つのLABファイルを点検して、結果を返す。(並列処理用)
+    repair_threshold を指定した場合は、点検に通過したファイルの短すぎる音素(ms)を修正して、
+    修正があれば一度だけ上書き保存する。
+    threshold を None にした場合は、点検せずに修正だけを行う。
+    """
+    label = label_cache.load(path_lab)
+    result = check_label(label, path_lab, threshold, repair_threshold)
+    if len(result['repairs']) != 0:
+        label_cache.write(label, path_lab)
+    return result
+
+
+def check_files(lab_files, threshold=0, repair_threshold=None) -> list[dict]:
+    """
+    複数のLABファイルをプロセスプールで点検して、ファイルごとの結果のリストを返す。
+    """
+    func = partial(check_file, threshold=threshold, repair_threshold=repair_threshold)
+    return process_map(
+        func,
+        [str(path) for path in lab_files],
+        colour='blue',
+        chunksize=max(1, len(lab_files) // 64),
+    )
+
+
+def invalid_files(results: list[dict]) -> list[str]:
+    """
+    点検に通過しなかったLABファイルの一覧を返す。
+    """
+    return [result['path'] for result in results if not result['valid']]
+
+
+def make_report(results: list[dict], threshold=0, repair_threshold=None) -> dict:
+    """
+    点検結果を、JSON に出力する形式にまとめる。
+    不具合も修正もなかったファイルは、件数だけ数える。
+    """
+    return {
+        'version': REPORT_VERSION,
+        'threshold_ms': threshold,
+        'repair_threshold_ms': repair_threshold,
+        'num_files': len(results),
+        'num_invalid_files': sum(not result['valid'] for result in results),
+        'num_repaired_files': sum(len(result['repairs']) != 0 for result in results),
+        'files': [result for result in results if result['problems'] or result['repairs']],
+    }
+
+
+def save_report(path_report, report: dict):
+    """
+    点検結果を JSON に保存する。途中で中断しても壊れないように置き換えで保存する。
+    """
+    path_tmp = f'{path_report}.tmp'
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    replace(path_tmp, path_report)
+
+
+if __name__ == '__main__':
+    # usage: label_check.py 出力するJSON LABファイル...
+    results = check_files(argv[2:])
+    save_report(argv[1], make_report(results))
+    print(f'{len(invalid_files(results))} / {len(results)} files are invalid.')
@@ -2,20 +2,36 @@
 # Copyright (c) 2021-2025 oatsu
 """
 フルラベル中の休符を結合して上書きする。
-いったんSongオブジェクトを経由するので、
+結果はいったんSongオブジェクトを経由した場合と同じになるので、
 utaupyの仕様に沿ったフルラベルになってしまうことに注意。
 """
 
+import re
 from copy import copy
+from decimal import ROUND_HALF_UP, Decimal
 from glob import glob
+from itertools import pairwise
 from sys import argv
 
 import utaupy
 import yaml
 from tqdm.contrib.concurrent import process_map
-from utaupy.hts import Song
+from utaupy.hts import (
+    BREAKS,
+    PAUSES,
+    SILENCES,
+    VOWELS,
+    Song,
+    adjust_break_contexts,
+    adjust_pau_contexts,
+)
 from utaupy.label import Label
 
+try:
+    from . import tracing
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+
 
 def merge_rests_full(song: Song) -> Song:
     """
@@ -134,14 +150,331 @@ def remove_breath_mono(label: Label):
         label.data = new_data
 
 
-def _process_one_labfile(path_full: str) -> None:
-    """1つのフルラベルファイルを処理（並列処理用）"""
-    song = utaupy.hts.load(path_full).song
+# ---------------------------------------------------------------------------
+# Songオブジェクトを経由しない休符の結合
+# ---------------------------------------------------------------------------
+# utaupy.hts.OneLine と同じ区切り文字と書式
+_GROUP_SEPARATOR = re.compile('/.:')
+_CONTEXT_SEPARATOR = re.compile('[{}]'.format(re.escape('=+-~∼!@#$%^ˆ&;_|[]')))
+_P_FORMAT = '{}@{}^{}-{}+{}={}_{}%{}^{}_{}~{}-{}!{}[{}${}]{}'
+_A_FORMAT = '{}-{}-{}@{}~{}'
+_C_FORMAT = '{}+{}+{}@{}&{}'
+_D_FORMAT = '{}!{}#{}${}%{}|{}&{};{}-{}'
+_E_FORMAT = (
+    '{}]{}^{}={}~{}!{}@{}#{}+{}]{}${}|{}[{}&{}]{}={}^{}~{}#{}_{};{}${}&{}%{}[{}|{}]{}-{}^{}'
+    '+{}~{}={}@{}${}!{}%{}#{}|{}|{}-{}&{}&{}+{}[{};{}]{};{}~{}~{}^{}^{}@{}[{}#{}={}!{}~{}'
+    '+{}!{}^{}'
+)
+_F_FORMAT = '{}#{}#{}-{}${}${}+{}%{};{}'
+_J_FORMAT = '{}~{}@{}'
+# /G: /H: /I: は Songオブジェクトから書き出すと常に空欄になる。
+_EMPTY_PHRASE = 'xx_xx'
+_EMPTY_NOTE = ['xx'] * 9
+_EMPTY_SYLLABLE = ['xx'] * 5
+# A から J までの各コンテキストの項目数 (P は別に扱う)
+_N_FIELDS = (5, 5, 5, 9, 60, 9, 2, 2, 2, 3)
+
+
+def _language_independent_identity(identity: str) -> str:
+    """
+    音素記号から p1 を求める。utaupy.hts.Song.autofill と同じ。
+    """
+    if identity == 'xx':
+        return 'xx'
+    if identity in VOWELS:
+        return 'v'
+    if identity in PAUSES:
+        return 'p'
+    if identity in SILENCES:
+        return 's'
+    if identity in BREAKS:
+        return 'b'
+    return 'c'
+
+
+def _length_100ns(length, tempo: str) -> Decimal:
+    """
+    ノート長を100ns単位で返す。utaupy.hts.Note.length_100ns と同じ計算。
+    """
+    return Decimal(25000000 * int(length) / Decimal(tempo))
+
+
+def _parse_lines(lines: list[str]):
+    """
+    フルラベルの各行を P の文字列, P の項目のリスト, A-J の文字列のリスト に分ける。
+    Songオブジェクトを経由した場合と同じ結果にできない行があれば None を返す。
+    """
+    p_strings = []
+    p_fields = []
+    groups = []
+    for line in lines:
+        v = line.split(maxsplit=2)
+        # 読み取るときだけ使われる区切り文字は、書き出すときに置き換わってしまう。
+        if len(v) != 3 or '∼' in v[2] or 'ˆ' in v[2]:
+            return None
+        line_groups = _GROUP_SEPARATOR.split(v[2])
+        if len(line_groups) != 11:
+            return None
+        p = _CONTEXT_SEPARATOR.split(line_groups[0])
+        if len(p) != 16:
+            return None
+        p_strings.append(line_groups[0])
+        p_fields.append(p)
+        groups.append(line_groups[1:])
+    return p_strings, p_fields, groups
+
+
+def _split_group(groups: list[str], index: int) -> list[str] | None:
+    """
+    A-J のうち1つのコンテキストを項目のリストにする。項目数が合わなければ None を返す。
+    """
+    fields = _CONTEXT_SEPARATOR.split(groups[index])
+    if len(fields) != _N_FIELDS[index]:
+        return None
+    return fields
+
+
+def _group_notes(p_fields, groups):
+    """
+    行をノートと音節に分ける。utaupy.hts.HTSFullLabel.generate_songobj と同じ規則。
+    (ノートの開始行のリスト, 音節の開始行のリスト) を返す。
+    Songオブジェクトを経由した場合と同じ結果にできない並びなら None を返す。
+    """
+    note_starts = []
+    syllable_starts = []
+    previous_is_rest = True
+    for i, p in enumerate(p_fields):
+        # Songオブジェクトでは p1 を音素記号から補完し直すので、一致しない場合は扱わない。
+        if p[0] != _language_independent_identity(p[3]):
+            return None
+        is_rest = p[0] in ('s', 'p')
+        if is_rest:
+            new_note = True
+            new_syllable = True
+        else:
+            new_syllable = p[11] == '1'
+            new_note = False
+            if new_syllable:
+                b = _split_group(groups[i], 1)
+                if b is None:
+                    return None
+                new_note = b[1] == '1'
+            # 休符の音節やノートに音符の音素が入る並びは扱わない。
+            if not new_note and (i == 0 or previous_is_rest):
+                return None
+        if new_note:
+            note_starts.append(i)
+        if new_syllable:
+            syllable_starts.append(i)
+        previous_is_rest = is_rest
+    return note_starts, syllable_starts
+
+
+def _merge_rests_full_lines(lines: list[str]) -> list[str] | None:
+    """
+    merge_rests_full と reset_time をフルラベルの行に直接行う。
+    読み取ったコンテキストの配列のうち、休符の結合で変わる項目だけを書き換える。
+
+    utaupy で書き出したフルラベル (ust2lab の出力) を前提にしている。
+    扱えない形式の場合は None を返す。
+    """
+    if not lines:
+        return None
+    parsed = _parse_lines(lines)
+    if parsed is None:
+        return None
+    p_strings, p_fields, groups = parsed
+    grouped = _group_notes(p_fields, groups)
+    if grouped is None:
+        return None
+    note_starts, syllable_starts = grouped
+    n_lines = len(lines)
+
+    # 休符をすべて pau にする。
+    renamed = [False] * n_lines
+    for i, p in enumerate(p_fields):
+        if p[3] == 'sil':
+            p[3] = 'pau'
+            p[0] = 'p'
+            renamed[i] = True
+
+    # ノートごとの E を読み取って、連続する休符を結合する。
+    # notes: [開始行, 終了行(含まない), E の項目, 休符かどうか, E を書き換えたかどうか]
+    notes = []
+    for i_note, start in enumerate(note_starts):
+        end = note_starts[i_note + 1] if i_note + 1 < len(note_starts) else n_lines
+        e = _split_group(groups[start], 4)
+        if e is None:
+            return None
+        # reset_time できないノートがある場合は、Songオブジェクトを経由したときと同じ例外にする。
+        if 'xx' in (e[4], e[7]):
+            return None
+        is_rest = p_fields[start][0] in ('s', 'p')
+        if notes:
+            prev = notes[-1]
+            prev_e = prev[2]
+            # 転調したり拍子やテンポが変わっていない場合のみ結合する。
+            if is_rest and prev[3] and e[2:5] == prev_e[2:5]:
+                # 直前のノート(休符)の長さを延長して、この休符の行は捨てる。
+                prev_e[7] = int(prev_e[7]) + int(e[7])
+                prev_e[6] = Decimal(_length_100ns(prev_e[7], prev_e[4]) / 100000).quantize(
+                    Decimal('0'), rounding=ROUND_HALF_UP
+                )
+                prev[4] = True
+                continue
+        notes.append([start, end, e, is_rest, False])
+
+    # 残す行
+    kept = []
+    for start, end, *_ in notes:
+        kept.extend(range(start, end))
+    is_syllable_start = [False] * n_lines
+    for i in syllable_starts:
+        is_syllable_start[i] = True
+
+    # P: 前後2つずつの音素記号とフラグを詰め直す。
+    identities = ['xx', 'xx'] + [p_fields[i][3] for i in kept] + ['xx', 'xx']
+    flags = ['xx', 'xx'] + [p_fields[i][8] for i in kept] + ['xx', 'xx']
+    new_p = []
+    for j, i in enumerate(kept):
+        p = p_fields[i]
+        window = (identities[j], identities[j + 1], identities[j + 3], identities[j + 4])
+        flag_window = (flags[j], flags[j + 1], flags[j + 3], flags[j + 4])
+        if (
+            not renamed[i]
+            and (p[1], p[2], p[4], p[5]) == window
+            and (p[6], p[7], p[9], p[10]) == flag_window
+        ):
+            new_p.append(None)
+        else:
+            p[1], p[2], p[4], p[5] = window
+            p[6], p[7], p[9], p[10] = flag_window
+            new_p.append(_P_FORMAT.format(*p))
+
+    # 結合した休符と、その前後のノートの A, C, D, E, F を書き換える。
+    # {行: {A-J の番号: 文字列}}
+    patches = {}
+    for i_note, (start, _, e, _, modified) in enumerate(notes):
+        if not modified:
+            continue
+        rest_b = _split_group(groups[start], 1)
+        if i_note + 1 < len(notes):
+            next_start, next_end = notes[i_note + 1][:2]
+            next_e = notes[i_note + 1][2][:9]
+            next_b = _split_group(groups[next_start], 1)
+        else:
+            next_start = next_end = n_lines
+            next_e = _EMPTY_NOTE
+            next_b = _EMPTY_SYLLABLE
+        if rest_b is None or next_b is None:
+            return None
+        patch = patches.setdefault(start, {})
+        patch[2] = _C_FORMAT.format(*next_b)
+        patch[4] = _E_FORMAT.format(*e)
+        patch[5] = _F_FORMAT.format(*next_e)
+        if i_note > 0:
+            prev_start, prev_end = notes[i_note - 1][:2]
+            f = _F_FORMAT.format(*e[:9])
+            for i in range(prev_start, prev_end):
+                patches.setdefault(i, {})[5] = f
+        d = _D_FORMAT.format(*e[:9])
+        a = _A_FORMAT.format(*rest_b)
+        for i in range(next_start, next_end):
+            patch = patches.setdefault(i, {})
+            patch[3] = d
+            # 次のノートの最初の音節だけ、直前の音節が変わる。
+            if i > next_start and is_syllable_start[i]:
+                a = None
+            if a is not None:
+                patch[0] = a
+
+    # J は Songオブジェクトと同じく1行目のものをすべての行に使い、j3 (フレーズ数) を数え直す。
+    j = _split_group(groups[0], 9)
+    if j is None:
+        return None
+    n_phrases = 0 if notes[0][3] else 1
+    for prev, note in pairwise(notes):
+        if prev[3] and not note[3]:
+            n_phrases += 1
+    j[2] = n_phrases
+    new_j = _J_FORMAT.format(*j)
+
+    # 時刻をノート長から計算し直して、書き出す。
+    new_lines = []
+    t_start = 0
+    t_end = 0
+    j_line = 0
+    for start, end, e, *_ in notes:
+        t_end += _length_100ns(e[7], e[4])
+        str_start = str(Decimal(t_start).quantize(Decimal('0'), rounding=ROUND_HALF_UP))
+        str_end = str(Decimal(t_end).quantize(Decimal('0'), rounding=ROUND_HALF_UP))
+        for i in range(start, end):
+            line_groups = groups[i]
+            patch = patches.get(i)
+            if patch is not None:
+                line_groups = line_groups.copy()
+                for index, value in patch.items():
+                    line_groups[index] = value
+            p = new_p[j_line]
+            if p is None:
+                p = p_strings[i]
+            new_lines.append(
+                f'{str_start} {str_end} {p}'
+                f'/A:{line_groups[0]}/B:{line_groups[1]}/C:{line_groups[2]}'
+                f'/D:{line_groups[3]}/E:{line_groups[4]}/F:{line_groups[5]}'
+                f'/G:{_EMPTY_PHRASE}/H:{_EMPTY_PHRASE}/I:{_EMPTY_PHRASE}/J:{new_j}'
+            )
+            j_line += 1
+        t_start = t_end
+    return new_lines
+
+
+def _merge_rests_full_lines_with_song(lines: list[str]) -> list[str]:
+    """
+    Songオブジェクトを経由して休符を結合する。
+    utaupy.hts.Song.write(strict_sinsy_style=False) と同じ形式の行のリストを返す。
+    """
+    song = utaupy.hts.load(lines).song
     song = merge_rests_full(song)
     song.reset_time()
-    song.write(path_full, strict_sinsy_style=False, as_mono=False)
+    full_label = utaupy.hts.HTSFullLabel()
+    full_label.song = song
+    full_label.fill_contexts_from_songobj()
+    full_label = adjust_break_contexts(full_label)
+    full_label = adjust_pau_contexts(full_label, strict=False)
+    return [str(oneline) for oneline in full_label]
+
+
+def merge_rests_full_lines(lines: list[str]) -> list[str]:
+    """
+    フルラベルの行のリストの休符を結合して、時刻を計算し直した行のリストを返す。
+
+    Songオブジェクトを経由して merge_rests_full と reset_time を行い、
+    strict_sinsy_style=False で書き出した場合と同じ結果になる。
+    通常は行を直接書き換え、扱えない形式の場合だけ Songオブジェクトを経由する。
+    """
+    new_lines = _merge_rests_full_lines(lines)
+    if new_lines is None:
+        return _merge_rests_full_lines_with_song(lines)
+    return new_lines
+
+
+@tracing.traced
+def _process_one_labfile(path_full: str) -> None:
+    """1つのフルラベルファイルを処理（並列処理用）"""
+    # utaupy.hts.load と同じく、UTF-8 で読めなければ cp932 で読む。
+    try:
+        with open(path_full, encoding='utf-8') as f:
+            lines = [line.rstrip('\r\n') for line in f.readlines()]
+    except UnicodeDecodeError:
+        with open(path_full, encoding='cp932') as f:
+            lines = [line.rstrip('\r\n') for line in f.readlines()]
+    lines = merge_rests_full_lines(lines)
+    with open(path_full, mode='w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(lines))
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     musicxmlから生成されたラベルと、DBに同梱されていたラベルの、休符をすべて結合する。
@@ -10,11 +10,16 @@ from glob import glob
 from os.path import join
 from sys import argv
 
-import utaupy as up
 import yaml
-from tqdm import tqdm
+from tqdm.contrib.concurrent import process_map
 from utaupy.label import Label
 
+try:
+    from . import label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import label_cache
+    import tracing
+
 
 def merge_rests_mono(label: Label):
     """
@@ -41,14 +46,26 @@ def merge_rests_mono(label: Label):
     return new_label
 
 
+@tracing.traced
+def merge_rests_mono_labfile(path_lab):
+    """
+    モノラベルファイルの休符を結合して上書きする。
+    """
+    label = label_cache.load(path_lab).merge_rests()
+    label_cache.write(label, path_lab)
+
+
 def merge_rests_mono_labfiles(mono_lab_dir):
     mono_lab_files = glob(f'{mono_lab_dir}/*.lab')
-    for path_lab in tqdm(mono_lab_files):
-        label = up.label.load(path_lab)
-        label = merge_rests_mono(label)
-        label.write(path_lab)
+    process_map(
+        merge_rests_mono_labfile,
+        mono_lab_files,
+        colour='blue',
+        chunksize=max(1, len(mono_lab_files) // 64),
+    )
 
 
+@tracing.traced
 def main(path_config_yaml):
     with open(path_config_yaml, encoding='utf-8') as fy:
         config = yaml.safe_load(fy)
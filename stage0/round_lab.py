@@ -7,16 +7,68 @@ LABファイルの時刻丸めを行う。(5ms)
 
 {out_dir}/lab/*.lab -> {out_dir}/mono_align_round/*.lab
 {out_dir}/full_score/*.lab -> {out_dir}/full_score_round/*.lab
+
+DB同梱のモノラベルは、休符の結合 (merge_rest_mono_align) と丸めを続けて行う。
+休符を結合したモノラベルで {out_dir}/lab を上書きするのは、
+config の keep_intermediate_files が true のときだけにする。
 """
 
+from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import basename, join
 from sys import argv
 
-import utaupy as up
 import yaml
-from tqdm import tqdm
+from tqdm.contrib.concurrent import process_map
+
+try:
+    from . import label_cache, tracing
+except ImportError:  # スクリプトとして実行した場合
+    import label_cache
+    import tracing
+
+# 時刻を丸める基準[100ns]
+ROUND_STEP_SIZE = 50000
+
+
+@tracing.traced
+def round_lab_file(path_lab, path_lab_round, step_size):
+    """
+    LABファイルの発声時刻を丸めて、新たなファイルに保存する。
+    """
+    label = label_cache.load(path_lab)
+    label.round(step_size)
+    label_cache.write(label, path_lab_round)
+
+
+@tracing.traced
+def merge_rests_and_round_lab_file(path_lab, path_lab_round, step_size, write_merged=True):
+    """
+    モノラベルファイルの休符を結合して発声時刻を丸め、新たなファイルに保存する。
+    write_merged が true のときは、休符を結合しただけのラベルで元のファイルも上書きする。
+    """
+    label = label_cache.load(path_lab).merge_rests()
+    if write_merged:
+        label_cache.write(label, path_lab)
+    label.round(step_size)
+    label_cache.write(label, path_lab_round)
+
+
+def _round_one_lab_file(path_lab, lab_dir_out, step_size):
+    """
+    round_lab_file の並列処理用
+    """
+    round_lab_file(path_lab, join(lab_dir_out, basename(path_lab)), step_size)
+
+
+def _merge_rests_and_round_one_lab_file(path_lab, lab_dir_out, step_size, write_merged):
+    """
+    merge_rests_and_round_lab_file の並列処理用
+    """
+    merge_rests_and_round_lab_file(
+        path_lab, join(lab_dir_out, basename(path_lab)), step_size, write_merged
+    )
 
 
 def round_lab_files(lab_dir_in, lab_dir_out, step_size):
@@ -25,13 +77,34 @@ def round_lab_files(lab_dir_in, lab_dir_out, step_size):
     """
     makedirs(lab_dir_out, exist_ok=True)
     lab_files = glob(f'{lab_dir_in}/*.lab')
-    for path_lab in tqdm(lab_files):
-        path_lab_round = join(lab_dir_out, basename(path_lab))
-        label = up.label.load(path_lab)
-        label.round(step_size)
-        label.write(path_lab_round)
+    process_map(
+        partial(_round_one_lab_file, lab_dir_out=lab_dir_out, step_size=step_size),
+        lab_files,
+        colour='blue',
+        chunksize=max(1, len(lab_files) // 64),
+    )
 
 
+def merge_rests_and_round_lab_files(lab_dir_in, lab_dir_out, step_size, write_merged=True):
+    """
+    フォルダ内のモノラベルファイルの休符を結合して発声時刻を丸め、新たなフォルダに保存する。
+    """
+    makedirs(lab_dir_out, exist_ok=True)
+    lab_files = glob(f'{lab_dir_in}/*.lab')
+    process_map(
+        partial(
+            _merge_rests_and_round_one_lab_file,
+            lab_dir_out=lab_dir_out,
+            step_size=step_size,
+            write_merged=write_merged,
+        ),
+        lab_files,
+        colour='blue',
+        chunksize=max(1, len(lab_files) // 64),
+    )
+
+
+@tracing.traced
 def main(path_config_yaml):
     """
     configを読み取ってフォルダを指定し、全体の処理を実行する。
@@ -39,15 +112,18 @@ def main(path_config_yaml):
     with open(path_config_yaml, encoding='utf-8') as fy:
         config = yaml.safe_load(fy)
     out_dir = config['out_dir']
+    step_size = ROUND_STEP_SIZE
 
-    # 時刻を丸める基準[100ns]
-    step_size = 50000
-
-    # DBに同梱されていたLABファイルを丸める
+    # DBに同梱されていたLABファイルの休符を結合して丸める
     lab_dir_in = join(out_dir, 'lab')
     lab_dir_out = join(out_dir, 'mono_align_round')
-    print(f'Rounding mono-LAB files in {lab_dir_in}')
-    round_lab_files(lab_dir_in, lab_dir_out, step_size=step_size)
+    print(f'Merging rests and rounding mono-LAB files in {lab_dir_in}')
+    merge_rests_and_round_lab_files(
+        lab_dir_in,
+        lab_dir_out,
+        step_size=step_size,
+        write_merged=config.get('keep_intermediate_files', False),
+    )
 
     # 楽譜からつくったフルラベルを丸める
     lab_dir_in = join(out_dir, 'full_score')
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+依存関係つきのタスクを、1つのプロセスプールで実行する。
+
+ステップごとに process_map でプールを作り直して全曲の完了を待つのではなく、
+曲ごと・ステップごとのタスクを依存関係に従って順次投入する。
+依存先がすべて終わったタスクから実行するので、曲ごとに独立して処理が進む。
+全曲の結果が必要な処理 (統計値の計算など) は in_parent=True で親プロセスで実行する。
+"""
+
+import heapq
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from os import cpu_count
+
+from tqdm import tqdm
+
+
+class ResultOf:
+    """
+    タスクの引数に使うと、指定したタスクの戻り値に置き換えられる。
+    指定したタスクは自動的に依存先になる。
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return f'ResultOf({self.key!r})'
+
+
+class _LogRecordCollector(logging.Handler):
+    """
+    子プロセスで出力されたログを集めて、親プロセスで出力しなおすためのハンドラ。
+    Windows では子プロセスにログ設定が引き継がれないため。
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        # 引数と例外の情報を文字列にしておくことで、pickle できるようにする。
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def _run_task_with_log_collector(func, args, kwargs):
+    """
+    ログを集めながら関数を実行して、(戻り値, ログのリスト) を返す。(子プロセス用)
+    例外が発生した場合は、それまでに集めたログを例外の log_records 属性に付けて送出する。
+    """
+    root_logger = logging.getLogger()
+    original_handlers = root_logger.handlers
+    original_level = root_logger.level
+    collector = _LogRecordCollector()
+    root_logger.handlers = [collector]
+    root_logger.setLevel(logging.INFO)
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        e.log_records = collector.records
+        raise
+    finally:
+        root_logger.handlers = original_handlers
+        root_logger.setLevel(original_level)
+    return result, collector.records
+
+
+def _resolve(value, results):
+    """
+    ResultOf をタスクの戻り値に置き換える。リストとタプルの中身も置き換える。
+    """
+    if isinstance(value, ResultOf):
+        return results[value.key]
+    if isinstance(value, (list, tuple)):
+        return type(value)(_resolve(v, results) for v in value)
+    return value
+
+
+def _find_dependencies(value) -> set:
+    """
+    引数に含まれる ResultOf の参照先を返す。
+    """
+    if isinstance(value, ResultOf):
+        return {value.key}
+    if isinstance(value, (list, tuple)):
+        return set().union(*(_find_dependencies(v) for v in value))
+    return set()
+
+
+class TaskGraph:
+    """
+    依存関係つきのタスクの集まり。
+    """
+
+    def __init__(self):
+        self.tasks: dict = {}
+
+    def add(self, key, func, *args, deps=(), in_parent=False, **kwargs):
+        """
+        タスクを追加する。
+
+        key: タスク名。ほかのタスクの deps や ResultOf で参照する。
+        deps: 先に終わらせておく必要があるタスク名。
+        in_parent: True のときは子プロセスではなく親プロセスで実行する。
+        """
+        if key in self.tasks:
+            raise ValueError(f'タスク名が重複しています: {key}')
+        dependencies = (
+            set(deps) | _find_dependencies(args) | _find_dependencies(tuple(kwargs.values()))
+        )
+        self.tasks[key] = {
+            'func': func,
+            'args': args,
+            'kwargs': kwargs,
+            'deps': dependencies,
+            'in_parent': in_parent,
+        }
+        return key
+
+    def _priorities(self) -> dict:
+        """
+        各タスクの優先度を決める。
+        後に続くタスクの段数が多いものほど優先し、同じ段数なら登録順に実行する。
+        """
+        for key, task in self.tasks.items():
+            missing = [dep for dep in task['deps'] if dep not in self.tasks]
+            if missing:
+                raise ValueError(f'タスク {key} の依存先が見つかりません: {missing}')
+        dependents: dict = {key: [] for key in self.tasks}
+        for key, task in self.tasks.items():
+            for dep in task['deps']:
+                dependents[dep].append(key)
+        # 後ろのタスクから順に、後に続くタスクの段数を数える。
+        heights: dict = {}
+        pending = list(self.tasks)
+        while pending:
+            next_pending = []
+            for key in pending:
+                if all(dependent in heights for dependent in dependents[key]):
+                    heights[key] = max((heights[d] + 1 for d in dependents[key]), default=0)
+                else:
+                    next_pending.append(key)
+            if len(next_pending) == len(pending):
+                raise ValueError(f'タスクの依存関係が循環しています: {next_pending}')
+            pending = next_pending
+        return {key: (-heights[key], order) for order, key in enumerate(self.tasks)}
+
+    def run(self, max_workers=None, desc=None, initializer=None, initargs=()) -> dict:
+        """
+        すべてのタスクを実行して、タスク名をキーとした戻り値の辞書を返す。
+        どれかのタスクで例外が発生したら、未実行のタスクを取り消して例外を送出する。
+        initializer: 子プロセスの起動時に一度だけ実行する関数 (ProcessPoolExecutor と同じ)
+        """
+        if max_workers is None:
+            max_workers = cpu_count() or 1
+        priorities = self._priorities()
+        remaining_deps = {key: set(task['deps']) for key, task in self.tasks.items()}
+        dependents: dict = {key: [] for key in self.tasks}
+        for key, task in self.tasks.items():
+            for dep in task['deps']:
+                dependents[dep].append(key)
+        ready = [priorities[key] + (key,) for key, deps in remaining_deps.items() if not deps]
+        heapq.heapify(ready)
+        results: dict = {}
+        running: dict = {}
+        root_logger = logging.getLogger()
+
+        def finish(key, result):
+            results[key] = result
+            progress_bar.update(1)
+            for dependent in dependents[key]:
+                remaining_deps[dependent].discard(key)
+                if not remaining_deps[dependent]:
+                    heapq.heappush(ready, priorities[dependent] + (dependent,))
+
+        with (
+            ProcessPoolExecutor(
+                max_workers=max_workers, initializer=initializer, initargs=initargs
+            ) as executor,
+            tqdm(total=len(self.tasks), desc=desc, colour='blue') as progress_bar,
+        ):
+            try:
+                while ready or running:
+                    # プールが空かないよう、ワーカー数の2倍までタスクを投入しておく。
+                    while ready and len(running) < max_workers * 2:
+                        *_, key = heapq.heappop(ready)
+                        task = self.tasks[key]
+                        args = _resolve(task['args'], results)
+                        kwargs = {k: _resolve(v, results) for k, v in task['kwargs'].items()}
+                        if task['in_parent']:
+                            finish(key, task['func'](*args, **kwargs))
+                        else:
+                            future = executor.submit(
+                                _run_task_with_log_collector, task['func'], args, kwargs
+                            )
+                            running[future] = key
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        try:
+                            result, records = future.result()
+                        except BaseException as e:
+                            # 失敗したタスクが例外の前に出力したログも失わないようにする。
+                            for record in getattr(e, 'log_records', ()):
+                                root_logger.handle(record)
+                            raise
+                        for record in records:
+                            root_logger.handle(record)
+                        finish(key, result)
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        return results
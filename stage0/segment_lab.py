@@ -4,19 +4,41 @@
 ラベルを休符で分割する。
 
 最初に長い休符で分割したのち、そのあと一定の長さまたは休符の出現回数ごとに分割する。
+
+分割結果は {out_dir}/segment_manifest.json に曲ごとに記録する。
+(セグメント名と、音声の切断時刻[100ns]・切断位置[サンプル])
 """
 
+import json
+from math import comb
 from sys import argv
 from pathlib import Path
 from functools import partial
-import utaupy
 
+import numpy as np
 from natsort import natsorted
-from utaupy.label import Label
 import yaml
-from os import makedirs
+from os import makedirs, replace
 from tqdm.contrib.concurrent import process_map
 
+try:
+    from . import audio_index, compact_label, label_cache, tracing, wav_segment
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import compact_label
+    import label_cache
+    import tracing
+    import wav_segment
+
+# 分割結果の記録ファイル
+MANIFEST_NAME = 'segment_manifest.json'
+# 記録ファイルの形式を変えたときに増やす
+MANIFEST_VERSION = 1
+# 分割方法の選択肢
+SEGMENT_MODES = ('greedy', 'balanced')
+# パディングの効率を推定するときのバッチサイズの既定値
+DEFAULT_REPORT_BATCH_SIZE = 8
+
 
 def check_labfile_count_and_names(dirs: list[Path]):
     """指定したフォルダ内にあるラベルのファイル数やファイル名が一致するか確認する。
@@ -40,201 +62,393 @@ def check_labfile_count_and_names(dirs: list[Path]):
         raise ValueError(f'ファイル名が一致しません: {names}')
 
 
-def _segment_labels_at_pause(
-    mono_score_label: Label,
-    full_score_label: Label,
-    mono_align_label: Label,
-    full_align_label: Label,
-    pauses: list[str],
-) -> tuple[list[Label], list[Label], list[Label], list[Label]]:
-    """休符直前でラベルを分割して、分割後のラベルのリストを返す。
+def _check_phoneme_counts(labels):
+    """
+    各ラベルの音素数が一致するか確認する。
+    """
+    phoneme_counts = [len(label) for label in labels]
+    if len(set(phoneme_counts)) != 1:
+        error_msg = f'各ラベル内の音素数 ({", ".join(map(str, phoneme_counts))}) が一致しません。'
+        raise ValueError(error_msg)
+
 
-    label: 分割対象のラベル
+def _greedy_ranges(
+    pau_indices, cumulative, pause_durations, max_pause_duration, max_segment_length
+):
     """
-    mono_score_segments = []
-    full_score_segments = []
-    mono_align_segments = []
-    full_align_segments = []
-    # 休符位置を確認
-    pau_indices = [i for i, ph in enumerate(mono_score_label) if ph.symbol in pauses]
-    # 休符直前～次の休符直前 でセグメントにする。最後の休符は無視される。
-    for start_idx, end_idx in zip(pau_indices[:-1], pau_indices[1:]):
-        mono_score_segments.append(mono_score_label[start_idx:end_idx])
-        full_score_segments.append(full_score_label[start_idx:end_idx])
-        mono_align_segments.append(mono_align_label[start_idx:end_idx])
-        full_align_segments.append(full_align_label[start_idx:end_idx])
-    return (mono_score_segments, full_score_segments, mono_align_segments, full_align_segments)
-
-
-def split_label_objects(
-    mono_score_label: Label,
-    full_score_label: Label,
-    mono_align_label: Label,
-    full_align_label: Label,
+    休符ごとの範囲を先頭から順に結合して、基準長を超える直前で分割する。
+    """
+    ranges = []
+    current_start, current_end, current_drop = 0, 0, False
+    for start_idx, end_idx, pause_duration in zip(
+        pau_indices[:-1], pau_indices[1:], pause_durations
+    ):
+        current_first = current_start + current_drop
+        current_length = (
+            cumulative[current_end] - cumulative[current_first]
+            if current_end > current_first
+            else 0
+        )
+        # 開始の休符が基準より長い場合は、休符を除去してセグメントを新規作成する。
+        if pause_duration > max_pause_duration:
+            if current_end > current_first:
+                ranges.append((current_start, current_end, current_drop))
+            current_start, current_end, current_drop = start_idx, end_idx, True
+        # 結合すると基準長を超える場合は、休符を除去せずにセグメントを新規作成する。
+        elif current_length + cumulative[end_idx] - cumulative[start_idx] > max_segment_length:
+            if current_end > current_first:
+                ranges.append((current_start, current_end, current_drop))
+            current_start, current_end, current_drop = start_idx, end_idx, False
+        # 結合しても基準長を超えない場合はセグメントを延長する。
+        else:
+            if current_end <= current_first:
+                current_start, current_drop = start_idx, False
+            current_end = end_idx
+    # 最後のセグメントを追加する
+    ranges.append((current_start, current_end, current_drop))
+    return ranges
+
+
+def _balanced_ranges(
+    pau_indices,
+    cumulative,
+    pause_durations,
+    max_pause_duration,
+    max_segment_length,
+    target_segment_length,
+):
+    """
+    各セグメントの長さと目標の長さの差の二乗和が最小になるように、休符ごとの範囲を結合する。
+
+    長い休符では必ず分割するので、長い休符から次の長い休符までのブロックごとに動的計画法で求める。
+    複数の範囲を結合したセグメントは基準長を超えないようにする。(1つの範囲だけで超える場合は除く)
+    音素が1つだけになるセグメントは、ほかに分割方法がない場合だけ作る。
+    """
+    n_units = len(pau_indices) - 1
+    forced = [pause_duration > max_pause_duration for pause_duration in pause_durations]
+    block_starts = [k for k in range(n_units) if k == 0 or forced[k]]
+
+    ranges = []
+    for block_start, block_end in zip(block_starts, block_starts[1:] + [n_units]):
+        drop_first = forced[block_start]
+        # best[j]: 範囲 block_start ～ j-1 を結合したときの (音素が1つのセグメント数, 二乗和)
+        best = {block_start: (0, 0)}
+        previous = {}
+        for j in range(block_start + 1, block_end + 1):
+            end_idx = pau_indices[j]
+            for i in range(j - 1, block_start - 1, -1):
+                first_idx = pau_indices[i] + (drop_first and i == block_start)
+                length = cumulative[end_idx] - cumulative[first_idx]
+                if length > max_segment_length and j - i > 1:
+                    break
+                phoneme_count = end_idx - first_idx
+                if phoneme_count == 0:
+                    cost = (0, 0)
+                elif phoneme_count == 1:
+                    cost = (1, 0)
+                else:
+                    cost = (0, (length - target_segment_length) ** 2)
+                candidate = (best[i][0] + cost[0], best[i][1] + cost[1])
+                if j not in best or candidate < best[j]:
+                    best[j] = candidate
+                    previous[j] = i
+        # 分割位置をたどる。音素のないセグメント (除去した休符だけ) は追加しない。
+        cuts = [block_end]
+        while cuts[-1] != block_start:
+            cuts.append(previous[cuts[-1]])
+        cuts.reverse()
+        for i, j in zip(cuts[:-1], cuts[1:]):
+            drop = drop_first and i == block_start
+            if pau_indices[j] - pau_indices[i] - drop > 0:
+                ranges.append((pau_indices[i], pau_indices[j], drop))
+    return ranges
+
+
+def segment_ranges(
+    mono_score_label: compact_label.CompactLabel,
     max_pause_duration: float,  # sec
     max_segment_length: float,  # sec
     pauses: list[str] = None,
-) -> tuple[list[Label], list[Label], list[Label], list[Label]]:
-    """ラベルを休符で分割する。
+    mode: str = 'greedy',
+    target_segment_length: float = None,  # sec
+) -> list[tuple[int, int, bool]]:
+    """ラベルを休符で分割する位置を求める。
 
     休符の長さが一定以上の場合は必ず分割し、その休符を除去する。
     その後、休符の出現回数ごとに再度分割する。
+
+    mode: 'greedy' (基準長を超える直前で分割する) または
+          'balanced' (各セグメントの長さが target_segment_length になるべく近くなるように分割する)
+    target_segment_length: 'balanced' の目標の長さ。省略した場合は max_segment_length の半分。
+
+    戻り値: [(開始位置, 終了位置, 開始の休符を除去するか), ...]
+    セグメントは音素 [開始位置 + 除去するか : 終了位置] の範囲になる。
     """
-    # 休符扱いの音素一覧
     if pauses is None:
         pauses = ['pau', 'sil']
+    if mode not in SEGMENT_MODES:
+        raise ValueError(f'segment_mode must be one of {SEGMENT_MODES}: {mode}')
+    if target_segment_length is None:
+        target_segment_length = max_segment_length / 2
 
-    # max_pause_duration と max_segment_length の単位をLABファイル用に換算する。
+    # 時間の単位をLABファイル用に換算する。
     max_pause_duration *= 1e7
     max_segment_length *= 1e7
+    target_segment_length *= 1e7
+
+    # 最初と最後の音素が休符であるかを確認する。
+    is_pause = mono_score_label.is_symbol_in(pauses)
+    if not is_pause[0]:
+        raise ValueError(f'最初の音素が休符ではありません: {mono_score_label.symbol(0)}')
+    if not is_pause[-1]:
+        raise ValueError(f'最後の音素が休符ではありません: {mono_score_label.symbol(-1)}')
+
+    # 発声時間の累積和。音素 [a:b] の長さは cumulative[b] - cumulative[a] になる。
+    durations = mono_score_label.durations
+    cumulative = np.concatenate(([0], np.cumsum(durations))).tolist()
+    # 休符直前～次の休符直前 の範囲ごとに結合するか決める。最後の休符は無視される。
+    pau_indices = np.flatnonzero(is_pause).tolist()
+    pause_durations = durations[pau_indices[:-1]].tolist()
+
+    if mode == 'greedy':
+        ranges = _greedy_ranges(
+            pau_indices, cumulative, pause_durations, max_pause_duration, max_segment_length
+        )
+    else:
+        ranges = _balanced_ranges(
+            pau_indices,
+            cumulative,
+            pause_durations,
+            max_pause_duration,
+            max_segment_length,
+            target_segment_length,
+        )
 
-    # 各LABファイルの音素数が一致するか、最初と最後の音素が休符であるかを確認する。
-    phoneme_counts = [
-        len(mono_score_label),
-        len(full_score_label),
-        len(mono_align_label),
-        len(full_align_label),
-    ]
-    if len(set(phoneme_counts)) != 1:
-        error_msg = f'各ラベル内の音素数 ({", ".join(map(str, phoneme_counts))}) が一致しません。'
-        raise ValueError(error_msg)
-    if mono_score_label[0].symbol not in pauses:
-        raise ValueError(f'最初の音素が休符ではありません: {mono_score_label[0].symbol}')
-    if mono_score_label[-1].symbol not in pauses:
-        raise ValueError(f'最後の音素が休符ではありません: {mono_score_label[-1].symbol}')
-
-    # 毎休符で分割したLabelのリストを作成する。
-    (
-        l_short_mono_score_segments,
-        l_short_full_score_segments,
-        l_short_mono_align_segments,
-        l_short_full_align_segments,
-    ) = _segment_labels_at_pause(
-        mono_score_label, full_score_label, mono_align_label, full_align_label, pauses
-    )
+    if len(ranges) == 0:
+        raise ValueError('音素数が少なすぎます: 0')
+    for start_idx, end_idx, drop_leading_pause in ranges:
+        phoneme_count = end_idx - start_idx - drop_leading_pause
+        if phoneme_count <= 1:
+            raise ValueError(f'音素数が少なすぎます: {phoneme_count}')
+    return ranges
 
-    # 各ラベルの分割後のリストを初期化
-    l_mono_score_segments = []
-    l_full_score_segments = []
-    l_mono_align_segments = []
-    l_full_align_segments = []
-
-    # 結合用のラベルを初期化
-    current_mono_score_seg = Label()
-    current_full_score_seg = Label()
-    current_mono_align_seg = Label()
-    current_full_align_seg = Label()
-
-    for (short_mono_score_seg, short_full_score_seg, short_mono_align_seg, short_full_align_seg) in zip(
-        l_short_mono_score_segments, l_short_full_score_segments, l_short_mono_align_segments, l_short_full_align_segments
-    ):  # fmt: skip
-        # 現在のセグメントの長さを計算する。
-        current_segment_length = sum(ph.duration for ph in current_mono_score_seg)
-        # 開始の休符が基準より長い場合は、休符を除去してセグメントを新規作成する。
-        if short_mono_score_seg[0].duration > max_pause_duration:
-            # セグメントが空の場合はセグメント追加をスキップする。
-            if len(current_mono_score_seg) > 0:
-                l_mono_score_segments.append(current_mono_score_seg)
-                l_full_score_segments.append(current_full_score_seg)
-                l_mono_align_segments.append(current_mono_align_seg)
-                l_full_align_segments.append(current_full_align_seg)
-            current_mono_score_seg = short_mono_score_seg[1:]
-            current_full_score_seg = short_full_score_seg[1:]
-            current_mono_align_seg = short_mono_align_seg[1:]
-            current_full_align_seg = short_full_align_seg[1:]
-        # 開始の休符が基準よりも短いがセグメントを結合すると基準長を超える場合は、休符を除去せずにセグメントを新規作成する。
-        elif (
-            current_segment_length + sum(ph.duration for ph in short_mono_score_seg)
-            > max_segment_length
-        ):
-            # セグメントが空の場合はセグメント追加をスキップする。
-            if len(current_mono_score_seg) > 0:
-                l_mono_score_segments.append(current_mono_score_seg)
-                l_full_score_segments.append(current_full_score_seg)
-                l_mono_align_segments.append(current_mono_align_seg)
-                l_full_align_segments.append(current_full_align_seg)
-            current_mono_score_seg = short_mono_score_seg
-            current_full_score_seg = short_full_score_seg
-            current_mono_align_seg = short_mono_align_seg
-            current_full_align_seg = short_full_align_seg
-        #  開始の休符が基準より短く、セグメントを結合しても基準長を超えない場合はセグメントを延長する。
-        else:
-            current_mono_score_seg.extend(short_mono_score_seg)
-            current_full_score_seg.extend(short_full_score_seg)
-            current_mono_align_seg.extend(short_mono_align_seg)
-            current_full_align_seg.extend(short_full_align_seg)
 
-    # 最後のセグメントを追加する
-    l_mono_score_segments.append(current_mono_score_seg)
-    l_full_score_segments.append(current_full_score_seg)
-    l_mono_align_segments.append(current_mono_align_seg)
-    l_full_align_segments.append(current_full_align_seg)
-
-    # 各セグメントの音素数が一致しているか確認する。
-    for mono_score_seg, full_score_seg, mono_align_seg, full_align_seg in zip(
-        l_mono_score_segments,
-        l_full_score_segments,
-        l_mono_align_segments,
-        l_full_align_segments,
-    ):
-        len_mono_score_seg = len(mono_score_seg)
-        len_full_score_seg = len(full_score_seg)
-        len_mono_align_seg = len(mono_align_seg)
-        len_full_align_seg = len(full_align_seg)
-
-        # 4種類のセグメントの音素数が一致しない場合はエラー
-        if not (
-            len_mono_score_seg == len_full_score_seg == len_mono_align_seg == len_full_align_seg
-        ):
-            error_msg = f'音素数が一致しません: {len_mono_score_seg}, {len_full_score_seg}, {len_mono_align_seg}, {len_full_align_seg}'
-            raise ValueError(error_msg)
-        if len_mono_score_seg <= 1:
-            raise ValueError(f'音素数が少なすぎます: {len_mono_score_seg}')
-
-    return (
-        l_mono_score_segments,
-        l_full_score_segments,
-        l_mono_align_segments,
-        l_full_align_segments,
+def segment_options(config) -> dict:
+    """
+    config から segment_ranges の分割設定を取り出す。
+    """
+    return {
+        'max_pause_duration': config['max_pause_duration'],
+        'max_segment_length': config['max_segment_length'],
+        'mode': config.get('segment_mode') or 'greedy',
+        'target_segment_length': config.get('segment_target_length'),
+    }
+
+
+def split_compact_labels(
+    mono_score_label: compact_label.CompactLabel,
+    full_score_label: compact_label.CompactLabel,
+    mono_align_label: compact_label.CompactLabel,
+    full_align_label: compact_label.CompactLabel,
+    max_pause_duration: float,  # sec
+    max_segment_length: float,  # sec
+    pauses: list[str] = None,
+    mode: str = 'greedy',
+    target_segment_length: float = None,  # sec
+) -> tuple[list, list, list, list]:
+    """CompactLabel を休符で分割する。分割位置は segment_ranges で求める。
+
+    分割後の各セグメントは元のラベルの連続した範囲なので、スライスして返す。
+    """
+    labels = (mono_score_label, full_score_label, mono_align_label, full_align_label)
+    _check_phoneme_counts(labels)
+    ranges = segment_ranges(
+        mono_score_label,
+        max_pause_duration,
+        max_segment_length,
+        pauses,
+        mode,
+        target_segment_length,
     )
+    return tuple(
+        [label[start_idx + drop : end_idx] for start_idx, end_idx, drop in ranges]
+        for label in labels
+    )
+
+
+def segment_records(segment_names, segment_times, path_wav) -> list[dict]:
+    """
+    セグメントごとに、名前と音声の切断時刻[100ns]・切断位置[サンプル] を返す。
+    segment_times: [(開始時刻, 終了時刻), ...]
+    切断時刻は full_align の分割後 (オフセット修正前) の最初の開始時刻と最後の終了時刻。
+    WAVファイルがない場合は、切断位置を None にする。
+    """
+    try:
+        frame_rate = audio_index.read_wav_info(path_wav)['frame_rate']
+    except FileNotFoundError:
+        frame_rate = None
+    records = []
+    for segment_name, (start, end) in zip(segment_names, segment_times):
+        records.append(
+            {
+                'name': segment_name,
+                'start': start,
+                'end': end,
+                'frame_rate': frame_rate,
+                'start_frame': (
+                    None if frame_rate is None else wav_segment.time_to_frame(start, frame_rate)
+                ),
+                'end_frame': (
+                    None if frame_rate is None else wav_segment.time_to_frame(end, frame_rate)
+                ),
+            }
+        )
+    return records
+
 
+def length_report(lengths, batch_size: int, bin_width: float = 5) -> dict:
+    """
+    セグメントの長さの分布と、学習時のパディングの効率の推定値を返す。
 
-def _process_one_song(song_paths_tuple, config, output_dirs):
-    """1曲分のラベル分割処理（並列処理用）"""
-    (orig_mono_score_path, orig_full_score_path, orig_mono_align_path, orig_full_align_path) = (
-        song_paths_tuple
+    lengths: セグメントの長さ[100ns] のリスト
+    batch_size: ランダムに選んだ batch_size 個のセグメントを最長のものに揃えると仮定する。
+                パディングの効率は (平均の長さ) / (バッチ内で最長のセグメントの長さの期待値)
+    bin_width: ヒストグラムの区間の幅[s]
+    """
+    lengths_sec = np.sort(np.asarray(lengths, dtype=np.float64)) / 1e7
+    n_segments = len(lengths_sec)
+    if n_segments == 0:
+        return {'count': 0, 'histogram': [], 'batch_size': batch_size, 'padding_efficiency': None}
+    # ヒストグラム [(区間の下限[s], 区間の上限[s], セグメント数), ...]
+    n_bins = int(lengths_sec[-1] // bin_width) + 1
+    counts = np.bincount((lengths_sec // bin_width).astype(np.int64), minlength=n_bins)
+    histogram = [
+        (idx * bin_width, (idx + 1) * bin_width, int(count)) for idx, count in enumerate(counts)
+    ]
+    # 長さの順で i 番目 (0始まり) のセグメントがバッチ内で最長になる確率は
+    # comb(i, batch_size - 1) / comb(n_segments, batch_size)
+    batch_size = max(1, min(batch_size, n_segments))
+    weights = np.array(
+        [comb(i, batch_size - 1) / comb(n_segments, batch_size) for i in range(n_segments)]
     )
+    expected_batch_max = float(np.dot(weights, lengths_sec))
+    mean = float(lengths_sec.mean())
+    return {
+        'count': n_segments,
+        'total': float(lengths_sec.sum()),
+        'mean': mean,
+        'std': float(lengths_sec.std()),
+        'min': float(lengths_sec[0]),
+        'max': float(lengths_sec[-1]),
+        'histogram': histogram,
+        'batch_size': batch_size,
+        'padding_efficiency': mean / expected_batch_max if expected_batch_max > 0 else None,
+    }
+
+
+def report_batch_size(config) -> int:
+    """
+    config からパディングの効率を推定するときのバッチサイズを取り出す。
+    """
+    return config.get('segment_report_batch_size') or DEFAULT_REPORT_BATCH_SIZE
+
 
-    # LABファイルを読み取ってLabelオブジェクトを作成する。
-    in_mono_score_lab = utaupy.label.load(orig_mono_score_path)
-    in_full_score_lab = utaupy.label.load(orig_full_score_path)
-    in_mono_align_lab = utaupy.label.load(orig_mono_align_path)
-    in_full_align_lab = utaupy.label.load(orig_full_align_path)
-
-    # Labelオブジェクトを分割してセグメント化する
-    mono_score_segments, full_score_segments, mono_align_segments, full_align_segments = (
-        split_label_objects(
-            in_mono_score_lab,
-            in_full_score_lab,
-            in_mono_align_lab,
-            in_full_align_lab,
-            max_pause_duration=config['max_pause_duration'],
-            max_segment_length=config['max_segment_length'],
+def print_length_report(lengths, batch_size: int):
+    """
+    セグメントの長さの分布と、パディングの効率の推定値を表示する。
+    """
+    report = length_report(lengths, batch_size)
+    if report['count'] == 0:
+        return
+    print(
+        f'Segment lengths: {report["count"]} segments, total {report["total"]:.1f} s, '
+        f'mean {report["mean"]:.1f} s, std {report["std"]:.1f} s, '
+        f'min {report["min"]:.1f} s, max {report["max"]:.1f} s'
+    )
+    max_count = max(count for _, _, count in report['histogram'])
+    for lower, upper, count in report['histogram']:
+        bar = '#' * round(40 * count / max_count)
+        print(f'  {lower:5.1f} - {upper:5.1f} s: {count:5d} {bar}')
+    if report['padding_efficiency'] is not None:
+        print(
+            f'Estimated padding efficiency (batch size {report["batch_size"]}): '
+            f'{report["padding_efficiency"]:.1%}'
         )
+
+
+def print_manifest_length_report(songs: dict, config):
+    """
+    分割結果の記録から、セグメントの長さの分布とパディングの効率の推定値を表示する。
+    songs: {曲名: segment_records() の戻り値}
+    """
+    print_length_report(
+        [record['end'] - record['start'] for records in songs.values() for record in records],
+        report_batch_size(config),
     )
 
+
+def save_manifest(out_dir, songs: dict):
+    """
+    分割結果を記録する。songs: {曲名: segment_records() の戻り値}
+    """
+    path_manifest = Path(out_dir) / MANIFEST_NAME
+    path_tmp = path_manifest.with_suffix('.json.tmp')
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'songs': songs}, f, ensure_ascii=False)
+    replace(path_tmp, path_manifest)
+
+
+def load_manifest(out_dir) -> dict:
+    """
+    分割結果の記録を読み取って、{曲名: セグメントのリスト} を返す。
+    ない場合や形式が古い場合は空にする。
+    """
+    try:
+        with open(Path(out_dir) / MANIFEST_NAME, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['songs']
+
+
+@tracing.traced
+def _process_one_song(song_paths_tuple, config, output_dirs) -> list[dict]:
+    """
+    1曲分のラベル分割処理（並列処理用）。
+    セグメントごとの記録 (segment_records() の戻り値) を返す。
+    """
+    orig_mono_score_path = song_paths_tuple[0]
+
+    # LABファイルを読み取る。
+    labels = [label_cache.load(path) for path in song_paths_tuple]
+    _check_phoneme_counts(labels)
+
+    # 分割位置を求める。
+    ranges = [
+        (start_idx + drop, end_idx)
+        for start_idx, end_idx, drop in segment_ranges(labels[0], **segment_options(config))
+    ]
+
     # セグメントを保存する。その際、ファイル名は元のファイル名にセグメント番号を付加する。
-    for idx, (mono_score_seg, full_score_seg, mono_align_seg, full_align_seg) in enumerate(
-        zip(mono_score_segments, full_score_segments, mono_align_segments, full_align_segments)
-    ):
-        str_idx = str(idx).zfill(2)
-        segment_name = f'{orig_mono_score_path.stem}__seg{str_idx}.lab'
-        mono_score_seg.write(output_dirs[0] / segment_name)
-        full_score_seg.write(output_dirs[1] / segment_name)
-        mono_align_seg.write(output_dirs[2] / segment_name)
-        full_align_seg.write(output_dirs[3] / segment_name)
+    segment_names = [
+        f'{orig_mono_score_path.stem}__seg{str(idx).zfill(2)}' for idx in range(len(ranges))
+    ]
+    for label, output_dir in zip(labels, output_dirs):
+        label_cache.write_ranges(
+            label, ranges, [output_dir / f'{segment_name}.lab' for segment_name in segment_names]
+        )
+    full_align_label = labels[3]
+    segment_times = [
+        (int(full_align_label.starts[start_idx]), int(full_align_label.ends[end_idx - 1]))
+        for start_idx, end_idx in ranges
+    ]
+    path_wav = output_dirs[0].parent / 'wav' / f'{orig_mono_score_path.stem}.wav'
+    return segment_records(segment_names, segment_times, path_wav)
 
 
+@tracing.traced
 def main(path_config_yaml: Path) -> None:
     """全体の処理をする。
 
@@ -297,7 +511,12 @@ def main(path_config_yaml: Path) -> None:
     process_func = partial(_process_one_song, config=config, output_dirs=output_dirs)
 
     # 並列処理で実行
-    process_map(process_func, song_paths, colour='blue')
+    results = process_map(process_func, song_paths, colour='blue')
+
+    # 分割結果を記録する
+    songs = {paths[0].stem: records for paths, records in zip(song_paths, results)}
+    save_manifest(out_dir, songs)
+    print_manifest_length_report(songs, config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+ステージ0の各ステップを、曲ごとにメモリ上で一度に実行する。
+
+通常のステージ0は各ステップでファイルを読み書きするが、
+このモジュールでは各曲の UST と LAB を一度だけ読み取り、
+オブジェクトのまま以下のステップに渡す。
+
+check_lab → force_ust_end_with_rest → ust2lab → merge_rest_mono_align
+→ merge_rest_full_score → round_lab → full2mono → compare_mono_align_and_mono_score
+→ copy_mono_time_to_full → assert_wav_is_longer_than_lab → segment_lab
+→ check_lab_after_segmentation → finalize_lab_and_wav
+
+ファイルに書き出すのは学習に使う最終成果物だけにする。
+config の keep_intermediate_files が true のときは、通常と同じ途中ファイルも書き出す。
+"""
+
+import logging
+from copy import copy
+from os import makedirs
+from os.path import join
+from pathlib import Path
+from sys import argv
+
+import utaupy as up
+import yaml
+from natsort import natsorted
+from utaupy.hts import adjust_break_contexts, adjust_pau_contexts
+from utaupy.label import Label, Phoneme
+from utaupy.utils._ust2hts import ustobj2songobj
+
+try:
+    from . import (
+        audio_index,
+        check_lab,
+        check_lab_after_segmentation,
+        check_wav,
+        compact_label,
+        compare_mono_align_and_mono_score,
+        copy_mono_time_to_full,
+        file_layout,
+        finalize_lab_and_wav,
+        force_ust_end_with_rest,
+        full2mono,
+        label_cache,
+        label_check,
+        merge_rest_full_score,
+        merge_rest_mono_align,
+        round_lab,
+        segment_lab,
+        tracing,
+        ust2lab,
+        wav_segment,
+    )
+    from .scheduler import ResultOf, TaskGraph
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import check_lab
+    import check_lab_after_segmentation
+    import check_wav
+    import compact_label
+    import compare_mono_align_and_mono_score
+    import copy_mono_time_to_full
+    import file_layout
+    import finalize_lab_and_wav
+    import force_ust_end_with_rest
+    import full2mono
+    import label_cache
+    import label_check
+    import merge_rest_full_score
+    import merge_rest_mono_align
+    import round_lab
+    import segment_lab
+    import tracing
+    import ust2lab
+    import wav_segment
+    from scheduler import ResultOf, TaskGraph
+
+
+def song_to_full_lines(song) -> list[str]:
+    """
+    Songオブジェクトを、ファイル出力するときと同じフルラベルの行のリストにする。
+    utaupy.hts.Song.write(strict_sinsy_style=False) と同じ処理。
+    """
+    full_label = up.hts.HTSFullLabel()
+    full_label.song = song
+    full_label.fill_contexts_from_songobj()
+    full_label = adjust_break_contexts(full_label)
+    full_label = adjust_pau_contexts(full_label, strict=False)
+    return [str(oneline) for oneline in full_label]
+
+
+def lines_to_label(lines: list[str]) -> Label:
+    """
+    LABファイルの行のリストを Labelオブジェクトにする。
+    utaupy.label.load と同じ処理。
+    """
+    label = Label()
+    for line in lines:
+        v = line.strip().split(maxsplit=2)
+        phoneme = Phoneme()
+        phoneme.start = int(v[0])
+        phoneme.end = int(v[1])
+        phoneme.symbol = v[2]
+        label.append(phoneme)
+    return label
+
+
+def copy_label(label: Label) -> Label:
+    """
+    Phonemeオブジェクトごと Labelオブジェクトを複製する。
+    """
+    new_label = Label()
+    new_label.data = [copy(phoneme) for phoneme in label]
+    return new_label
+
+
+def _write_lines(lines: list[str], path_out):
+    """
+    行のリストをLABファイルとして出力する。
+    """
+    with open(path_out, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(lines))
+
+
+@tracing.traced
+def _prepare_one_song(songname, out_dir, path_table, keep_intermediate_files):
+    """
+    1曲分のラベルを読み取って、mono_score との比較までを行う。(並列処理用)
+    """
+    path_ust = join(out_dir, 'ust', f'{songname}.ust')
+    path_mono_align = join(out_dir, 'lab', f'{songname}.lab')
+    path_mono_align_round = join(out_dir, 'mono_align_round', f'{songname}.lab')
+    path_mono_score_round = join(out_dir, 'mono_score_round', f'{songname}.lab')
+
+    # check_lab: 発声時刻に不具合がないか点検して、短すぎる音素をメモリ上で修正する。
+    # 結果は全曲分をまとめて _check_prepared_songs で確認する。
+    # 結果は check_lab.main と同じく、点検と修正で分けて返す。
+    mono_align_compact = label_cache.load(path_mono_align)
+    lab_result = label_check.check_label(mono_align_compact, path_mono_align, threshold=0)
+    # 不具合のあるラベルはこれ以上処理しない。(関係のない例外で点検結果が隠れないようにする。)
+    if not lab_result['valid']:
+        return {
+            'songname': songname,
+            'lab_is_valid': False,
+            'lab_result': lab_result,
+            'repair_result': None,
+        }
+    repair_result = label_check.check_label(
+        mono_align_compact, path_mono_align, threshold=None, repair_threshold=5
+    )
+    mono_align_label = mono_align_compact.to_label()
+
+    # force_ust_end_with_rest: USTが休符で終わるようにする。
+    ust = up.ust.load(path_ust)
+    force_ust_end_with_rest.force_ust_end_with_rest(ust, path_ust)
+
+    # ust2lab: USTからフルラベルを生成する。
+    full_score_lines = song_to_full_lines(ustobj2songobj(ust, ust2lab.kana_table(path_table)))
+    if keep_intermediate_files:
+        ust.write(path_ust)
+        _write_lines(full_score_lines, join(out_dir, 'full_score', f'{songname}.lab'))
+
+    # merge_rest_mono_align: DB同梱のモノラベルの休符を結合する。
+    # LABファイルは全曲の点検が終わってから書き換えるので、_finalize_one_song で書き出す。
+    mono_align_label = merge_rest_mono_align.merge_rests_mono(mono_align_label)
+    mono_align_merged = copy_label(mono_align_label) if keep_intermediate_files else None
+
+    # merge_rest_full_score: フルラベルの休符を結合する。
+    full_score_lines = merge_rest_full_score.merge_rests_full_lines(full_score_lines)
+    if keep_intermediate_files:
+        _write_lines(full_score_lines, join(out_dir, 'full_score', f'{songname}.lab'))
+
+    # round_lab: 時刻を丸める。
+    mono_align_label.round(round_lab.ROUND_STEP_SIZE)
+    full_score_label = lines_to_label(full_score_lines)
+    full_score_label.round(round_lab.ROUND_STEP_SIZE)
+    if keep_intermediate_files:
+        full_score_label.write(join(out_dir, 'full_score_round', f'{songname}.lab'))
+
+    # full2mono: フルラベルをモノラベルにする。
+    mono_score_label = lines_to_label(
+        full2mono.convert_full_to_mono_lines([str(phoneme) for phoneme in full_score_label])
+    )
+    if keep_intermediate_files:
+        mono_score_label.write(path_mono_score_round)
+
+    # compare_mono_align_and_mono_score: 最初の音素の開始時刻を0にして、音素記号を比較する。
+    compare_mono_align_and_mono_score.force_start_with_zero(
+        path_mono_align_round, mono_align_label=mono_align_label
+    )
+    if keep_intermediate_files:
+        mono_align_label.write(path_mono_align_round)
+    phoneme_is_ok = compare_mono_align_and_mono_score.phoneme_is_ok(
+        path_mono_align_round,
+        path_mono_score_round,
+        mono_align_label=mono_align_label,
+        mono_score_label=mono_score_label,
+    )
+    duration_differences = []
+    if phoneme_is_ok:
+        duration_differences = compare_mono_align_and_mono_score.vowel_duration_differences(
+            mono_align_label, mono_score_label
+        )
+
+    return {
+        'songname': songname,
+        'lab_is_valid': True,
+        'lab_result': lab_result,
+        'repair_result': repair_result,
+        'mono_align_merged': mono_align_merged,
+        'phoneme_is_ok': phoneme_is_ok,
+        'duration_differences': duration_differences,
+        'mono_align_round': mono_align_label,
+        'mono_score_round': mono_score_label,
+        'full_score_round': full_score_label,
+    }
+
+
+@tracing.traced
+def _finalize_one_song(song_data, out_dir, config, keep_intermediate_files):
+    """
+    1曲分のラベルについて、時刻のコピーから学習用ファイルの出力までを行う。(並列処理用)
+
+    (不具合のあったラベルファイルのリスト, セグメント名のリスト, セグメントの長さ[100ns] のリスト)
+    を返す。分割後のラベルに不具合があった場合は、学習用ファイルを出力しない。
+    """
+    songname = song_data['songname']
+    mono_align_label = song_data['mono_align_round']
+    mono_score_label = song_data['mono_score_round']
+    full_score_label = song_data['full_score_round']
+    path_wav = join(out_dir, 'wav', f'{songname}.wav')
+    layout = file_layout.layout_mode(config)
+
+    # merge_rest_mono_align: 休符を結合したDB同梱のモノラベルを書き出す。
+    if keep_intermediate_files:
+        song_data['mono_align_merged'].write(join(out_dir, 'lab', f'{songname}.lab'))
+
+    # copy_mono_time_to_full: mono_align の時刻を full_score にコピーする。
+    full_align_label = copy_mono_time_to_full.copy_mono_align_time_to_full_label(
+        mono_align_label, copy_label(full_score_label)
+    )
+    if keep_intermediate_files:
+        full_align_label.write(join(out_dir, 'full_align_round', f'{songname}.lab'))
+
+    # assert_wav_is_longer_than_lab: WAVファイルがラベルより長いことを確認する。
+    wav_info = audio_index.read_wav_info(path_wav)
+    for label, lab_dir in (
+        (full_align_label, 'full_align_round'),
+        (full_score_label, 'full_score_round'),
+    ):
+        if wav_info['duration_seconds'] < label[-1].end / 10000000:
+            path_lab = join(out_dir, lab_dir, f'{songname}.lab')
+            logging.warning('WAV is shorter than LAB or score. (%s) (%s)', path_wav, path_lab)
+
+    # segment_lab: ラベルを分割する。分割後は配列で保持するラベルとして扱う。
+    segments = segment_lab.split_compact_labels(
+        *(
+            compact_label.CompactLabel.from_label(label)
+            for label in (mono_score_label, full_score_label, mono_align_label, full_align_label)
+        ),
+        **segment_lab.segment_options(config),
+    )
+    segment_names = [f'{songname}__seg{str(idx).zfill(2)}' for idx in range(len(segments[0]))]
+    if keep_intermediate_files:
+        for lab_dir, label_segments in zip(
+            (
+                'mono_score_round_seg',
+                'full_score_round_seg',
+                'mono_align_round_seg',
+                'full_align_round_seg',
+            ),
+            segments,
+        ):
+            for segment_name, label in zip(segment_names, label_segments):
+                label.write(join(out_dir, lab_dir, f'{segment_name}.lab'))
+
+    # check_lab_after_segmentation: 分割後のラベルの発声時間が負になっていないか点検する。
+    _, full_score_segments, mono_align_segments, full_align_segments = segments
+    segment_lengths = [int(label.ends[-1]) - int(label.starts[0]) for label in full_align_segments]
+    invalid_lab_files = []
+    for lab_dir, label_segments in (
+        ('full_align_round_seg', full_align_segments),
+        ('mono_align_round_seg', mono_align_segments),
+    ):
+        for segment_name, label in zip(segment_names, label_segments):
+            if not label.is_valid(0):
+                path_lab = join(out_dir, lab_dir, f'{segment_name}.lab')
+                logging.error('LABファイルの発声時刻に不具合があります。(%s)', path_lab)
+                invalid_lab_files.append(path_lab)
+    if len(invalid_lab_files) != 0:
+        return invalid_lab_files, segment_names, segment_lengths
+
+    # finalize_lab_and_wav: 学習用のフォルダにラベルと分割した音声を保存する。
+    with wav_segment.WavSource(path_wav) as wav:
+        for segment_name, full_score_seg, full_align_seg in zip(
+            segment_names, full_score_segments, full_align_segments
+        ):
+            # timelag 用のラベルはオフセットを修正しない。
+            for label, lab_dir in (
+                (full_align_seg, 'label_phone_align'),
+                (full_score_seg, 'label_phone_score'),
+            ):
+                label.write(join(out_dir, 'timelag', lab_dir, f'{segment_name}.lab'))
+            # オフセットを修正する前の時刻で音声を切り出す。
+            finalize_lab_and_wav.export_wav_segment(
+                wav, full_align_seg, join(out_dir, 'acoustic', 'wav', f'{segment_name}.wav')
+            )
+            # duration 用と acoustic 用のラベルはオフセットを修正する。
+            full_align_seg.fix_offset()
+            full_score_seg.fix_offset()
+            # duration 用と acoustic 用の full_align は同じ内容なので、一度だけ書き出す。
+            path_duration_align = join(
+                out_dir, 'duration', 'label_phone_align', f'{segment_name}.lab'
+            )
+            full_align_seg.write(path_duration_align)
+            file_layout.place_file(
+                path_duration_align,
+                join(out_dir, 'acoustic', 'label_phone_align', f'{segment_name}.lab'),
+                layout,
+            )
+            full_score_seg.write(
+                join(out_dir, 'acoustic', 'label_phone_score', f'{segment_name}.lab')
+            )
+    return [], segment_names, segment_lengths
+
+
+def _check_prepared_songs(
+    songs_data: list[dict], out_dir, cached_duration_differences, duration_check_mode
+):
+    """
+    全曲の check_lab と compare_mono_align_and_mono_score の結果を確認する。
+    """
+    # check_lab の結果を保存して確認する。check_lab.main と同じく、
+    # 全曲が点検に通過した場合だけ、修正の結果を保存する。
+    lab_results = [song_data['lab_result'] for song_data in songs_data]
+    if len(label_check.invalid_files(lab_results)) == 0:
+        lab_results = [song_data['repair_result'] for song_data in songs_data]
+    check_lab.save_report_and_raise_if_invalid(out_dir, lab_results)
+
+    # 母音のdurationの統計値を取得する。
+    duration_differences = list(cached_duration_differences or [])
+    for song_data in songs_data:
+        duration_differences += song_data['duration_differences']
+    _, mean_100ns, stdev_100ns = compare_mono_align_and_mono_score.median_mean_pstdev(
+        duration_differences
+    )
+
+    # 音素記号と前奏の長さを点検する。
+    invalid_basenames = []
+    for song_data in songs_data:
+        basename_lab = f'{song_data["songname"]}.lab'
+        if not song_data['phoneme_is_ok']:
+            invalid_basenames.append(basename_lab)
+        if not compare_mono_align_and_mono_score.offet_is_ok(
+            join(out_dir, 'mono_align_round', basename_lab),
+            join(out_dir, 'mono_score_round', basename_lab),
+            mean_100ns,
+            stdev_100ns,
+            mode=duration_check_mode,
+            mono_align_label=song_data['mono_align_round'],
+            mono_score_label=song_data['mono_score_round'],
+        ):
+            invalid_basenames.append(basename_lab)
+    if len(invalid_basenames) > 0:
+        raise Exception(
+            'DBから生成したラベルと楽譜から生成したラベルに不整合があります。'
+            'ログファイルを参照して修正して下さい。'
+        )
+
+    # 音素長をチェックする。
+    for song_data in songs_data:
+        basename_lab = f'{song_data["songname"]}.lab'
+        compare_mono_align_and_mono_score.vowel_durations_are_ok(
+            join(out_dir, 'mono_align_round', basename_lab),
+            join(out_dir, 'mono_score_round', basename_lab),
+            mean_100ns,
+            stdev_100ns,
+            mode=duration_check_mode,
+            mono_align_label=song_data['mono_align_round'],
+            mono_score_label=song_data['mono_score_round'],
+        )
+
+
+def run_single_pass(
+    config, songnames: list[str], cached_duration_differences: list[int] | None = None
+) -> dict[str, dict]:
+    """
+    指定した曲について、ステージ0の各ステップをメモリ上で実行する。
+
+    cached_duration_differences: 処理しない曲の母音のdurationの差。統計値の計算に含める。
+
+    曲名をキーとして、母音のdurationの差とセグメント名のリストを返す。
+    """
+    out_dir = config['out_dir'].strip('"')
+    keep_intermediate_files = config.get('keep_intermediate_files', False)
+    duration_check_mode = config['vowel_duration_check']
+    path_table = ust2lab.table_path(config)
+
+    # 出力先フォルダを作成する
+    output_dirs = [
+        'timelag/label_phone_align',
+        'timelag/label_phone_score',
+        'duration/label_phone_align',
+        'acoustic/wav',
+        'acoustic/label_phone_align',
+        'acoustic/label_phone_score',
+    ]
+    if keep_intermediate_files:
+        output_dirs += [
+            'full_score',
+            'mono_align_round',
+            'full_score_round',
+            'mono_score_round',
+            'full_align_round',
+            'mono_score_round_seg',
+            'full_score_round_seg',
+            'mono_align_round_seg',
+            'full_align_round_seg',
+        ]
+    for output_dir in output_dirs:
+        makedirs(join(out_dir, output_dir), exist_ok=True)
+
+    # 各曲のラベルを読み取って mono_score との比較まで進め、
+    # 全曲の統計値を使った点検のあとに、ラベルを分割して学習用のファイルを出力する。
+    # 2つの段階で同じプロセスプールを使う。
+    print('Processing labels in memory (check_lab - finalize_lab_and_wav)')
+    graph = TaskGraph()
+    for songname in songnames:
+        graph.add(
+            f'{songname}/prepare',
+            _prepare_one_song,
+            songname,
+            out_dir,
+            path_table,
+            keep_intermediate_files,
+        )
+    graph.add(
+        'check',
+        _check_prepared_songs,
+        [ResultOf(f'{songname}/prepare') for songname in songnames],
+        out_dir,
+        cached_duration_differences,
+        duration_check_mode,
+        in_parent=True,
+    )
+    for songname in songnames:
+        graph.add(
+            f'{songname}/finalize',
+            _finalize_one_song,
+            ResultOf(f'{songname}/prepare'),
+            out_dir,
+            config,
+            keep_intermediate_files,
+            deps=['check'],
+        )
+    # 変換テーブルは子プロセスごとに一度だけ読み込む。
+    results = graph.run(
+        desc='single_pass', initializer=ust2lab.init_worker, initargs=(path_table,)
+    )
+
+    invalid_lab_files = []
+    song_results = {}
+    segment_lengths = []
+    for songname in songnames:
+        invalid_lab_files_in_song, segment_names, segment_lengths_in_song = results[
+            f'{songname}/finalize'
+        ]
+        invalid_lab_files += invalid_lab_files_in_song
+        segment_lengths += segment_lengths_in_song
+        song_results[songname] = {
+            'duration_differences': results[f'{songname}/prepare']['duration_differences'],
+            'segments': segment_names,
+        }
+    check_lab_after_segmentation.raise_if_invalid(invalid_lab_files)
+    segment_lab.print_length_report(segment_lengths, segment_lab.report_batch_size(config))
+    return song_results
+
+
+@tracing.traced
+def main(path_config_yaml):
+    """
+    config を読み取って、全曲についてステージ0の各ステップをメモリ上で実行する。
+    copy_files を実行済みであること。
+    """
+    with open(path_config_yaml, encoding='utf-8') as fy:
+        config = yaml.safe_load(fy)
+    out_dir = config['out_dir'].strip('"')
+    ust_dir = join(out_dir, 'ust')
+    mono_align_dir = join(out_dir, 'lab')
+
+    # ファイル数と名前が一致するか点検
+    ust2lab.compare_number_of_ustfiles_and_labfiles(ust_dir, mono_align_dir)
+    ust2lab.compare_name_of_ustfiles_and_labfiles(ust_dir, mono_align_dir)
+
+    # wavファイルのフォーマットが適切か点検する。
+    check_wav.main(path_config_yaml)
+
+    # 除外する曲をスキップする
+    songnames = []
+    for path_ust in natsorted(Path(ust_dir).glob('*.ust')):
+        if path_ust.stem in config['exclude_songs']:
+            print(f'Skip excluded song: {path_ust.stem}')
+        else:
+            songnames.append(path_ust.stem)
+
+    run_single_pass(config, songnames)
+
+
+if __name__ == '__main__':
+    if len(argv) == 1:
+        main('config.yaml')
+    else:
+        main(argv[1].strip('"'))
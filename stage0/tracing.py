@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+ステージ0の各ステップと曲ごとの処理の、実行時間などを記録する。
+
+enable() を呼ぶと、span() や traced() で囲んだ処理ごとに以下の値を記録する。
+記録先フォルダは環境変数で子プロセスにも引き継ぐので、並列処理中のタスクも記録できる。
+
+- 経過時間
+- CPU時間
+- 読み書きしたバイト数 (psutil があればそれを使い、なければ /proc/self/io を使う)
+
+ピークメモリ使用量はプロセス全体の最大値 (high-water mark) で、処理ごとには測れないので、
+プロセスごとに記録する。(/proc/self/status か resource を使い、Windows では psutil を使う)
+
+write_report() で、Chrome のトレース形式 (Perfetto で開ける) の trace.json と、
+処理ごとに集計した summary.txt を出力する。
+profile=True のときは各プロセスの cProfile の結果をまとめて profile.prof に保存する。
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from glob import glob
+from os import environ, getpid, makedirs, remove
+from os.path import basename, join
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENV_TRACE_DIR = 'STAGE0_TRACE_DIR'
+ENV_PROFILE = 'STAGE0_PROFILE'
+
+# プロセスごとの記録状態。fork で引き継がれた値は使わないよう pid も記録する。
+_state = {'pid': None, 'depth': 0, 'events': [], 'profiler': None}
+
+
+def enable(trace_dir, profile=False):
+    """
+    記録を開始する。以前の記録は削除する。
+    """
+    makedirs(trace_dir, exist_ok=True)
+    for pattern in ('events-*.jsonl', 'profile*.prof', 'trace.json', 'summary.txt'):
+        for path in glob(join(trace_dir, pattern)):
+            remove(path)
+    environ[ENV_TRACE_DIR] = trace_dir
+    if profile:
+        environ[ENV_PROFILE] = '1'
+    else:
+        environ.pop(ENV_PROFILE, None)
+
+
+def is_enabled() -> bool:
+    """
+    記録中かどうかを返す。
+    """
+    return bool(environ.get(ENV_TRACE_DIR))
+
+
+def _process_state() -> dict:
+    """
+    このプロセスの記録状態を返す。
+    """
+    if _state['pid'] != getpid():
+        _state.update(pid=getpid(), depth=0, events=[], profiler=None)
+    return _state
+
+
+def _process_peak_rss_bytes():
+    """
+    このプロセスが開始してからのピークメモリ使用量[byte]を返す。取得できない場合は None。
+    """
+    # Linux の ru_maxrss は exec 前のプロセスの値を引き継ぐので、VmHWM を優先する。
+    try:
+        with open('/proc/self/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS では byte 単位、Linux では KiB 単位
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        # Windows ではピーク値を取得できる。
+        return getattr(memory_info, 'peak_wset', memory_info.rss)
+    return None
+
+
+def _io_bytes():
+    """
+    このプロセスが読み書きしたバイト数の累計を返す。取得できない場合は (None, None)。
+    """
+    if psutil is not None:
+        try:
+            io_counters = psutil.Process().io_counters()
+        except (AttributeError, psutil.Error):
+            return None, None
+        return io_counters.read_bytes, io_counters.write_bytes
+    try:
+        with open('/proc/self/io', encoding='utf-8') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None, None
+    return int(counters['rchar']), int(counters['wchar'])
+
+
+def _difference(end, start):
+    """
+    取得できなかった値を None にしたまま差を求める。
+    """
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+def _flush(state, trace_dir):
+    """
+    記録した値をファイルに追記する。
+    プロセスのピークメモリ使用量もここで記録する。(値は単調に増えるので、最後の記録が最大値)
+    """
+    state['events'].append(
+        {
+            'name': 'peak_rss',
+            'ph': 'C',
+            'pid': getpid(),
+            'ts': time.time_ns() // 1000,
+            'peak_rss': _process_peak_rss_bytes(),
+        }
+    )
+    if state['events']:
+        with open(join(trace_dir, f'events-{getpid()}.jsonl'), 'a', encoding='utf-8') as f:
+            for event in state['events']:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        state['events'] = []
+    if state['profiler'] is not None:
+        state['profiler'].dump_stats(join(trace_dir, f'profile-{getpid()}.prof'))
+
+
+@contextmanager
+def span(name, target=None):
+    """
+    with 文で囲んだ処理の実行時間などを記録する。記録中でなければ何もしない。
+
+    name: 処理名。summary.txt ではこの名前ごとに集計する。
+    target: 処理対象のファイル名など。
+    """
+    trace_dir = environ.get(ENV_TRACE_DIR)
+    if not trace_dir:
+        yield
+        return
+    state = _process_state()
+    # 一番外側の処理だけ cProfile を有効にする。
+    outermost = state['depth'] == 0
+    if outermost and environ.get(ENV_PROFILE):
+        if state['profiler'] is None:
+            state['profiler'] = cProfile.Profile()
+        state['profiler'].enable()
+    state['depth'] += 1
+    read_start, write_start = _io_bytes()
+    timestamp_us = time.time_ns() // 1000
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall_sec = time.perf_counter() - wall_start
+        cpu_sec = time.process_time() - cpu_start
+        read_end, write_end = _io_bytes()
+        state['depth'] -= 1
+        if outermost and state['profiler'] is not None:
+            state['profiler'].disable()
+        state['events'].append(
+            {
+                'name': name,
+                'ph': 'X',
+                'target': target,
+                'pid': getpid(),
+                'tid': threading.get_native_id(),
+                'ts': timestamp_us,
+                'wall_sec': wall_sec,
+                'cpu_sec': cpu_sec,
+                'read_bytes': _difference(read_end, read_start),
+                'write_bytes': _difference(write_end, write_start),
+            }
+        )
+        if outermost:
+            _flush(state, trace_dir)
+
+
+def _describe(value):
+    """
+    関数の最初の引数から、記録する処理対象の名前を作る。
+    """
+    if isinstance(value, (list, tuple)) and len(value) > 0:
+        value = value[0]
+    if isinstance(value, dict):
+        value = value.get('songname')
+    if value is None:
+        return None
+    return basename(str(value))
+
+
+def traced(func):
+    """
+    関数の実行時間などを記録するデコレータ。
+    処理名は「モジュール名.関数名」、処理対象は最初の引数から決める。
+    """
+    name = f'{func.__module__.rsplit(".", maxsplit=1)[-1]}.{func.__name__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return func(*args, **kwargs)
+        with span(name, _describe(args[0]) if args else None):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _load_events(trace_dir) -> list[dict]:
+    """
+    全プロセスの記録を読み取る。
+    """
+    events = []
+    for path in sorted(glob(join(trace_dir, 'events-*.jsonl'))):
+        with open(path, encoding='utf-8') as f:
+            events += [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda event: event['ts'])
+
+
+def _to_chrome_trace(events: list[dict], parent_pid) -> dict:
+    """
+    Chrome のトレース形式にする。
+    """
+    trace_events = []
+    for pid in sorted({event['pid'] for event in events}):
+        process_name = 'main' if pid == parent_pid else f'worker {pid}'
+        trace_events.append(
+            {'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': process_name}}
+        )
+    for event in events:
+        # プロセスのピークメモリ使用量はカウンタとして表示する。
+        if event['ph'] == 'C':
+            if event['peak_rss'] is not None:
+                trace_events.append(
+                    {
+                        'name': event['name'],
+                        'ph': 'C',
+                        'pid': event['pid'],
+                        'ts': event['ts'],
+                        'args': {'peak_rss': event['peak_rss']},
+                    }
+                )
+            continue
+        args = {
+            key: event[key]
+            for key in ('target', 'cpu_sec', 'read_bytes', 'write_bytes')
+            if event[key] is not None
+        }
+        trace_events.append(
+            {
+                'name': event['name'],
+                'cat': 'stage0',
+                'ph': 'X',
+                'pid': event['pid'],
+                'tid': event['tid'],
+                'ts': event['ts'],
+                'dur': round(event['wall_sec'] * 1000000),
+                'args': args,
+            }
+        )
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def _sum_or_none(values):
+    """
+    None を含む場合は None にして合計する。
+    """
+    values = list(values)
+    if any(value is None for value in values):
+        return None
+    return sum(values)
+
+
+def _format_bytes(value):
+    """
+    バイト数を MiB 単位の文字列にする。
+    """
+    return '-' if value is None else f'{value / 1048576:.1f}'
+
+
+def process_peak_rss(events: list[dict]) -> dict:
+    """
+    プロセスごとのピークメモリ使用量[byte] (プロセス全体の最大値) を返す。
+    """
+    peak_rss = {}
+    for event in events:
+        if event['ph'] == 'C' and event['peak_rss'] is not None:
+            peak_rss[event['pid']] = max(peak_rss.get(event['pid'], 0), event['peak_rss'])
+    return peak_rss
+
+
+def summarize(events: list[dict], parent_pid=None) -> str:
+    """
+    処理名ごとに集計した表を作る。経過時間の合計が長い順に並べる。
+    その後に、メインプロセスと子プロセスのピークメモリ使用量を1回ずつ示す。
+    """
+    rows = {}
+    for event in events:
+        if event['ph'] == 'X':
+            rows.setdefault(event['name'], []).append(event)
+    width = max((len(name) for name in rows), default=4)
+    header = (
+        f'{"name":<{width}} {"count":>6} {"wall[s]":>9} {"max[s]":>8} {"cpu[s]":>9} '
+        f'{"read[MiB]":>10} {"write[MiB]":>10}'
+    )
+    lines = [header, '-' * len(header)]
+    for name, group in sorted(rows.items(), key=lambda item: -sum(e['wall_sec'] for e in item[1])):
+        lines.append(
+            f'{name:<{width}} {len(group):>6} '
+            f'{sum(e["wall_sec"] for e in group):>9.3f} '
+            f'{max(e["wall_sec"] for e in group):>8.3f} '
+            f'{sum(e["cpu_sec"] for e in group):>9.3f} '
+            f'{_format_bytes(_sum_or_none(e["read_bytes"] for e in group)):>10} '
+            f'{_format_bytes(_sum_or_none(e["write_bytes"] for e in group)):>10}'
+        )
+    peak_rss = process_peak_rss(events)
+    if peak_rss:
+        worker_peak_rss = [value for pid, value in peak_rss.items() if pid != parent_pid]
+        lines += [
+            '',
+            'Peak RSS per process (high-water mark of the whole process) [MiB]',
+            f'main: {_format_bytes(peak_rss.get(parent_pid))}, '
+            f'workers: {_format_bytes(max(worker_peak_rss, default=None))} '
+            f'(max of {len(worker_peak_rss)} processes)',
+        ]
+    return '\n'.join(lines)
+
+
+def merge_profiles(trace_dir) -> str | None:
+    """
+    全プロセスの cProfile の結果をまとめて profile.prof に保存し、上位の関数の一覧を返す。
+    """
+    profile_files = sorted(glob(join(trace_dir, 'profile-*.prof')))
+    if len(profile_files) == 0:
+        return None
+    stream = io.StringIO()
+    stats = pstats.Stats(*profile_files, stream=stream)
+    stats.dump_stats(join(trace_dir, 'profile.prof'))
+    stats.sort_stats('cumulative').print_stats(30)
+    return stream.getvalue()
+
+
+def write_report():
+    """
+    記録した値を trace.json と summary.txt に出力する。
+    """
+    trace_dir = environ.get(ENV_TRACE_DIR)
+    if not trace_dir:
+        return
+    state = _process_state()
+    _flush(state, trace_dir)
+    events = _load_events(trace_dir)
+    with open(join(trace_dir, 'trace.json'), 'w', encoding='utf-8') as f:
+        json.dump(_to_chrome_trace(events, getpid()), f, ensure_ascii=False)
+    summary = summarize(events, getpid())
+    profile_summary = merge_profiles(trace_dir)
+    with open(join(trace_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+        f.write(summary + '\n')
+        if profile_summary is not None:
+            f.write('\n' + profile_summary)
+    print(summary)
+    print(f'Saved stage-0 trace to {join(trace_dir, "trace.json")}')
@@ -7,29 +7,78 @@ UST版
 - '{out_dir}/sinsy_full' にフルラベルを生成する。
 - '{out_dir}/sinsy_mono' にモノラベルを生成する。(この工程は省略した)
 - '{out_dir}/mono_label' にDBのモノラベルを複製する
+
+かな→音素の変換テーブルは、プロセスプールの initializer で子プロセスごとに一度だけ読み込む。
+force_ust_end_with_rest で解析済みのUSTは、ust_cache から取り出して子プロセスに渡す。
+(spawn で作った子プロセスにも渡せるように、fork でのキャッシュの引き継ぎには頼らない。)
 """
 
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import basename, join, splitext
 from sys import argv
 
+import utaupy as up
 import yaml
 from natsort import natsorted  # pyright: ignore[reportMissingImports]
-from tqdm.contrib.concurrent import process_map
-from utaupy.utils import ust2hts
+from tqdm import tqdm
+from utaupy.utils._ust2hts import ustobj2songobj
+
+try:
+    from . import tracing, ust_cache
+except ImportError:  # スクリプトとして実行した場合
+    import tracing
+    import ust_cache
+
+# プロセスごとに読み込んだ変換テーブル
+_table = {'path': None, 'table': None}
 
 
-def _convert_one_ust_file(path_ust, path_full_dir_out, path_table, exclude_songs):
-    """1つのUSTファイルを処理（並列処理用）"""
+def table_path(config) -> str:
+    """
+    config で指定された、かな→音素の変換テーブルのパスを返す。
+    """
+    if 'table_path' in config:
+        return config['table_path'].strip('"')
+    return config['utaupy_table_path'].strip('"')
+
+
+def kana_table(path_table) -> dict:
+    """
+    変換テーブルを返す。このプロセスで読み込み済みならそれを使う。
+    """
+    if _table['path'] != path_table:
+        _table['table'] = up.table.load(path_table, encoding='utf-8')
+        _table['path'] = path_table
+    return _table['table']
+
+
+def init_worker(path_table):
+    """
+    プロセスプールの initializer。子プロセスごとに変換テーブルを一度だけ読み込む。
+    """
+    kana_table(path_table)
+
+
+@tracing.traced
+def _convert_one_ust_file(path_ust, ust, path_full_dir_out, path_table, exclude_songs):
+    """
+    1つのUSTファイルを処理（並列処理用）
+    ust: 親プロセスで解析済みの Ustオブジェクト。None ならファイルを読み取る。
+    """
     songname = splitext(basename(path_ust))[0]
     if songname in exclude_songs:
         print(f'Skip excluded song: {songname}')
     else:
         path_full = f'{path_full_dir_out}/{songname}.lab'
-        ust2hts(path_ust, path_full, path_table, strict_sinsy_style=False)
+        # utaupy.utils.ust2hts と同じ処理。USTと変換テーブルは読み込み済みのものを使う。
+        if ust is None:
+            ust = ust_cache.load(path_ust)
+        song = ustobj2songobj(ust, kana_table(path_table))
+        song.write(path_full, strict_sinsy_style=False)
 
 
 def ust2full(path_ust_dir_in, path_full_dir_out, path_table, exclude_songs):
@@ -38,6 +87,8 @@ def ust2full(path_ust_dir_in, path_full_dir_out, path_table, exclude_songs):
     """
     makedirs(path_full_dir_out, exist_ok=True)
     ust_files = glob(f'{path_ust_dir_in}/**/*.ust', recursive=True)
+    # 解析済みのUSTがあれば、子プロセスで解析しなおさないように渡す。
+    usts = [ust_cache.cached(path_ust) for path_ust in ust_files]
     # partialで固定引数を部分適用した関数を作成
     func = partial(
         _convert_one_ust_file,
@@ -45,8 +96,15 @@ def ust2full(path_ust_dir_in, path_full_dir_out, path_table, exclude_songs):
         path_table=path_table,
         exclude_songs=exclude_songs,
     )
-    # 並列処理でUST変換
-    process_map(func, ust_files, colour='blue')
+    # 並列処理でUST変換。変換テーブルは子プロセスごとに一度だけ読み込む。
+    with ProcessPoolExecutor(initializer=init_worker, initargs=(path_table,)) as executor:
+        list(
+            tqdm(
+                executor.map(func, ust_files, usts, chunksize=max(1, len(ust_files) // 64)),
+                total=len(ust_files),
+                colour='blue',
+            )
+        )
 
 
 def compare_number_of_ustfiles_and_labfiles(ust_dir, mono_align_dir):
@@ -90,6 +148,7 @@ def compare_name_of_ustfiles_and_labfiles(ust_dir, mono_align_dir):
         )
 
 
+@tracing.traced
 def main(path_config_yaml):
     """
     1. yamlを読み取って、以下の項目を取得する。
@@ -104,10 +163,7 @@ def main(path_config_yaml):
         config = yaml.safe_load(fy)
     exclude_songs = config['exclude_songs']
     out_dir = config['out_dir'].strip('"')
-    if 'table_path' in config:
-        path_table = config['table_path'].strip('"')
-    else:
-        path_table = config['utaupy_table_path'].strip('"')
+    path_table = table_path(config)
 
     ust_dir = join(out_dir, 'ust')
     mono_align_dir = join(out_dir, 'lab')
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+読み取ったUSTファイルをプロセス内でキャッシュして、同じファイルを何度も解析しないようにする。
+
+force_ust_end_with_rest で読み取って修正したUSTを、ust2lab がそのまま使う。
+ファイルの内容のハッシュで照合するので、書き換えられたファイルの古い内容は使わない。
+(USTファイルは小さいので、読み取りとハッシュの計算は解析より十分速い。)
+キャッシュはプロセスごとに持つ。子プロセスで使うには、cached() で取り出して引数で渡す。
+(spawn で作った子プロセスは、親プロセスのキャッシュを引き継がないため。)
+
+load() が返す Ustオブジェクトはキャッシュと共有している。変更した場合は write() で書き戻すこと。
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from os.path import abspath
+
+import utaupy as up
+
+# プロセス内でキャッシュするUSTファイルの合計サイズの上限[byte]
+MAX_CACHE_BYTES = 16 * 1024 * 1024
+
+# {絶対パス: (内容のハッシュ, ファイルサイズ, Ustオブジェクト)}
+_cache: OrderedDict = OrderedDict()
+_state = {'bytes': 0, 'hits': 0, 'misses': 0}
+
+
+def _digest(data: bytes) -> bytes:
+    """
+    ファイルの内容のハッシュを返す。
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _read_bytes(path):
+    """
+    ファイルの内容を返す。ファイルがなければ None を返す。
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _remember(path, digest, nbytes, ust):
+    """
+    プロセス内のキャッシュに追加する。同じパスの古い内容は置き換える。
+    """
+    if path in _cache:
+        _state['bytes'] -= _cache.pop(path)[1]
+    _cache[path] = (digest, nbytes, ust)
+    _state['bytes'] += nbytes
+    while _state['bytes'] > MAX_CACHE_BYTES and len(_cache) > 1:
+        _, (_, old_nbytes, _) = _cache.popitem(last=False)
+        _state['bytes'] -= old_nbytes
+
+
+def clear():
+    """
+    プロセス内のキャッシュを空にする。
+    """
+    _cache.clear()
+    _state['bytes'] = 0
+
+
+def stats() -> dict:
+    """
+    プロセス内のキャッシュの使用状況を返す。
+    """
+    return {'entries': len(_cache), **_state}
+
+
+def _lookup(path, data):
+    """
+    ファイルの内容がキャッシュと同じなら、キャッシュした Ustオブジェクトを返す。
+    """
+    entry = _cache.get(path)
+    if entry is None or entry[0] != _digest(data):
+        return None
+    _cache.move_to_end(path)
+    return entry[2]
+
+
+def cached(path):
+    """
+    キャッシュした Ustオブジェクトを返す。
+    ファイルの内容が変わっているか、まだ読み取っていなければ None を返す。
+    USTを解析しないので、並列処理の前に親プロセスで呼んでも遅くならない。
+    """
+    path = abspath(str(path).strip('"'))
+    data = _read_bytes(path)
+    if data is None:
+        return None
+    return _lookup(path, data)
+
+
+def load(path) -> up.ust.Ust:
+    """
+    USTファイルを読み取って Ustオブジェクトを返す。内容が同じならキャッシュを使う。
+    """
+    path = abspath(str(path).strip('"'))
+    data = _read_bytes(path)
+    if data is None:
+        raise FileNotFoundError(path)
+    ust = _lookup(path, data)
+    if ust is not None:
+        _state['hits'] += 1
+        return ust
+    _state['misses'] += 1
+    ust = up.ust.load(path)
+    _remember(path, _digest(data), len(data), ust)
+    return ust
+
+
+def write(ust, path_out, encoding='cp932') -> bool:
+    """
+    Ustオブジェクトを Ust.write と同じ形式でファイルに書き出して、キャッシュする。
+    ファイルの内容が変わらない場合は書き出さない。書き出したかどうかを返す。
+
+    Ust.write と同じく [#DELETE] のノートを除いて、テンポとノート番号を整理する。
+    (書き出した内容と一致するように、ust 自体も整理する。)
+    """
+    path = abspath(str(path_out).strip('"'))
+    ust.notes = [note for note in ust.notes if note.tag != '[#DELETE]']
+    ust.reload_tempo()
+    ust.reload_index()
+    text = str(ust) + '\n'
+    # テキストモードで書き出したときと同じ改行コードで比較する。
+    data = text.replace('\n', os.linesep).encode(encoding)
+    changed = _read_bytes(path) != data
+    if changed:
+        with open(path, mode='w', encoding=encoding) as f:
+            f.write(text)
+    _remember(path, _digest(data), len(data), ust)
+    return changed
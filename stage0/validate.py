@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+歌唱DB全体について、ステージ0の点検をすべて一度に実行して、結果をまとめて出力する。
+
+通常のステージ0は最初に見つかった不具合で止まるので、不具合の多いDBは何度も実行しなおす必要がある。
+このモジュールは歌唱DBのファイルを直接読み取り、学習用のファイルを作らずに以下をすべて点検する。
+
+- UST・LAB・WAV の組がそろっているか (ust2lab)
+- LABファイルの発声時刻 (check_lab)
+- WAVファイルのフォーマット (check_wav)
+- USTの末尾が休符か (force_ust_end_with_rest)
+- DB同梱のラベルと楽譜の音素記号 (compare_mono_align_and_mono_score)
+- 前奏と母音の長さの外れ値 (compare_mono_align_and_mono_score)
+- WAVファイルがラベルより長いか (assert_wav_is_longer_than_lab)
+
+曲ごとの点検はプロセスプールで並列に行い、全曲の統計値を使う点検はそのあとにまとめて行う。
+結果は JSON と HTML で保存する。不具合の重さ (severity) は、通常のステージ0での扱いに合わせる。
+
+- error  : ステージ0が停止する。
+- warning: 警告を出して処理を続ける。
+- info   : 自動で修正して処理を続ける。
+
+error が1件でもあれば、終了コードを 1 にする。
+"""
+
+import html
+import logging
+import statistics
+import sys
+from collections import Counter
+from functools import partial
+from os import makedirs
+from os.path import basename, dirname, expanduser, join, splitext
+from sys import argv
+
+import utaupy as up
+import yaml
+from natsort import natsorted
+from tqdm.contrib.concurrent import process_map
+from utaupy.utils._ust2hts import ustobj2songobj
+
+try:
+    from . import (
+        audio_index,
+        compact_label,
+        compare_mono_align_and_mono_score,
+        copy_files,
+        full2mono,
+        label_cache,
+        label_check,
+        merge_rest_full_score,
+        merge_rest_mono_align,
+        round_lab,
+        single_pass,
+        tracing,
+        ust2lab,
+    )
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+    import compact_label
+    import compare_mono_align_and_mono_score
+    import copy_files
+    import full2mono
+    import label_cache
+    import label_check
+    import merge_rest_full_score
+    import merge_rest_mono_align
+    import round_lab
+    import single_pass
+    import tracing
+    import ust2lab
+
+# 出力する JSON の形式を変えたときに増やす
+REPORT_VERSION = 1
+REPORT_NAME = 'validate_report.json'
+# 1曲分としてそろっている必要があるファイルの拡張子
+SONG_EXTENSIONS = ('ust', 'lab', 'wav')
+SEVERITIES = ('error', 'warning', 'info')
+
+
+def _problem(check, severity, message, **kwargs) -> dict:
+    """
+    不具合1件分の記録を作る。
+    """
+    return {'check': check, 'severity': severity, 'message': message, **kwargs}
+
+
+def report_path(config) -> str:
+    """
+    config で指定された、点検結果の JSON ファイルのパスを返す。
+    指定がなければ {out_dir}/validate_report.json にする。
+    """
+    path_report = config.get('stage0_validate_report')
+    if path_report:
+        return path_report.strip('"')
+    return join(config['out_dir'].strip('"'), REPORT_NAME)
+
+
+def find_songs(db_root, exclude_songs=()) -> list[dict]:
+    """
+    歌唱DBのフォルダを一度だけ走査して、曲ごとの UST・LAB・WAV のパスを返す。
+    見つからなかったファイルは None にする。
+    copy_files と同じく、同名のファイルが複数ある場合は後に見つかったものを使う。
+    """
+    target_files = copy_files.find_target_files(db_root, SONG_EXTENSIONS, exclude_songs)
+    songs = {}
+    for ext in SONG_EXTENSIONS:
+        for path in target_files[ext]:
+            songname = splitext(basename(path))[0]
+            song = songs.setdefault(
+                songname,
+                {'name': songname, **dict.fromkeys(SONG_EXTENSIONS), 'duplicates': []},
+            )
+            if song[ext] is not None:
+                song['duplicates'].append(song[ext])
+            song[ext] = path
+    return [songs[songname] for songname in natsorted(songs)]
+
+
+def _read_wav(path_wav, problems: list):
+    """
+    WAVファイルのヘッダを読み取って、点検に使う情報を返す。読み取れなければ None を返す。
+    """
+    try:
+        info = audio_index.read_wav_info(path_wav)
+    except Exception as e:
+        problems.append(_problem('wav_format', 'error', f'WAVファイルを読み取れません。: {e}'))
+        return None
+    return {
+        'channels': info['channels'],
+        'frame_rate': info['frame_rate'],
+        'sample_width': info['sample_width'],
+        'duration_seconds': info['duration_seconds'],
+    }
+
+
+def _mono_align_label(path_lab, problems: list):
+    """
+    check_lab から compare_mono_align_and_mono_score の直前までを、DB同梱のラベルに行う。
+    発声時刻に不具合があっても、音素記号を比較できるようにラベルを返す。
+    """
+    label = label_cache.load(path_lab)
+    if len(label) == 0:
+        problems.append(_problem('lab_timing', 'error', 'LABファイルに音素がありません。'))
+        return None
+    # check_lab: 発声時刻を点検して、短すぎる音素を修正する。
+    lab_problems = label_check.find_problems(label, 0)
+    for lab_problem in lab_problems:
+        problems.append(
+            _problem(
+                'lab_timing', 'error', 'LABファイルの発声時刻に不具合があります。', **lab_problem
+            )
+        )
+    if len(lab_problems) == 0:
+        label = label.copy()
+        try:
+            label.repair_too_short_phonemes(5, path_lab)
+        except ValueError as e:
+            problems.append(_problem('lab_timing', 'error', str(e), kind='unrepairable'))
+    # merge_rest_mono_align, round_lab
+    mono_align_label = merge_rest_mono_align.merge_rests_mono(label.to_label())
+    mono_align_label.round(round_lab.ROUND_STEP_SIZE)
+    # compare_mono_align_and_mono_score.force_start_with_zero
+    if mono_align_label[0].start != 0:
+        problems.append(
+            _problem(
+                'lab_start',
+                'info',
+                'DB同梱のラベルの最初の音素開始時刻が0ではありません。0に修正します。',
+                start=mono_align_label[0].start,
+            )
+        )
+        mono_align_label[0].start = 0
+    return mono_align_label
+
+
+def _score_labels(path_ust, path_table, problems: list):
+    """
+    force_ust_end_with_rest から full2mono までを、USTファイルに行う。
+    (丸めたモノラベル, 丸めたフルラベル) を返す。
+    """
+    ust = up.ust.load(path_ust)
+    # force_ust_end_with_rest
+    if ust.notes[-1].lyric != 'R':
+        problems.append(
+            _problem(
+                'ust_trailing_rest', 'info', 'USTの末尾に休符がありません。休符を追加します。'
+            )
+        )
+    ust.make_finalnote_R()
+    # ust2lab, merge_rest_full_score
+    full_score_lines = merge_rest_full_score.merge_rests_full_lines(
+        single_pass.song_to_full_lines(ustobj2songobj(ust, ust2lab.kana_table(path_table)))
+    )
+    # round_lab
+    full_score_label = single_pass.lines_to_label(full_score_lines)
+    full_score_label.round(round_lab.ROUND_STEP_SIZE)
+    # full2mono
+    mono_score_label = single_pass.lines_to_label(
+        full2mono.convert_full_to_mono_lines([str(phoneme) for phoneme in full_score_label])
+    )
+    return mono_score_label, full_score_label
+
+
+def _compare_labels(mono_align_label, mono_score_label, result: dict):
+    """
+    compare_mono_align_and_mono_score.compare_song_labels で音素記号を比較して、
+    前奏と母音の長さの差を記録する。
+    外れ値かどうかは、全曲の統計値を求めてから check_corpus で点検する。
+    """
+    mono_align_label = compact_label.CompactLabel.from_label(mono_align_label)
+    mono_score_label = compact_label.CompactLabel.from_label(mono_score_label)
+    song_durations = compare_mono_align_and_mono_score.compare_song_labels(
+        mono_align_label, mono_score_label
+    )
+    i = song_durations['mismatch_index']
+    if i is not None:
+        result['problems'].append(
+            _problem(
+                'phoneme',
+                'error',
+                'DB同梱のラベルと楽譜から生成したラベルの音素記号が一致しません。',
+                index=i,
+                align=mono_align_label.lines()[i],
+                score=mono_score_label.lines()[i],
+            )
+        )
+    elif not song_durations['phoneme_is_ok']:
+        result['problems'].append(
+            _problem(
+                'phoneme',
+                'error',
+                'DB同梱のラベルと楽譜から生成したラベルの音素数が一致しません。',
+                align_count=len(mono_align_label),
+                score_count=len(mono_score_label),
+            )
+        )
+    result['offset_difference'] = song_durations['offset_difference']
+    result['durations'] = song_durations
+    # 外れ値を報告するときのために、点検する母音の行だけ取っておく。
+    mono_align_lines = mono_align_label.lines()
+    mono_score_lines = mono_score_label.lines()
+    result['vowel_lines'] = {
+        index: (mono_align_lines[index], mono_score_lines[index])
+        for index in song_durations['vowel_indices'].tolist()
+    }
+
+
+@tracing.traced
+def validate_song(song: dict, path_table) -> dict:
+    """
+    1曲分のファイルを点検して、結果を返す。(並列処理用)
+    song: find_songs の戻り値の要素
+    """
+    problems = []
+    result = {
+        'song': song['name'],
+        'files': {ext: song[ext] for ext in SONG_EXTENSIONS},
+        'wav': None,
+        'problems': problems,
+        'offset_difference': None,
+        'durations': None,
+        'vowel_lines': {},
+    }
+    # ust2lab: ファイルの組がそろっているか
+    for ext in SONG_EXTENSIONS:
+        if song[ext] is None:
+            problems.append(
+                _problem('file_pairing', 'error', f'{ext.upper()}ファイルがありません。', ext=ext)
+            )
+    for path in song['duplicates']:
+        problems.append(
+            _problem(
+                'file_pairing',
+                'warning',
+                '同じ名前のファイルが複数あります。後に見つかったファイルを使います。',
+                path=path,
+            )
+        )
+    # check_wav
+    if song['wav'] is not None:
+        result['wav'] = _read_wav(song['wav'], problems)
+    mono_align_label = None
+    if song['lab'] is not None:
+        try:
+            mono_align_label = _mono_align_label(song['lab'], problems)
+        except Exception as e:
+            problems.append(_problem('lab_timing', 'error', f'LABファイルを読み取れません。: {e}'))
+    mono_score_label = full_score_label = None
+    if song['ust'] is not None:
+        try:
+            mono_score_label, full_score_label = _score_labels(song['ust'], path_table, problems)
+        except Exception as e:
+            problems.append(_problem('ust', 'error', f'USTファイルを変換できません。: {e!r}'))
+    # compare_mono_align_and_mono_score
+    if mono_align_label is not None and mono_score_label is not None:
+        _compare_labels(mono_align_label, mono_score_label, result)
+    # assert_wav_is_longer_than_lab: full_align の終了時刻は full_score と同じ。
+    if result['wav'] is not None and full_score_label is not None:
+        lab_seconds = full_score_label[-1].end / 10000000
+        if result['wav']['duration_seconds'] < lab_seconds:
+            problems.append(
+                _problem(
+                    'wav_length',
+                    'warning',
+                    'WAV is shorter than LAB or score.',
+                    wav_seconds=result['wav']['duration_seconds'],
+                    lab_seconds=lab_seconds,
+                )
+            )
+    return result
+
+
+def _check_wav_formats(results: list[dict]):
+    """
+    check_wav と同じく、モノラル音声か、サンプリングレートとビット深度が全曲で同じかを点検する。
+    """
+    results = [result for result in results if result['wav'] is not None]
+    if len(results) == 0:
+        return
+    mode_frame_rate = statistics.mode(result['wav']['frame_rate'] for result in results)
+    mode_sample_width = statistics.mode(result['wav']['sample_width'] for result in results)
+    for result in results:
+        wav = result['wav']
+        if wav['channels'] != 1:
+            result['problems'].append(
+                _problem('wav_format', 'error', 'モノラル音声ではありません。', **wav)
+            )
+        if wav['frame_rate'] != mode_frame_rate:
+            result['problems'].append(
+                _problem(
+                    'wav_format',
+                    'error',
+                    f'サンプリングレートが他のファイル ({mode_frame_rate} Hz) と一致しません。',
+                    **wav,
+                )
+            )
+        if wav['sample_width'] != mode_sample_width:
+            result['problems'].append(
+                _problem(
+                    'wav_format',
+                    'error',
+                    f'ビット深度が他のファイル ({mode_sample_width * 8} bit) と一致しません。',
+                    **wav,
+                )
+            )
+
+
+def check_corpus(results: list[dict], duration_check_mode: str) -> dict:
+    """
+    全曲の結果を使う点検 (WAVのフォーマットの一致、前奏と母音の長さの外れ値) を行い、
+    各曲の結果に不具合を追加する。母音のdurationの差の統計値を返す。
+    """
+    _check_wav_formats(results)
+
+    stats = compare_mono_align_and_mono_score.DurationStats()
+    for result in results:
+        if result['durations'] is not None:
+            stats = stats.merge(result['durations']['stats'])
+    if stats.count == 0:
+        return {}
+    median_100ns, mean_100ns, stdev_100ns = stats.median_mean_pstdev()
+    k_offset = compare_mono_align_and_mono_score.OFFSET_SIGMAS.get(duration_check_mode, 6)
+    k_vowel = compare_mono_align_and_mono_score.VOWEL_DURATION_SIGMAS.get(duration_check_mode, 6)
+    offset_range = (mean_100ns - k_offset * stdev_100ns, mean_100ns + k_offset * stdev_100ns)
+    vowel_range = (mean_100ns - k_vowel * stdev_100ns, mean_100ns + k_vowel * stdev_100ns)
+
+    for result in results:
+        # offet_is_ok: 前奏の長さ
+        offset_difference = result['offset_difference']
+        if offset_difference is not None and not (
+            offset_range[0] < offset_difference < offset_range[1]
+        ):
+            result['problems'].append(
+                _problem(
+                    'offset',
+                    'error',
+                    f'DB同梱のラベルの前奏の長さが、平均値 ± {k_offset}σ の範囲外です。',
+                    difference_ms=round(offset_difference / 10000),
+                )
+            )
+        # vowel_durations_are_ok: 母音の長さ
+        if result['durations'] is None:
+            continue
+        for i, difference in compare_mono_align_and_mono_score.vowel_outliers(
+            result['durations'], *vowel_range
+        ):
+            align, score = result['vowel_lines'][i]
+            result['problems'].append(
+                _problem(
+                    'vowel_duration',
+                    'warning',
+                    f'DB同梱のラベルの母音の長さが、平均値 ± {k_vowel}σ の範囲外です。',
+                    index=i,
+                    difference_ms=round(difference / 10000),
+                    align=align,
+                    score=score,
+                )
+            )
+    return {
+        'num_vowels': stats.count,
+        'median_ms': median_100ns / 10000,
+        'mean_ms': mean_100ns / 10000,
+        'pstdev_ms': stdev_100ns / 10000,
+        'offset_sigmas': k_offset,
+        'offset_range_ms': [round(t / 10000) for t in offset_range],
+        'vowel_duration_sigmas': k_vowel,
+        'vowel_duration_range_ms': [round(t / 10000) for t in vowel_range],
+    }
+
+
+def make_report(results: list[dict], db_root, duration_check_mode, vowel_statistics) -> dict:
+    """
+    点検結果を、JSON に出力する形式にまとめる。不具合がなかった曲は、曲数だけ数える。
+    """
+    problems = [problem for result in results for problem in result['problems']]
+    if len(results) == 0:
+        problems.append(_problem('file_pairing', 'error', f'曲が見つかりません。: {db_root}'))
+    severities = Counter(problem['severity'] for problem in problems)
+    return {
+        'version': REPORT_VERSION,
+        'db_root': db_root,
+        'vowel_duration_check': duration_check_mode,
+        'num_songs': len(results),
+        'num_songs_with_errors': sum(
+            any(problem['severity'] == 'error' for problem in result['problems'])
+            for result in results
+        ),
+        **{f'num_{severity}s': severities[severity] for severity in SEVERITIES},
+        'checks': dict(Counter(f'{p["check"]}/{p["severity"]}' for p in problems)),
+        'vowel_duration_difference': vowel_statistics,
+        'problems': problems if len(results) == 0 else [],
+        'songs': [
+            {key: result[key] for key in ('song', 'files', 'wav', 'problems')}
+            for result in results
+            if result['problems']
+        ],
+    }
+
+
+def _html_details(problem: dict) -> str:
+    """
+    不具合の詳細を、HTMLの表のセルに書く文字列にする。
+    """
+    return ', '.join(
+        f'{key}={value}'
+        for key, value in problem.items()
+        if key not in ('check', 'severity', 'message')
+    )
+
+
+def save_html_report(path_html, report: dict):
+    """
+    点検結果を、ブラウザで見るための HTML ファイルに保存する。
+    """
+    rows = [
+        '<tr class="{}"><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format(  # noqa: UP032
+            problem['severity'],
+            html.escape(song['song']),
+            problem['severity'],
+            html.escape(problem['check']),
+            html.escape(problem['message']),
+            html.escape(_html_details(problem)),
+        )
+        for song in report['songs']
+        for problem in song['problems']
+    ]
+    summary = [
+        f'<tr><th>{html.escape(key)}</th><td>{html.escape(str(report[key]))}</td></tr>'
+        for key in (
+            'db_root',
+            'num_songs',
+            'num_songs_with_errors',
+            'num_errors',
+            'num_warnings',
+            'num_infos',
+        )
+    ]
+    summary += [
+        f'<tr><th>{html.escape(key)}</th><td>{html.escape(str(value))}</td></tr>'
+        for key, value in report['vowel_duration_difference'].items()
+    ]
+    summary += [
+        f'<tr><th>{html.escape(problem["check"])}</th><td>{html.escape(problem["message"])}</td></tr>'
+        for problem in report['problems']
+    ]
+    lines = [
+        '<!DOCTYPE html>',
+        '<html><head><meta charset="utf-8"><title>stage0 validate report</title>',
+        '<style>',
+        'table { border-collapse: collapse; }',
+        'th, td { border: 1px solid #ccc; padding: 2px 6px; }',
+        '.error { background: #fdd; } .warning { background: #ffd; } .info { background: #eef; }',
+        '</style></head><body>',
+        '<h1>stage0 validate report</h1>',
+        '<table>',
+        *summary,
+        '</table>',
+        '<h2>Problems</h2>',
+        '<table>',
+        '<tr><th>song</th><th>severity</th><th>check</th><th>message</th><th>details</th></tr>',
+        *rows,
+        '</table>',
+        '</body></html>',
+    ]
+    with open(path_html, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+@tracing.traced
+def main(path_config_yaml) -> int:
+    """
+    config を読み取って歌唱DB全体を点検し、結果を保存する。
+    error があれば 1 を、なければ 0 を返す。(終了コードに使う)
+    """
+    with open(path_config_yaml, encoding='utf-8') as fy:
+        config = yaml.safe_load(fy)
+    db_root = expanduser(config['db_root']).strip('"')
+    duration_check_mode = config['vowel_duration_check']
+    path_table = ust2lab.table_path(config)
+
+    songs = find_songs(db_root, config.get('exclude_songs') or ())
+    print(f'Validating {len(songs)} songs in "{db_root}"')
+    results = process_map(
+        partial(validate_song, path_table=path_table),
+        songs,
+        colour='blue',
+        chunksize=max(1, len(songs) // 64),
+    )
+    vowel_statistics = check_corpus(results, duration_check_mode)
+    report = make_report(results, db_root, duration_check_mode, vowel_statistics)
+
+    path_report = report_path(config)
+    makedirs(dirname(path_report) or '.', exist_ok=True)
+    label_check.save_report(path_report, report)
+    save_html_report(f'{splitext(path_report)[0]}.html', report)
+
+    for song in report['songs']:
+        for problem in song['problems']:
+            if problem['severity'] == 'error':
+                logging.error('%s: %s (%s)', song['song'], problem['message'], problem['check'])
+    print(
+        f'{report["num_songs_with_errors"]} / {report["num_songs"]} songs have errors. '
+        f'(errors: {report["num_errors"]}, warnings: {report["num_warnings"]}, '
+        f'infos: {report["num_infos"]})'
+    )
+    print(f'Saved validation report: {path_report}')
+    return 1 if report['num_errors'] != 0 else 0
+
+
+if __name__ == '__main__':
+    if len(argv) == 1:
+        sys.exit(main('config.yaml'))
+    else:
+        sys.exit(main(argv[1].strip('"')))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+WAVファイルのヘッダだけを読み取って、チャンネル数やサンプルレート、長さを取得する。
+
+pydub.AudioSegment.from_file は音声全体を読み込むので、長い音声ファイルでは遅く、メモリも使う。
+ここでは RIFF/WAVE の fmt チャンクと data チャンクのサイズだけを読み取る。
+(WAVE_FORMAT_EXTENSIBLE と RF64 にも対応する。)
+ヘッダが壊れている場合だけ、pydub で音声全体を読み込む。
+"""
+
+import logging
+import struct
+import warnings
+from os import fstat
+from sys import argv
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from pydub import AudioSegment
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavHeaderError(ValueError):
+    """
+    WAVファイルのヘッダを読み取れないときの例外
+    """
+
+
+def _parse_fmt_chunk(body: bytes) -> dict:
+    """
+    fmt チャンクの中身を読み取る。
+    """
+    if len(body) < 16:
+        raise WavHeaderError(f'fmt チャンクが短すぎます: {len(body)} bytes')
+    format_tag, channels, frame_rate, _, block_align, bits_per_sample = struct.unpack_from(
+        '<HHIIHH', body
+    )
+    # WAVE_FORMAT_EXTENSIBLE の場合は、SubFormat の先頭2バイトが実際のフォーマット
+    if format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(body) < 40:
+            raise WavHeaderError('WAVE_FORMAT_EXTENSIBLE の fmt チャンクが短すぎます。')
+        (format_tag,) = struct.unpack_from('<H', body, 24)
+    if channels == 0 or frame_rate == 0 or block_align == 0:
+        raise WavHeaderError(
+            f'fmt チャンクの値が不正です: channels={channels}, '
+            f'frame_rate={frame_rate}, block_align={block_align}'
+        )
+    return {
+        'format_tag': format_tag,
+        'channels': channels,
+        'frame_rate': frame_rate,
+        'block_align': block_align,
+        'bits_per_sample': bits_per_sample,
+    }
+
+
+def read_wav_header(path_wav) -> dict:
+    """
+    WAVファイルのヘッダを読み取る。音声データは読み込まない。
+    ヘッダを読み取れない場合は WavHeaderError を送出する。
+
+    戻り値の sample_width は pydub と同じく、24bit の場合は 4 にする。
+    (pydub は 24bit の音声を 32bit に変換して読み込むため。)
+    """
+    with open(path_wav, 'rb') as f:
+        file_size = fstat(f.fileno()).st_size
+        riff_header = f.read(12)
+        if len(riff_header) < 12 or riff_header[8:12] != b'WAVE':
+            raise WavHeaderError('RIFF/WAVE ファイルではありません。')
+        riff_id = riff_header[:4]
+        if riff_id not in (b'RIFF', b'RF64', b'BW64'):
+            raise WavHeaderError(f'RIFF/WAVE ファイルではありません: {riff_id!r}')
+
+        fmt = None
+        ds64_data_size = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise WavHeaderError('data チャンクが見つかりません。')
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'data':
+                break
+            if chunk_id == b'fmt ':
+                fmt = _parse_fmt_chunk(f.read(chunk_size))
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b'ds64':
+                # RF64 の場合は、data チャンクのサイズを ds64 チャンクに記録する。
+                body = f.read(chunk_size)
+                if len(body) < 16:
+                    raise WavHeaderError('ds64 チャンクが短すぎます。')
+                (ds64_data_size,) = struct.unpack_from('<Q', body, 8)
+                f.seek(chunk_size & 1, 1)
+            else:
+                # チャンクのサイズが奇数の場合は1バイトの詰め物がある。
+                f.seek(chunk_size + (chunk_size & 1), 1)
+        if fmt is None:
+            raise WavHeaderError('fmt チャンクが data チャンクより前にありません。')
+        data_offset = f.tell()
+
+    if chunk_size == 0xFFFFFFFF and ds64_data_size is not None:
+        chunk_size = ds64_data_size
+    # 書き込み途中のファイルなど、実際のサイズがヘッダより小さい場合はファイル末尾までとする。
+    data_size = min(chunk_size, file_size - data_offset)
+    num_frames = data_size // fmt['block_align']
+    sample_width = fmt['bits_per_sample'] // 8
+    return {
+        'path': path_wav,
+        'format_tag': fmt['format_tag'],
+        'channels': fmt['channels'],
+        'frame_rate': fmt['frame_rate'],
+        'sample_width': 4 if sample_width == 3 else sample_width,
+        'bits_per_sample': fmt['bits_per_sample'],
+        'block_align': fmt['block_align'],
+        'data_offset': data_offset,
+        'data_size': data_size,
+        'num_frames': num_frames,
+        'duration_seconds': num_frames / fmt['frame_rate'],
+    }
+
+
+def _read_wav_info_by_decoding(path_wav) -> dict:
+    """
+    pydub で音声全体を読み込んで、read_wav_header と同じ形式の情報を返す。
+    """
+    audio = AudioSegment.from_file(path_wav)
+    return {
+        'path': path_wav,
+        'format_tag': None,
+        'channels': audio.channels,
+        'frame_rate': audio.frame_rate,
+        'sample_width': audio.sample_width,
+        'bits_per_sample': audio.sample_width * 8,
+        'block_align': audio.frame_width,
+        'data_offset': None,
+        'data_size': len(audio.raw_data),
+        'num_frames': int(audio.frame_count()),
+        'duration_seconds': audio.duration_seconds,
+    }
+
+
+def read_wav_info(path_wav) -> dict:
+    """
+    WAVファイルの情報を取得する。
+    ヘッダを読み取れない場合だけ、pydub で音声全体を読み込む。
+    """
+    try:
+        return read_wav_header(path_wav)
+    except WavHeaderError as e:
+        logging.warning(
+            'WAVファイルのヘッダを読み取れないため、音声全体を読み込みます。: %s (%s)', path_wav, e
+        )
+        return _read_wav_info_by_decoding(path_wav)
+
+
+if __name__ == '__main__':
+    for path in argv[1:]:
+        print(read_wav_info(path.strip('"')))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+WAVファイルをデコードせずに切り出す。
+
+元のWAVファイルの data チャンクをメモリマップして、切り出す範囲のバイト列を
+新しいヘッダの後ろにそのまま書き込む。音声全体を読み込まないので速く、メモリもほとんど使わない。
+
+切断位置は、ラベルの時刻[100ns]から計算したサンプル番号にする。
+(pydub で切り出していたときは、ミリ秒に丸めてから切断していた。)
+ヘッダを読み取れないWAVファイルだけは、pydub で音声全体を読み込んでから同じように切り出す。
+"""
+
+import mmap
+import struct
+import warnings
+from sys import argv
+
+try:
+    from . import audio_index
+except ImportError:  # スクリプトとして実行した場合
+    import audio_index
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from pydub import AudioSegment
+
+# ラベルの時刻の単位[100ns] を秒に直すときの分母
+TIME_UNIT = 10_000_000
+
+
+def time_to_frame(t, frame_rate: int) -> int:
+    """
+    ラベルの時刻[100ns] を、最も近いサンプル番号にする。(ちょうど半分の場合は切り上げる。)
+    """
+    return (int(t) * frame_rate + TIME_UNIT // 2) // TIME_UNIT
+
+
+def _wav_header(format_tag, channels, frame_rate, block_align, bits_per_sample, data_size):
+    """
+    44バイトの RIFF/WAVE ヘッダを作る。
+    """
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF',
+        36 + data_size + (data_size & 1),
+        b'WAVE',
+        b'fmt ',
+        16,
+        format_tag,
+        channels,
+        frame_rate,
+        frame_rate * block_align,
+        block_align,
+        bits_per_sample,
+        b'data',
+        data_size,
+    )
+
+
+class WavSource:
+    """
+    切り出し元のWAVファイル。with文で開いて、write_segment() で切り出す。
+
+    WAVE_FORMAT_EXTENSIBLE のファイルは、SubFormat の形式 (PCM または IEEE float) の
+    通常のヘッダで書き出す。24bit の音声は 24bit のまま書き出す。
+    """
+
+    def __init__(self, path_wav):
+        self.path = path_wav
+        self._file = None
+        self._mmap = None
+        self._data = None
+        info = audio_index.read_wav_info(path_wav)
+        self.channels = info['channels']
+        self.frame_rate = info['frame_rate']
+        self.block_align = info['block_align']
+        self.bits_per_sample = info['bits_per_sample']
+        self.format_tag = info['format_tag']
+        self.num_frames = info['num_frames']
+        self.duration_seconds = info['duration_seconds']
+        self._data_offset = info['data_offset']
+
+    def __enter__(self):
+        if self._data_offset is None:
+            # ヘッダを読み取れない場合は、デコードした音声から切り出す。
+            audio = AudioSegment.from_file(self.path, format='wav')
+            self.format_tag = 1
+            self.block_align = audio.frame_width
+            self.bits_per_sample = audio.sample_width * 8
+            self.num_frames = int(audio.frame_count())
+            self._data = memoryview(audio.raw_data)
+        else:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._mmap)[
+                self._data_offset : self._data_offset + self.num_frames * self.block_align
+            ]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # memoryview を解放してから mmap を閉じる。
+        if self._data is not None:
+            self._data.release()
+            self._data = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def frame_range(self, t_start, t_end) -> tuple[int, int]:
+        """
+        ラベルの時刻[100ns] の範囲を、サンプル番号の範囲にする。音声の範囲外は切り詰める。
+        """
+        start = min(max(time_to_frame(t_start, self.frame_rate), 0), self.num_frames)
+        end = min(max(time_to_frame(t_end, self.frame_rate), start), self.num_frames)
+        return start, end
+
+    def write_segment(self, t_start, t_end, path_wav_out):
+        """
+        ラベルの時刻[100ns] の範囲を切り出して、WAVファイルに保存する。
+        """
+        self.write_frames(*self.frame_range(t_start, t_end), path_wav_out)
+
+    def write_frames(self, start: int, end: int, path_wav_out):
+        """
+        サンプル番号の範囲を切り出して、WAVファイルに保存する。音声の範囲外は切り詰める。
+        """
+        start = min(max(start, 0), self.num_frames)
+        end = min(max(end, start), self.num_frames)
+        data = self._data[start * self.block_align : end * self.block_align]
+        header = _wav_header(
+            self.format_tag,
+            self.channels,
+            self.frame_rate,
+            self.block_align,
+            self.bits_per_sample,
+            len(data),
+        )
+        with open(path_wav_out, 'wb') as f:
+            f.write(header)
+            f.write(data)
+            # data チャンクのサイズが奇数の場合は1バイトの詰め物を入れる。
+            if len(data) & 1:
+                f.write(b'\x00')
+        data.release()
+
+
+if __name__ == '__main__':
+    # usage: wav_segment.py 入力WAV 開始時刻[100ns] 終了時刻[100ns] 出力WAV
+    with WavSource(argv[1].strip('"')) as source:
+        source.write_segment(int(argv[2]), int(argv[3]), argv[4].strip('"'))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+full2mono._convert_one_full_to_mono が、utaupy.hts.load(path).as_mono() と
+同じモノラベルのファイルを書き出すことを確かめる。
+バイト列のまま切り出す処理と、utaupy で変換しなおす処理の両方を対象にする。
+"""
+
+from pathlib import Path
+
+import pytest
+import utaupy as up
+from utaupy.utils._ust2hts import ustobj2songobj
+
+from stage0 import full2mono, ust2lab
+
+PATH_TABLE = Path(__file__).resolve().parents[1] / 'dic' / 'kana2phonemes_etk_001.table'
+# 最初のノートを休符にしないことで、1行目を消すとノートの途中から始まるようにする。
+NOTES = [('か', 480), ('R', 480), ('さ', 240), ('きゃ', 240), ('R', 480), ('ん', 480), ('R', 480)]
+
+
+def _full_label_bytes(tmp_path: Path) -> bytes:
+    """
+    NOTES から、ust2lab と同じ手順でフルラベルのファイルを作って、その内容を返す。
+    """
+    lines = ['[#VERSION]', 'UST Version1.2', '[#SETTING]', 'Tempo=120.00', 'Tracks=1']
+    for i, (lyric, length) in enumerate(NOTES):
+        lines += [f'[#{i:04}]', f'Length={length}', f'Lyric={lyric}', 'NoteNum=60']
+    lines.append('[#TRACKEND]')
+    path_ust = tmp_path / 'song.ust'
+    path_ust.write_text('\n'.join(lines) + '\n', encoding='cp932')
+    song = ustobj2songobj(up.ust.load(str(path_ust)), ust2lab.kana_table(str(PATH_TABLE)))
+    path_full = tmp_path / 'song_full.lab'
+    song.write(str(path_full), strict_sinsy_style=False)
+    return path_full.read_bytes()
+
+
+# 名前: (フルラベルの内容を書き換える関数, バイト列のまま切り出せるか)
+VARIANTS = {
+    'lf': (lambda data: data, True),
+    'trailing_newline': (lambda data: data + b'\n', True),
+    'crlf': (lambda data: data.replace(b'\n', b'\r\n'), False),
+    'cp932': (lambda data: data.replace(b'-a+', '-あ+'.encode('cp932'), 1), False),
+    'wave_dash': (lambda data: data.replace(b'~', '∼'.encode(), 1), False),
+    'modifier_circumflex': (lambda data: data.replace(b'^', 'ˆ'.encode(), 1), False),
+    'first_line_is_not_note': (lambda data: data.split(b'\n', 1)[1], False),
+}
+
+
+@pytest.mark.parametrize('name', list(VARIANTS))
+def test_convert_one_full_to_mono_matches_utaupy(tmp_path, name):
+    """
+    どの書き換えについても、utaupy で変換した場合と同じファイルを書き出す。
+    """
+    modify, can_slice = VARIANTS[name]
+    data = modify(_full_label_bytes(tmp_path))
+    # 想定した処理を通っていなければ、両方の処理を確かめたことにならない。
+    assert (full2mono._convert_bytes(data) is not None) == can_slice
+
+    path_full = tmp_path / 'full' / f'{name}.lab'
+    path_full.parent.mkdir()
+    path_full.write_bytes(data)
+    mono_dir = tmp_path / 'mono'
+    mono_dir.mkdir()
+    full2mono._convert_one_full_to_mono(str(path_full), str(mono_dir))
+
+    path_expected = tmp_path / 'expected.lab'
+    up.hts.load(str(path_full)).as_mono().write(str(path_expected))
+    assert (mono_dir / f'{name}.lab').read_bytes() == path_expected.read_bytes()
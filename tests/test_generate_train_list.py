@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+generate_train_list.generate_train_list_by_hash で、
+曲を追加してもほかの曲やセグメントの振り分けが変わらないことを確かめる。
+"""
+
+from pathlib import Path
+
+import pytest
+
+from stage0 import generate_train_list
+
+
+def _make_segments(out_dir: Path, songnames, num_segments: int = 3):
+    """
+    {out_dir}/acoustic/wav に、曲ごとのセグメントの空のWAVファイルを作る。
+    """
+    wav_dir = out_dir / 'acoustic' / 'wav'
+    wav_dir.mkdir(parents=True, exist_ok=True)
+    for songname in songnames:
+        for i in range(num_segments):
+            (wav_dir / f'{songname}__seg{i}.wav').touch()
+
+
+def _subset_of(out_dir: Path, select_by) -> dict[str, str]:
+    """
+    セグメント名から、振り分け先 (dev, eval, train) への辞書を返す。
+    """
+    _, dev_list, eval_list, train_list = generate_train_list.generate_train_list_by_hash(
+        out_dir, select_by=select_by
+    )
+    return {
+        utt_id: name
+        for name, utt_list in (('dev', dev_list), ('eval', eval_list), ('train', train_list))
+        for utt_id in utt_list
+    }
+
+
+@pytest.mark.parametrize('select_by', ['song', 'segment'])
+def test_split_is_stable_when_songs_are_added(tmp_path, select_by):
+    """
+    曲を追加しても、もとからある曲のセグメントの振り分けは変わらない。
+    """
+    # dev や eval が空のときに train から移した曲は、曲を追加すると戻ることがあるので、
+    # ハッシュだけで dev と eval が埋まる曲数にする。
+    _make_segments(tmp_path, [f'song{i:03}' for i in range(60)])
+    before = _subset_of(tmp_path, select_by)
+    assert {'dev', 'eval', 'train'} == set(before.values())
+
+    _make_segments(tmp_path, [f'added{i:03}' for i in range(40)] + ['song999', 'a_song'])
+    after = _subset_of(tmp_path, select_by)
+    assert len(after) == len(before) + 42 * 3
+    assert {utt_id: after[utt_id] for utt_id in before} == before
+
+
+def test_song_is_not_split_across_subsets(tmp_path):
+    """
+    select_by='song' では、同じ曲のセグメントはすべて同じリストに入る。
+    """
+    _make_segments(tmp_path, [f'song{i:03}' for i in range(40)], num_segments=5)
+    subsets = _subset_of(tmp_path, 'song')
+    for i in range(40):
+        assert len({subsets[f'song{i:03}__seg{j}'] for j in range(5)}) == 1
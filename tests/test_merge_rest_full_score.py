@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+merge_rest_full_score の高速な休符結合 (_merge_rests_full_lines) が、
+utaupy の Songオブジェクトを使う結合 (_merge_rests_full_lines_with_song) と
+同じ行を返すことを確かめる。
+"""
+
+from itertools import pairwise
+from pathlib import Path
+
+import pytest
+import utaupy as up
+from utaupy.utils._ust2hts import ustobj2songobj
+
+from stage0 import merge_rest_full_score, single_pass, ust2lab
+
+PATH_TABLE = Path(__file__).resolve().parents[1] / 'dic' / 'kana2phonemes_etk_001.table'
+
+# (歌詞, ノート長, テンポ) のリスト。テンポが None のノートはテンポを変えない。
+USTS = {
+    'rests_at_start_and_end': [
+        ('R', 480, None),
+        ('あ', 480, None),
+        ('か', 240, None),
+        ('R', 480, None),
+    ],
+    'consecutive_rests': [
+        ('R', 480, None),
+        ('R', 480, None),
+        ('あ', 480, None),
+        ('R', 240, None),
+        ('R', 240, None),
+        ('R', 120, None),
+        ('か', 480, None),
+        ('R', 480, None),
+        ('R', 960, None),
+    ],
+    'single_note': [
+        ('あ', 480, None),
+    ],
+    'single_note_between_rests': [
+        ('R', 480, None),
+        ('さ', 1920, None),
+        ('R', 480, None),
+    ],
+    'multiple_phrases': [
+        ('R', 960, None),
+        ('さ', 480, None),
+        ('きゃ', 240, None),
+        ('っ', 120, None),
+        ('R', 480, None),
+        ('br', 120, None),
+        ('ん', 480, None),
+        ('が', 480, None),
+        ('R', 240, None),
+        ('R', 240, None),
+        ('しゅ', 480, None),
+        ('ー', 480, None),
+        ('R', 480, None),
+    ],
+    'tempo_changes': [
+        ('R', 480, None),
+        ('た', 480, '140'),
+        ('R', 7, None),
+        ('R', 13, '97.5'),
+        ('な', 60, None),
+        ('R', 480, '181.3'),
+        ('R', 480, None),
+    ],
+}
+
+
+def _load_ust(path_ust: Path, notes) -> up.ust.Ust:
+    """
+    ノートのリストからUSTファイルを作って読み取る。
+    """
+    lines = ['[#VERSION]', 'UST Version1.2', '[#SETTING]', 'Tempo=120.00', 'Tracks=1']
+    for i, (lyric, length, tempo) in enumerate(notes):
+        lines += [f'[#{i:04}]', f'Length={length}', f'Lyric={lyric}', 'NoteNum=60']
+        if tempo is not None:
+            lines.append(f'Tempo={tempo}')
+    lines.append('[#TRACKEND]')
+    path_ust.write_text('\n'.join(lines) + '\n', encoding='cp932')
+    return up.ust.load(str(path_ust))
+
+
+def _full_lines(tmp_path: Path, name) -> list[str]:
+    """
+    USTS のノートから、ust2lab と同じ手順でフルラベルの行のリストを作る。
+    """
+    ust = _load_ust(tmp_path / f'{name}.ust', USTS[name])
+    return single_pass.song_to_full_lines(ustobj2songobj(ust, ust2lab.kana_table(str(PATH_TABLE))))
+
+
+@pytest.mark.parametrize('name', list(USTS))
+def test_fast_path_matches_song(tmp_path, name):
+    """
+    ust2lab と同じ手順で作ったフルラベルについて、どちらの結合も同じ行を返す。
+    """
+    full_lines = _full_lines(tmp_path, name)
+    merged_lines = merge_rest_full_score._merge_rests_full_lines(list(full_lines))
+    # None のときは utaupy で結合しなおすので、高速な結合を確かめたことにならない。
+    assert merged_lines is not None
+    assert merged_lines == merge_rest_full_score._merge_rests_full_lines_with_song(
+        list(full_lines)
+    )
+    assert merged_lines == merge_rest_full_score.merge_rests_full_lines(list(full_lines))
+
+
+def test_consecutive_rests_are_merged(tmp_path):
+    """
+    連続する休符が1つにまとめられる。(結合しない実装でも上のテストは通るため)
+    """
+    full_lines = _full_lines(tmp_path, 'consecutive_rests')
+    merged_lines = merge_rest_full_score._merge_rests_full_lines(list(full_lines))
+    symbols = [line.split()[2].split('-')[1].split('+')[0] for line in merged_lines]
+    assert len(merged_lines) < len(full_lines)
+    assert not any(a == b == 'pau' for a, b in pairwise(symbols))
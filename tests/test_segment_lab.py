@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+segment_lab.segment_ranges の分割位置を確かめる。
+balanced (_balanced_ranges) が基準長を守ることと、
+各セグメントの長さと目標の長さの差の二乗和が greedy より大きくならないことを確かめる。
+"""
+
+import random
+
+import pytest
+
+from stage0 import compact_label, segment_lab
+
+MAX_PAUSE_DURATION = 4  # [s]
+# (max_segment_length, segment_target_length) [s]
+LENGTH_SETTINGS = [(30, 15), (10, 5), (10, 8), (6, 2)]
+
+
+def _random_label(seed: int) -> compact_label.CompactLabel:
+    """
+    休符と音素を並べたラベルを作る。時刻は 50ms 単位にして、休符ごとの範囲はどれも 5 秒以下にする。
+    """
+    rng = random.Random(seed)
+    symbols, durations = [], []
+    for _ in range(rng.randint(1, 40)):
+        # ときどき max_pause_duration より長い休符を入れる。
+        if rng.random() < 0.15:
+            durations.append(rng.randint(90, 160) * 500000)
+        else:
+            durations.append(rng.randint(2, 20) * 500000)
+        symbols.append('pau')
+        for _ in range(rng.randint(2, 8)):
+            durations.append(rng.randint(1, 10) * 500000)
+            symbols.append(rng.choice(['a', 'i', 'k', 's', 'N', 'cl']))
+    durations.append(rng.randint(2, 20) * 500000)
+    symbols.append('sil')
+    ends = [sum(durations[: i + 1]) for i in range(len(durations))]
+    starts = [0] + ends[:-1]
+    return compact_label.CompactLabel.from_lines(starts, ends, symbols)
+
+
+def _segment_lengths(label, ranges) -> list[int]:
+    """
+    各セグメントの長さ [100ns] を返す。
+    """
+    return [
+        int(label.ends[end_idx - 1] - label.starts[start_idx + drop])
+        for start_idx, end_idx, drop in ranges
+    ]
+
+
+def _squared_error(label, ranges, target_segment_length) -> float:
+    """
+    各セグメントの長さと目標の長さの差の二乗和を返す。(_balanced_ranges が最小にする値)
+    """
+    return sum(
+        (length - target_segment_length * 1e7) ** 2 for length in _segment_lengths(label, ranges)
+    )
+
+
+@pytest.mark.parametrize('max_segment_length, target_segment_length', LENGTH_SETTINGS)
+@pytest.mark.parametrize('seed', range(30))
+def test_balanced_ranges(seed, max_segment_length, target_segment_length):
+    """
+    balanced は max_segment_length を超えず、二乗和が greedy 以下になる。
+    長い休符だけを除去して、ほかの音素はすべてどれかのセグメントに含まれる。
+    """
+    label = _random_label(seed)
+    ranges = {
+        mode: segment_lab.segment_ranges(
+            label,
+            MAX_PAUSE_DURATION,
+            max_segment_length,
+            mode=mode,
+            target_segment_length=target_segment_length,
+        )
+        for mode in segment_lab.SEGMENT_MODES
+    }
+
+    long_pauses = {
+        idx
+        for idx, (symbol, duration) in enumerate(zip(label.symbols, label.durations))
+        if symbol == 'pau' and duration > MAX_PAUSE_DURATION * 1e7
+    }
+    expected_indices = [idx for idx in range(len(label) - 1) if idx not in long_pauses]
+    for mode_ranges in ranges.values():
+        assert max(_segment_lengths(label, mode_ranges)) <= max_segment_length * 1e7
+        covered_indices = [
+            idx
+            for start_idx, end_idx, drop in mode_ranges
+            for idx in range(start_idx + drop, end_idx)
+        ]
+        assert covered_indices == expected_indices
+
+    assert _squared_error(label, ranges['balanced'], target_segment_length) <= _squared_error(
+        label, ranges['greedy'], target_segment_length
+    ) * (1 + 1e-9)
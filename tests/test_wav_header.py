@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+wav_header.read_wav_header が、wave モジュールで読み取った値と同じ値を返すことを確かめる。
+PCM のほか、WAVE_FORMAT_EXTENSIBLE、奇数サイズのチャンクを含むファイル、RF64 を対象にする。
+"""
+
+import struct
+import wave
+from pathlib import Path
+
+import pytest
+
+from stage0 import wav_header
+
+# (チャンネル数, サンプルあたりのバイト数, サンプリングレート, フレーム数)
+# 8bit モノラルで奇数フレームにして、data チャンクのサイズも奇数にする。
+AUDIO_PARAMS = [(1, 2, 48000, 1000), (2, 3, 44100, 777), (1, 1, 22050, 501)]
+# KSDATAFORMAT_SUBTYPE_PCM の GUID
+SUBTYPE_PCM = bytes.fromhex('0100000000001000800000aa00389b71')
+
+
+def _chunk(chunk_id: bytes, body: bytes, size=None) -> bytes:
+    """
+    チャンクを作る。サイズが奇数の場合は1バイトの詰め物を付ける。
+    """
+    size = len(body) if size is None else size
+    return chunk_id + struct.pack('<I', size) + body + b'\x00' * (len(body) & 1)
+
+
+def _fmt_body(channels, sample_width, frame_rate, extensible=False) -> bytes:
+    """
+    fmt チャンクの中身を作る。
+    """
+    block_align = channels * sample_width
+    values = (channels, frame_rate, frame_rate * block_align, block_align, sample_width * 8)
+    if not extensible:
+        return struct.pack('<HHIIHH', wav_header.WAVE_FORMAT_PCM, *values)
+    return struct.pack(
+        '<HHIIHHHHI16s',
+        wav_header.WAVE_FORMAT_EXTENSIBLE,
+        *values,
+        22,
+        sample_width * 8,
+        (1 << channels) - 1,
+        SUBTYPE_PCM,
+    )
+
+
+def _riff(chunks: list[bytes]) -> bytes:
+    """
+    RIFF/WAVE ファイルの内容を作る。
+    """
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def _pcm(params, frames: bytes) -> bytes:
+    """
+    fmt と data 以外のチャンクを含まない、ふつうの PCM の WAV ファイル
+    """
+    return _riff([_chunk(b'fmt ', _fmt_body(*params)), _chunk(b'data', frames)])
+
+
+def _extensible(params, frames: bytes) -> bytes:
+    """
+    WAVE_FORMAT_EXTENSIBLE の WAV ファイル
+    """
+    return _riff([_chunk(b'fmt ', _fmt_body(*params, extensible=True)), _chunk(b'data', frames)])
+
+
+def _odd_chunks(params, frames: bytes) -> bytes:
+    """
+    fmt チャンクの前後と data チャンクの後に、奇数サイズのチャンクがある WAV ファイル
+    """
+    return _riff(
+        [
+            _chunk(b'LIST', b'INFOx'),
+            _chunk(b'fmt ', _fmt_body(*params)),
+            _chunk(b'junk', b'abc'),
+            _chunk(b'data', frames),
+            _chunk(b'id3 ', b'abcdefg'),
+        ]
+    )
+
+
+def _rf64(params, frames: bytes) -> bytes:
+    """
+    data チャンクのサイズを ds64 チャンクに記録した RF64 ファイル
+    """
+    num_frames = len(frames) // (params[0] * params[1])
+    data = _chunk(b'data', frames, size=0xFFFFFFFF)
+    fmt = _chunk(b'fmt ', _fmt_body(*params))
+    # 'WAVE' と ds64 チャンク (ヘッダ 8 bytes + 中身 28 bytes) と fmt と data の合計
+    riff_size = 4 + (8 + 28) + len(fmt) + len(data)
+    ds64 = _chunk(b'ds64', struct.pack('<QQQI', riff_size, len(frames), num_frames, 0))
+    return b'RF64' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE' + ds64 + fmt + data
+
+
+VARIANTS = {
+    'pcm': _pcm,
+    'extensible': _extensible,
+    'odd_chunks': _odd_chunks,
+    'rf64': _rf64,
+}
+
+
+def _write_with_wave(path_wav: Path, params):
+    """
+    wave モジュールで WAV ファイルを書き出して、(fmt の値, 音声データ) を返す。
+    """
+    channels, sample_width, frame_rate, num_frames = params
+    frames = bytes(i % 251 for i in range(num_frames * channels * sample_width))
+    with wave.open(str(path_wav), 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(sample_width)
+        w.setframerate(frame_rate)
+        w.writeframes(frames)
+    return (channels, sample_width, frame_rate), frames
+
+
+@pytest.mark.parametrize('params', AUDIO_PARAMS)
+@pytest.mark.parametrize('name', list(VARIANTS))
+def test_read_wav_header_matches_wave(tmp_path, name, params):
+    """
+    どの形式でも、wave で読み取ったチャンネル数・サンプリングレート・ビット深度・フレーム数と、
+    data チャンクの位置が一致する。
+    """
+    path_reference = tmp_path / 'reference.wav'
+    fmt_params, frames = _write_with_wave(path_reference, params)
+    path_wav = tmp_path / f'{name}.wav'
+    path_wav.write_bytes(VARIANTS[name](fmt_params, frames))
+
+    header = wav_header.read_wav_header(str(path_wav))
+    with wave.open(str(path_reference), 'rb') as w:
+        assert header['channels'] == w.getnchannels()
+        assert header['frame_rate'] == w.getframerate()
+        assert header['bits_per_sample'] == w.getsampwidth() * 8
+        assert header['sample_width'] == (4 if w.getsampwidth() == 3 else w.getsampwidth())
+        assert header['block_align'] == w.getnchannels() * w.getsampwidth()
+        assert header['num_frames'] == w.getnframes()
+        assert header['duration_seconds'] == w.getnframes() / w.getframerate()
+        expected_frames = w.readframes(w.getnframes())
+    assert header['format_tag'] == wav_header.WAVE_FORMAT_PCM
+    data = path_wav.read_bytes()
+    offset, size = header['data_offset'], header['data_size']
+    assert data[offset : offset + size] == expected_frames
+
+
+@pytest.mark.parametrize('params', AUDIO_PARAMS)
+@pytest.mark.parametrize('name', ['wave', 'odd_chunks'])
+def test_file_readable_by_wave(tmp_path, name, params):
+    """
+    wave でも読めるファイル (wave が書き出したファイルと、奇数サイズのチャンクを含むファイル) は、
+    そのファイルを wave で読み取った値と直接比べる。
+    """
+    path_wav = tmp_path / 'reference.wav'
+    fmt_params, frames = _write_with_wave(path_wav, params)
+    if name == 'odd_chunks':
+        path_wav = tmp_path / 'odd_chunks.wav'
+        path_wav.write_bytes(_odd_chunks(fmt_params, frames))
+    header = wav_header.read_wav_header(str(path_wav))
+    with wave.open(str(path_wav), 'rb') as w:
+        assert (
+            header['channels'],
+            header['frame_rate'],
+            header['bits_per_sample'],
+            header['num_frames'],
+        ) == (w.getnchannels(), w.getframerate(), w.getsampwidth() * 8, w.getnframes())
+
+
+def test_truncated_data_chunk(tmp_path):
+    """
+    data チャンクが途中で切れている場合は、ファイルの末尾までのフレーム数を返す。
+    """
+    fmt_params, frames = _write_with_wave(tmp_path / 'reference.wav', AUDIO_PARAMS[0])
+    path_wav = tmp_path / 'truncated.wav'
+    path_wav.write_bytes(_pcm(fmt_params, frames)[:-101])
+    header = wav_header.read_wav_header(str(path_wav))
+    assert header['num_frames'] == (len(frames) - 101) // 2
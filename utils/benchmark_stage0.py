@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+合成した歌唱DBを使って、ステージ0の処理速度を計測する。
+
+曲数ごとに generate_synthetic_database.py で歌唱DBを生成し、
+preprocess_data.py を記録つき (stage0_trace_dir) で実行する。
+preprocess_data.main 全体と、各ステップの main() について、
+経過時間・CPU時間・1秒あたりの曲数を JSON に保存する。
+ピークメモリ使用量はプロセス全体の最大値なので、メインプロセスと子プロセスに分けて1回ずつ記録する。
+
+コミットごとの結果を比べられるよう、JSON にはコミットのハッシュも記録する。
+
+usage: python utils/benchmark_stage0.py [--sizes 10 100 1000] [--pipelines default dag]
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from os import cpu_count, makedirs
+from os.path import abspath, dirname, exists, join
+from shutil import rmtree
+
+import generate_synthetic_database
+import yaml
+
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_WORK_DIR = join(REPO_ROOT, 'benchmark')
+
+
+def git_commit() -> str | None:
+    """
+    現在のコミットのハッシュを返す。取得できない場合は None。
+    """
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def prepare_database(work_dir, num_songs: int, sample_rate: int) -> str:
+    """
+    合成した歌唱DBを用意する。生成済みの場合はそれを使う。
+    """
+    db_root = join(work_dir, f'db_{num_songs}_{sample_rate}')
+    path_done = join(db_root, '.done')
+    if not exists(path_done):
+        rmtree(db_root, ignore_errors=True)
+        generate_synthetic_database.main(
+            db_root,
+            num_songs,
+            sample_rate=sample_rate,
+            path_table=join(REPO_ROOT, 'dic', 'kana2phonemes_etk_001.table'),
+        )
+        with open(path_done, 'w', encoding='utf-8'):
+            pass
+    return db_root
+
+
+def write_config(base_config: dict, work_dir, db_root, num_songs: int, pipeline) -> str:
+    """
+    計測用の config を作成して、そのパスを返す。
+    """
+    run_name = f'{pipeline}_{num_songs}'
+    config = {
+        **base_config,
+        'db_root': db_root,
+        'out_dir': join(work_dir, f'out_{run_name}'),
+        'exclude_songs': [],
+        'stage0_pipeline': pipeline,
+        'stage0_cache': False,
+        'stage0_trace_dir': join(work_dir, f'trace_{run_name}'),
+        'stage0_profile': False,
+    }
+    path_config = join(work_dir, f'config_{run_name}.yaml')
+    with open(path_config, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return path_config
+
+
+def summarize_trace(path_trace_json, num_songs: int) -> dict:
+    """
+    preprocess_data が出力した trace.json から、ステップごとの値を集計する。
+    """
+    with open(path_trace_json, encoding='utf-8') as f:
+        events = [e for e in json.load(f)['traceEvents'] if e['ph'] == 'X']
+    steps = {}
+    for event in events:
+        step = steps.setdefault(event['name'], {'count': 0, 'wall_sec': 0.0, 'cpu_sec': 0.0})
+        step['count'] += 1
+        step['wall_sec'] += event['dur'] / 1000000
+        step['cpu_sec'] += event['args'].get('cpu_sec', 0.0)
+    for step in steps.values():
+        step['songs_per_sec'] = num_songs / step['wall_sec'] if step['wall_sec'] > 0 else None
+    return steps
+
+
+def summarize_peak_rss(path_trace_json) -> dict:
+    """
+    trace.json から、メインプロセスと子プロセス (の最大値) のピークメモリ使用量[MiB]を求める。
+    """
+    with open(path_trace_json, encoding='utf-8') as f:
+        trace_events = json.load(f)['traceEvents']
+    main_pids = {
+        e['pid']
+        for e in trace_events
+        if e['ph'] == 'M' and e['name'] == 'process_name' and e['args']['name'] == 'main'
+    }
+    peak_rss = {}
+    for event in trace_events:
+        if event['ph'] == 'C' and event['name'] == 'peak_rss':
+            pid = event['pid']
+            peak_rss[pid] = max(peak_rss.get(pid, 0), event['args']['peak_rss'] / 1048576)
+    return {
+        'main_peak_rss_mib': max(
+            (v for pid, v in peak_rss.items() if pid in main_pids), default=None
+        ),
+        'worker_peak_rss_mib': max(
+            (v for pid, v in peak_rss.items() if pid not in main_pids), default=None
+        ),
+        'num_worker_processes': len(peak_rss.keys() - main_pids),
+    }
+
+
+def run_benchmark(path_config, num_songs: int) -> dict:
+    """
+    preprocess_data.py を別プロセスで実行して、計測結果を返す。
+    """
+    with open(path_config, encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    t_start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, join(REPO_ROOT, 'preprocess_data.py'), path_config],
+        cwd=REPO_ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    wall_sec = time.perf_counter() - t_start
+    path_trace_json = join(config['stage0_trace_dir'], 'trace.json')
+    steps = summarize_trace(path_trace_json, num_songs)
+    # ステップの main() と、曲ごとの処理に分ける
+    main_steps = {name: v for name, v in steps.items() if name.endswith('.main')}
+    tasks = {name: v for name, v in steps.items() if not name.endswith('.main')}
+    return {
+        'num_songs': num_songs,
+        'pipeline': config['stage0_pipeline'],
+        'wall_sec': wall_sec,
+        'songs_per_sec': num_songs / wall_sec,
+        **summarize_peak_rss(path_trace_json),
+        'steps': main_steps,
+        'tasks': tasks,
+    }
+
+
+def print_results(results: list[dict]):
+    """
+    計測結果の概要を表示する。
+    """
+    print(
+        f'{"pipeline":<12} {"songs":>6} {"wall[s]":>9} {"songs/s":>9} '
+        f'{"mainRSS[MiB]":>12} {"workerRSS[MiB]":>14}'
+    )
+    for result in results:
+        main_rss = result['main_peak_rss_mib']
+        worker_rss = result['worker_peak_rss_mib']
+        print(
+            f'{result["pipeline"]:<12} {result["num_songs"]:>6} {result["wall_sec"]:>9.2f} '
+            f'{result["songs_per_sec"]:>9.2f} '
+            f'{"-" if main_rss is None else f"{main_rss:.1f}":>12} '
+            f'{"-" if worker_rss is None else f"{worker_rss:.1f}":>14}'
+        )
+
+
+def main(sizes=DEFAULT_SIZES, pipelines=('default',), work_dir=DEFAULT_WORK_DIR, path_output=None):
+    """
+    曲数と処理方法の組み合わせごとに計測して、結果を JSON に保存する。
+    """
+    # 生成したファイルを git の管理対象にしない
+    makedirs(work_dir, exist_ok=True)
+    with open(join(work_dir, '.gitignore'), 'w', encoding='utf-8') as f:
+        f.write('*\n')
+    with open(join(REPO_ROOT, 'config.yaml'), encoding='utf-8') as f:
+        base_config = yaml.safe_load(f)
+    sample_rate = base_config['sample_rate']
+    commit = git_commit()
+
+    results = []
+    for num_songs in sizes:
+        db_root = prepare_database(work_dir, num_songs, sample_rate)
+        for pipeline in pipelines:
+            print(f'Benchmarking stage 0: {num_songs} songs, pipeline={pipeline}')
+            path_config = write_config(base_config, work_dir, db_root, num_songs, pipeline)
+            results.append(run_benchmark(path_config, num_songs))
+
+    report = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'cpu_count': cpu_count(),
+        'results': results,
+    }
+    if path_output is None:
+        path_output = join(work_dir, f'benchmark_{(commit or "unknown")[:10]}.json')
+    with open(path_output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print(f'Saved benchmark results to {path_output}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark stage 0 with synthetic databases.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument(
+        '--pipelines',
+        nargs='+',
+        default=['default'],
+        choices=['default', 'single_pass', 'dag'],
+    )
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    main(args.sizes, args.pipelines, args.work_dir, args.output)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 oatsu
+"""
+ステージ0の速度計測用に、合成した歌唱DBを生成する。
+
+変換テーブルにある歌詞でランダムなUSTを作り、楽譜から作ったモノラベルの時刻を
+少しずらしたものを LAB とする。WAV はラベルより少し長いノイズにする。
+ステージ0の各ステップ (休符の結合、長い休符の除去、末尾の休符の追加など) を通るよう、
+以下を含める。
+
+- 連続する休符、4秒より長い休符
+- 休符で終わらないUST
+- pau の代わりに sil を使ったラベル
+
+usage: python utils/generate_synthetic_database.py OUT_DIR NUM_SONGS [SAMPLE_RATE]
+"""
+
+import random
+import wave
+from os import makedirs
+from os.path import join
+from sys import argv
+
+import numpy as np
+import utaupy as up
+from tqdm import tqdm
+from utaupy.utils._ust2hts import ustobj2songobj
+
+DEFAULT_TABLE_PATH = 'dic/kana2phonemes_etk_001.table'
+# 歌詞に使わない項目
+SPECIAL_LYRICS = {'R', 'pau', 'sil', 'br', '息'}
+# LABの時刻をずらす幅と、音素の最短の長さ[100ns]
+JITTER_100NS = 150000
+MIN_PHONEME_DURATION_100NS = 60000
+
+
+def _add_note(ust, lyric, length, notenum=60):
+    """
+    USTの末尾にノートを追加する。
+    """
+    note = up.ust.Note(tag=f'[#{len(ust.notes):04d}]')
+    note.lyric = lyric
+    note.length = length
+    note.notenum = notenum
+    ust.notes.append(note)
+
+
+def generate_ust(rng: random.Random, lyrics: list[str]):
+    """
+    ランダムなフレーズと休符を並べたUSTを作る。
+    """
+    ust = up.ust.Ust()
+    ust.setting['Tempo'] = rng.choice([100, 120, 140])
+    _add_note(ust, 'R', rng.choice([480, 960, 1920]))
+    for _ in range(rng.randint(3, 9)):
+        for _ in range(rng.randint(3, 12)):
+            _add_note(
+                ust, rng.choice(lyrics), rng.choice([240, 480, 720, 960]), rng.randint(55, 72)
+            )
+        for _ in range(rng.choice([1, 1, 2, 3])):
+            _add_note(ust, 'R', rng.choice([240, 480, 1920, 4800]))
+    # 休符で終わらないUSTも作る
+    if rng.random() < 0.3:
+        ust.notes[-1].lyric = rng.choice(lyrics)
+    ust.reload_tempo()
+    return ust
+
+
+def generate_mono_align_label(rng: random.Random, mono_score_label):
+    """
+    楽譜から作ったモノラベルの時刻をずらして、DB同梱のラベルのようにする。
+    """
+    times = [int(phoneme.start) for phoneme in mono_score_label]
+    times.append(int(mono_score_label[-1].end))
+    new_times = [0]
+    for t in times[1:-1]:
+        t += rng.randint(-JITTER_100NS, JITTER_100NS)
+        new_times.append(max(t, new_times[-1] + MIN_PHONEME_DURATION_100NS))
+    new_times.append(max(times[-1], new_times[-1] + MIN_PHONEME_DURATION_100NS))
+
+    label = up.label.Label()
+    for i, phoneme_score in enumerate(mono_score_label):
+        phoneme = up.label.Phoneme()
+        phoneme.start = new_times[i]
+        phoneme.end = new_times[i + 1]
+        phoneme.symbol = phoneme_score.symbol
+        # 休符の一部を sil にする
+        if phoneme.symbol == 'pau' and rng.random() < 0.2:
+            phoneme.symbol = 'sil'
+        label.append(phoneme)
+    return label
+
+
+def write_noise_wav(path_wav, duration_sec, sample_rate, seed):
+    """
+    指定した長さのノイズを 16bit モノラルのWAVファイルとして保存する。
+    """
+    num_frames = int(duration_sec * sample_rate)
+    samples = np.random.default_rng(seed).standard_normal(num_frames) * 300
+    with wave.open(path_wav, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.astype('<i2').tobytes())
+
+
+def generate_song(songname, out_dir, d_table, lyrics, sample_rate=48000, seed=0):
+    """
+    1曲分の UST・LAB・WAV を生成する。
+    """
+    rng = random.Random(f'{seed}-{songname}')
+    ust = generate_ust(rng, lyrics)
+    path_ust = join(out_dir, f'{songname}.ust')
+    ust.write(path_ust)
+
+    # ステージ0と同じく、休符で終わるようにしてからラベルにする。
+    ust = up.ust.load(path_ust)
+    ust.make_finalnote_R()
+    mono_score_label = ustobj2songobj(ust, d_table).as_mono()
+    mono_align_label = generate_mono_align_label(rng, mono_score_label)
+    mono_align_label.write(join(out_dir, f'{songname}.lab'))
+
+    # WAVはラベルより0.5秒長くする。
+    duration_sec = mono_align_label[-1].end / 10000000 + 0.5
+    write_noise_wav(
+        join(out_dir, f'{songname}.wav'), duration_sec, sample_rate, rng.getrandbits(32)
+    )
+
+
+def main(out_dir, num_songs: int, sample_rate=48000, seed=0, path_table=DEFAULT_TABLE_PATH):
+    """
+    num_songs 曲分の UST・LAB・WAV を out_dir に生成する。
+    """
+    makedirs(out_dir, exist_ok=True)
+    d_table = up.table.load(path_table, encoding='utf-8')
+    lyrics = [lyric for lyric in d_table if lyric not in SPECIAL_LYRICS]
+    print(f'Generating {num_songs} synthetic songs in {out_dir}')
+    for i in tqdm(range(num_songs), colour='blue'):
+        generate_song(f'song{i:04d}', out_dir, d_table, lyrics, sample_rate, seed)
+
+
+if __name__ == '__main__':
+    args = argv[1:]
+    main(args[0], int(args[1]), sample_rate=int(args[2]) if len(args) > 2 else 48000)